@@ -27,6 +27,7 @@
         "security/cx_tower_plan_line_security.xml",
         "security/cx_tower_plan_line_action_security.xml",
         "security/cx_tower_plan_log_security.xml",
+        "security/cx_tower_plan_fleet_log_security.xml",
         "security/cx_tower_server_log_security.xml",
         "security/cx_tower_command_log_security.xml",
         "security/cx_tower_server_template_security.xml",
@@ -47,6 +48,7 @@
         "views/cx_tower_plan_line_view.xml",
         "views/cx_tower_command_log_view.xml",
         "views/cx_tower_plan_log_view.xml",
+        "views/cx_tower_plan_fleet_log_view.xml",
         "views/cx_tower_key_view.xml",
         "views/cx_tower_file_view.xml",
         "views/cx_tower_file_template_view.xml",
@@ -3,6 +3,7 @@
 from . import cx_tower_variable_mixin
 from . import cx_tower_template_mixin
 from . import cx_tower_access_mixin
+from . import cx_tower_heartbeat_mixin
 from . import cx_tower_reference_mixin
 from . import cx_tower_key_mixin
 from . import cx_tower_variable
@@ -15,10 +16,12 @@ from . import cx_tower_tag
 from . import cx_tower_command
 from . import cx_tower_key
 from . import cx_tower_command_log
+from . import cx_tower_command_log_chunk
 from . import cx_tower_plan
 from . import cx_tower_plan_line
 from . import cx_tower_plan_line_action
 from . import cx_tower_plan_log
+from . import cx_tower_plan_fleet_log
 from . import cx_tower_server_log
 from . import cx_tower_server_template
 from . import cetmix_tower
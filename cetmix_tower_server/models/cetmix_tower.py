@@ -1,10 +1,13 @@
 # Copyright (C) 2024 Cetmix OÜ
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+from functools import partial
+
 from odoo import _, api, models
 from odoo.exceptions import ValidationError
 
 from .constants import SSH_CONNECTION_ERROR, SSH_CONNECTION_TIMEOUT
 from .cx_tower_server import SSH
+from .ssh_host_keys import SSH_HOST_KEYS
 
 
 class CetmixTower(models.AbstractModel):
@@ -138,12 +141,17 @@ class CetmixTower(models.AbstractModel):
             "port": int(server.ssh_port),
             "timeout": timeout,
             "mode": server.ssh_auth_mode,
+            "host_keys": server._get_ssh_host_keys(),
+            "on_new_host_key": partial(
+                SSH_HOST_KEYS.add, self.env.cr.dbname, server.id
+            ),
         }
 
         if server.ssh_auth_mode == "p":
             ssh_params["password"] = server.ssh_password
         elif server.ssh_auth_mode == "k":
             ssh_params["ssh_key"] = server.ssh_key_id.sudo().secret_value
+            ssh_params["ssh_key_id"] = server.ssh_key_id.id
 
         # Initialize SSH connection instance
         ssh_connection = SSH(**ssh_params)
@@ -180,6 +188,7 @@ class CetmixTower(models.AbstractModel):
                     }
             finally:
                 ssh_connection.disconnect()
+                server._save_ssh_host_keys()
 
         # If all attempts fail
         return {
@@ -0,0 +1,496 @@
+# Copyright (C) 2024 Cetmix OÜ
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+import codecs
+import collections
+import gzip
+import re
+import tempfile
+import time
+
+# Default output streaming settings.
+# Can be overridden using the following system parameters:
+#   - cetmix_tower_server.command_output_flush_interval
+#   - cetmix_tower_server.command_output_buffer_size
+COMMAND_OUTPUT_FLUSH_INTERVAL = 5
+COMMAND_OUTPUT_BUFFER_SIZE = 65536
+
+# Output saved to the log is rewritten each time new output is appended.
+# Each flush must add at least this share of the output saved before
+# so the amount of data written grows linearly with the output size.
+COMMAND_OUTPUT_GROWTH_RATIO = 0.25
+
+# Size of a single chunk read from the SSH channel
+COMMAND_OUTPUT_CHUNK_SIZE = 32768
+
+# Inserted between the head and the tail of a truncated output
+COMMAND_OUTPUT_SKIPPED_MARKER = "\n\n... {} characters skipped ...\n\n"
+
+
+class OutputLimiter(object):
+    """
+    Keeps the head and the tail of the output and drops the rest.
+    Head and tail sizes as well as the total output size are counted
+    in UTF-8 bytes. Symbols are never split so a kept part
+    can be a few bytes shorter than its limit.
+    Full output can be saved into a compressed temporary file.
+    """
+
+    def __init__(self, head_size=None, tail_size=None, keep_full=False):
+        """
+        Args:
+            head_size (Int, optional): number of bytes to keep
+                from the beginning of the output. Output is not limited if None.
+            tail_size (Int, optional): number of bytes to keep
+                from the end of the output.
+            keep_full (bool, optional): save full output into
+                a compressed temporary file. Defaults to False.
+        """
+        self.head_size = head_size
+        self.tail_size = tail_size or 0
+        self.size = 0
+        self.line_count = 0
+        self.skipped = 0
+        self._head_left = head_size
+        # (text, size in bytes)
+        self._tail = collections.deque()
+        self._tail_length = 0
+        self._ends_with_newline = True
+        self._full_file = None
+        self._full_output = None
+        if keep_full and head_size is not None:
+            self._full_file = tempfile.SpooledTemporaryFile(
+                max_size=COMMAND_OUTPUT_BUFFER_SIZE
+            )
+            self._full_output = gzip.GzipFile(fileobj=self._full_file, mode="wb")
+
+    def feed(self, text):
+        """Process the next part of the output.
+
+        Args:
+            text (Text): output part
+
+        Returns:
+            Text: part of the output that should be saved right now
+        """
+        if not text:
+            return text
+        data = text.encode("utf-8", "replace")
+        self.size += len(data)
+        self.line_count += text.count("\n")
+        self._ends_with_newline = text.endswith("\n")
+        if self.head_size is None:
+            return text
+        if self._full_output:
+            self._full_output.write(data)
+
+        if len(data) <= self._head_left:
+            self._head_left -= len(data)
+            return text
+        head = data[: self._head_left].decode("utf-8", "ignore")
+        # Symbol that does not fit goes to the tail with the rest of the output
+        self._head_left = 0
+        self._add_to_tail(text[len(head) :], len(data) - len(head.encode("utf-8")))
+        return head
+
+    def _add_to_tail(self, text, size):
+        """Keep the last `tail_size` bytes of the output
+
+        Args:
+            text (Text): output part
+            size (Int): size of the text in bytes
+        """
+        self._tail.append((text, size))
+        self._tail_length += size
+        while self._tail and self._tail_length > self.tail_size:
+            extra = self._tail_length - self.tail_size
+            first, first_size = self._tail[0]
+            if first_size <= extra:
+                self._tail.popleft()
+                self._tail_length -= first_size
+                self.skipped += len(first)
+            else:
+                kept = first.encode("utf-8", "replace")[extra:]
+                kept = kept.decode("utf-8", "ignore")
+                kept_size = len(kept.encode("utf-8"))
+                self._tail[0] = (kept, kept_size)
+                self._tail_length -= first_size - kept_size
+                self.skipped += len(first) - len(kept)
+
+    def finish(self):
+        """Get the rest of the output to save when output is complete.
+
+        Returns:
+            Text: skipped marker followed by the output tail
+        """
+        if self.size and not self._ends_with_newline:
+            self.line_count += 1
+            self._ends_with_newline = True
+        tail = "".join(text for text, _size in self._tail)
+        self._tail.clear()
+        self._tail_length = 0
+        if self.skipped:
+            return COMMAND_OUTPUT_SKIPPED_MARKER.format(self.skipped) + tail
+        return tail
+
+    def limit(self, text):
+        """Limit complete output.
+
+        Args:
+            text (Text): complete output
+
+        Returns:
+            Text: limited output
+        """
+        if not isinstance(text, str):
+            return text
+        return self.feed(text) + self.finish()
+
+    def get_full_output(self):
+        """Get full output compressed with gzip.
+        Temporary file is closed after this.
+
+        Returns:
+            Bytes: compressed output or None if full output is not kept
+        """
+        if not self._full_output:
+            return None
+        self._full_output.close()
+        self._full_file.seek(0)
+        data = self._full_file.read()
+        self._full_file.close()
+        self._full_output = self._full_file = None
+        return data
+
+
+class SecretScrubber(object):
+    """
+    Replaces secrets in text with a placeholder.
+
+    All secrets are searched at once using a single compiled pattern
+    so text is scanned only once regardless of the number of secrets.
+    Longer secrets are preferred when several secrets start
+    at the same position.
+    """
+
+    def __init__(self, secrets, replacement):
+        """
+        Args:
+            secrets (list of Text): values to replace. Empty ones are ignored.
+            replacement (Text): text to put instead of secrets
+        """
+        self.secrets = sorted(
+            {secret for secret in secrets if secret}, key=len, reverse=True
+        )
+        self.replacement = replacement
+        # Backslashes are special in `re.sub()` replacement
+        self._escaped_replacement = replacement.replace("\\", "\\\\")
+        self.max_length = len(self.secrets[0]) if self.secrets else 0
+        # Longest secret is tried first at each position
+        self._pattern = (
+            re.compile("|".join(re.escape(secret) for secret in self.secrets))
+            if self.secrets
+            else None
+        )
+
+    def scrub(self, text):
+        """Replace secrets in complete text.
+
+        Args:
+            text (Text): text to clean
+
+        Returns:
+            Text: cleaned text
+        """
+        if not (text and self._pattern):
+            return text
+        return self._pattern.sub(self._escaped_replacement, text)
+
+    def stream(self):
+        """Get scrubber for text received in chunks.
+
+        Returns:
+            SecretScrubberStream: stream scrubber
+        """
+        return SecretScrubberStream(self)
+
+
+class SecretScrubberStream(object):
+    """
+    Replaces secrets in text received in chunks.
+
+    Last `max_length - 1` characters of a chunk are kept
+    and are processed together with the next chunk.
+    Any secret starting before them is fully contained in the text,
+    so secrets split between chunks are replaced the same way
+    as if the whole text was received at once.
+    """
+
+    def __init__(self, scrubber):
+        """
+        Args:
+            scrubber (SecretScrubber): scrubber holding the secrets
+        """
+        self.scrubber = scrubber
+        self._carry = ""
+
+    def feed(self, text):
+        """Process the next chunk.
+
+        Args:
+            text (Text): output chunk
+
+        Returns:
+            Text: cleaned text that is safe to save right now
+        """
+        scrubber = self.scrubber
+        if not scrubber._pattern:
+            return text
+        text = self._carry + (text or "")
+        # Secrets starting before this position cannot be changed by more text
+        safe_end = len(text) - scrubber.max_length + 1
+        result = []
+        position = 0
+        for match in scrubber._pattern.finditer(text):
+            if match.start() >= safe_end:
+                break
+            result.append(text[position : match.start()])
+            result.append(scrubber.replacement)
+            position = match.end()
+        end = max(position, safe_end)
+        result.append(text[position:end])
+        self._carry = text[end:]
+        return "".join(result)
+
+    def finish(self):
+        """Process the rest of the text when output is complete.
+
+        Returns:
+            Text: cleaned text
+        """
+        text, self._carry = self._carry, ""
+        return self.scrubber.scrub(text)
+
+
+class CommandOutputCollector(object):
+    """
+    Collects command output while the command is running.
+
+    Output is kept in a bounded buffer which is flushed
+    using the provided function when the buffer is full
+    or when the flush interval is reached.
+    Buffer grows together with the saved output, so large outputs
+    are flushed in larger chunks.
+    Only complete lines are flushed unless the buffer is full.
+    Secrets split between two flushes are replaced by the scrubber.
+    """
+
+    def __init__(
+        self,
+        flush,
+        flush_interval=COMMAND_OUTPUT_FLUSH_INTERVAL,
+        buffer_size=COMMAND_OUTPUT_BUFFER_SIZE,
+        scrubber=None,
+        limiters=None,
+        on_finish=None,
+    ):
+        """
+        Args:
+            flush (callable): function that saves output.
+                Called with `response` and `error` text arguments.
+            flush_interval (Int, optional): seconds between flushes
+            buffer_size (Int, optional): max number of characters
+                kept in memory
+            scrubber (SecretScrubber, optional): removes secrets
+                from text before it is flushed.
+            limiters (dict, optional): {"response": OutputLimiter(),
+                "error": OutputLimiter()} limiters applied to cleaned text.
+            on_finish (callable, optional): function called with `limiters`
+                after the final flush.
+        """
+        self._flush = flush
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self._scrubbers = (
+            {"response": scrubber.stream(), "error": scrubber.stream()}
+            if scrubber
+            else {}
+        )
+        self.limiters = limiters or {}
+        self._on_finish = on_finish
+        self._buffers = {"response": [], "error": []}
+        self._decoders = {
+            "response": codecs.getincrementaldecoder("utf-8")("replace"),
+            "error": codecs.getincrementaldecoder("utf-8")("replace"),
+        }
+        self._size = 0
+        self._last_flush = time.monotonic()
+        self.flush_count = 0
+        self.saved_size = 0
+
+    def add_response(self, data):
+        """Add data received from stdout.
+
+        Args:
+            data (Bytes, Text): output chunk
+        """
+        self._add("response", data)
+
+    def add_error(self, data):
+        """Add data received from stderr.
+
+        Args:
+            data (Bytes, Text): output chunk
+        """
+        self._add("error", data)
+
+    def _add(self, stream, data):
+        if isinstance(data, bytes):
+            data = self._decoders[stream].decode(data)
+        if not data:
+            return
+        self._buffers[stream].append(data)
+        self._size += len(data)
+        if self._size >= max(self.buffer_size, self._get_min_flush_size()):
+            self.flush(partial=True)
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        """Flush output if the flush interval is reached
+        and enough output is collected.
+        """
+        if (
+            time.monotonic() - self._last_flush >= self.flush_interval
+            and self._size >= self._get_min_flush_size()
+        ):
+            self.flush()
+
+    def _get_min_flush_size(self):
+        """Get minimum number of characters saved at once.
+
+        Returns:
+            Int: number of characters
+        """
+        return int(self.saved_size * COMMAND_OUTPUT_GROWTH_RATIO)
+
+    def flush(self, partial=False, final=False):
+        """Save collected output.
+
+        Args:
+            partial (bool, optional): flush incomplete lines too.
+                Defaults to False.
+            final (bool, optional): command is finished.
+                Flush everything that is left. Defaults to False.
+        """
+        if final:
+            for stream, decoder in self._decoders.items():
+                tail = decoder.decode(b"", final=True)
+                if tail:
+                    self._buffers[stream].append(tail)
+
+        values = {}
+        for stream, buffer in self._buffers.items():
+            text = "".join(buffer)
+            if not (partial or final):
+                # Keep incomplete line in the buffer
+                position = text.rfind("\n") + 1
+                text, rest = text[:position], text[position:]
+                self._buffers[stream] = [rest] if rest else []
+            else:
+                self._buffers[stream] = []
+            scrubber = self._scrubbers.get(stream)
+            if scrubber:
+                text = scrubber.feed(text)
+                if final:
+                    text += scrubber.finish()
+            limiter = self.limiters.get(stream)
+            if limiter:
+                text = limiter.feed(text)
+                if final:
+                    text = (text or "") + limiter.finish()
+            values[stream] = text or None
+
+        self._size = sum(
+            len(part) for buffer in self._buffers.values() for part in buffer
+        )
+        self._last_flush = time.monotonic()
+        if values["response"] or values["error"]:
+            self._flush(**values)
+            self.flush_count += 1
+            self.saved_size += sum(len(text) for text in values.values() if text)
+        if final and self._on_finish:
+            self._on_finish(self.limiters)
+
+
+class StatusMarkerFilter(object):
+    """
+    Passes command output to the collector and takes out the lines
+    with exit codes that commands run in a single session print to stderr.
+    Text that can be the beginning of a marker is kept
+    until more output is received.
+    """
+
+    def __init__(self, output_collector, status_marker):
+        """
+        Args:
+            output_collector (CommandOutputCollector): collector
+                that receives the output without status lines
+            status_marker (Char): marker used to report exit codes
+        """
+        self.output_collector = output_collector
+        self.status_marker = status_marker
+        self.status_lines = []
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._carry = ""
+
+    def add_response(self, data):
+        """Add data received from stdout.
+
+        Args:
+            data (Bytes, Text): output chunk
+        """
+        self.output_collector.add_response(data)
+
+    def add_error(self, data):
+        """Add data received from stderr.
+
+        Args:
+            data (Bytes, Text): output chunk
+        """
+        if isinstance(data, bytes):
+            data = self._decoder.decode(data)
+        text = self._carry + data
+        position = text.rfind("\n") + 1
+        text, rest = text[:position], text[position:]
+        # Keep incomplete status line or what can be the start of a marker
+        marker_position = rest.find(self.status_marker)
+        if marker_position < 0:
+            marker_position = max(len(rest) - len(self.status_marker) + 1, 0)
+        self._carry = rest[marker_position:]
+        self._add_error(text + rest[:marker_position])
+
+    def _add_error(self, text):
+        """Pass stderr text without status lines to the collector"""
+        clean = []
+        for line in text.splitlines(keepends=True):
+            position = line.find(self.status_marker)
+            if position < 0:
+                clean.append(line)
+                continue
+            self.status_lines.append(line[position:])
+            # Command output may not end with a new line
+            if position:
+                clean.append(line[:position])
+        if clean:
+            self.output_collector.add_error("".join(clean))
+
+    def flush_if_due(self):
+        """Flush collected output if the flush interval is reached"""
+        self.output_collector.flush_if_due()
+
+    def finish(self):
+        """Process the rest of stderr when output is complete"""
+        text = self._carry + self._decoder.decode(b"", final=True)
+        self._carry = ""
+        if text:
+            self._add_error(text)
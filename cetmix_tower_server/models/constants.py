@@ -33,6 +33,18 @@ PLAN_LINE_CONDITION_CHECK_FAILED = -20
 # Returned when the command failed to execute due to a python code execution error
 PYTHON_COMMAND_ERROR = -24
 
+# Returned when a running flight plan stopped reporting heartbeats,
+# eg because the worker running it was killed
+PLAN_INTERRUPTED = -25
+
+# Returned when a running command stopped reporting heartbeats,
+# eg because the worker running it was killed
+COMMAND_INTERRUPTED = -26
+
+# Returned when a line of a parallel group failed with an error
+# before its command was finished
+PLAN_LINE_FAILED = -27
+
 # Returned when an SSH connection error occurs
 SSH_CONNECTION_ERROR = 503
 
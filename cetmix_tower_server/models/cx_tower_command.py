@@ -155,6 +155,34 @@ class CxTowerCommand(models.Model):
         column1="command_id",
         column2="variable_id",
     )
+    # ---- Command output
+    output_policy = fields.Selection(
+        selection=[
+            ("server", "Server Settings"),
+            ("full", "Keep Full Output"),
+            ("limit", "Keep Head and Tail"),
+        ],
+        default="server",
+        required=True,
+        help="How command output is saved in the command log. "
+        "'Server Settings' uses the output policy of the server "
+        "the command is run on",
+    )
+    output_head_kb = fields.Integer(
+        string="Output Head, KB",
+        default=64,
+        help="Amount of output kept from the beginning",
+    )
+    output_tail_kb = fields.Integer(
+        string="Output Tail, KB",
+        default=64,
+        help="Amount of output kept from the end",
+    )
+    output_attachment = fields.Boolean(
+        string="Save Full Output",
+        help="Save full output as a compressed attachment of the command log "
+        "when the output is truncated",
+    )
 
     @classmethod
     def _get_depends_fields(cls):
@@ -185,6 +213,81 @@ class CxTowerCommand(models.Model):
     def _compute_secret_ids(self):
         return super()._compute_secret_ids()
 
+    def _get_output_policy(self, server):
+        """Get command output policy.
+
+        Args:
+            server (cx.tower.server()): server the command is run on
+
+        Returns:
+            dict: `OutputLimiter` arguments. Empty if output is not limited.
+        """
+        self.ensure_one()
+        source = server if self.output_policy == "server" else self
+        if source.output_policy != "limit":
+            return {}
+        return {
+            "head_size": max(source.output_head_kb, 0) * 1024,
+            "tail_size": max(source.output_tail_kb, 0) * 1024,
+            "keep_full": source.output_attachment,
+        }
+
+    def render_for_servers(self, servers, path=None):
+        """Render command code and path for several servers at once.
+        Variable values of all servers are fetched together.
+
+        Args:
+            servers (cx.tower.server()): servers to render the command for
+            path (Char, optional): Path where to execute the command.
+                Provide in case you need to override default command path
+
+        Returns:
+            dict: {server_id: {
+                    "rendered_code": rendered command code,
+                    "rendered_path": rendered command path
+                }}
+        """
+        self.ensure_one()
+
+        # Get variables from code and path.
+        # Stored variable references are used unless path is overridden.
+        path = path if path else self.path
+        variables = self._get_variable_references(self.code, self.path)
+        if path and path != self.path:
+            for ve in self.get_variables_from_code(path):
+                if ve not in variables:
+                    variables.append(ve)
+
+        # Get variable values for all servers
+        variable_values_dict = (
+            servers.get_variable_values(variables) if variables else {}
+        )
+
+        res = {}
+        for server in servers:
+            variable_values = variable_values_dict.get(server.id)
+
+            # Render command code using variables
+            if variable_values:
+                if self.action == "python_code":
+                    variable_values["pythonic_mode"] = True
+                rendered_code = (
+                    self.render_code_custom(self.code, **variable_values)
+                    if self.code
+                    else False
+                )
+                rendered_path = (
+                    self.render_code_custom(path, **variable_values) if path else False
+                )
+            else:
+                rendered_code = self.code
+                rendered_path = path
+            res[server.id] = {
+                "rendered_code": rendered_code,
+                "rendered_path": rendered_path,
+            }
+        return res
+
     @api.depends("action")
     def _compute_code(self):
         """
@@ -1,10 +1,19 @@
 # Copyright (C) 2022 Cetmix OÜ
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
-from odoo import api, fields, models
+from odoo import _, api, fields, models
+
+from .command_output import (
+    COMMAND_OUTPUT_BUFFER_SIZE,
+    COMMAND_OUTPUT_FLUSH_INTERVAL,
+    CommandOutputCollector,
+    OutputLimiter,
+)
+from .constants import COMMAND_INTERRUPTED
 
 
 class CxTowerCommandLog(models.Model):
     _name = "cx.tower.command.log"
+    _inherit = ["cx.tower.heartbeat.mixin"]
     _description = "Cetmix Tower Command Log"
     _order = "start_date desc, id desc"
 
@@ -39,6 +48,29 @@ class CxTowerCommandLog(models.Model):
     command_status = fields.Integer(string="Exit Code")
     command_response = fields.Text(string="Response")
     command_error = fields.Text(string="Error")
+    command_output_live = fields.Text(
+        string="Live Output",
+        compute="_compute_command_output_live",
+        help="Output saved while the command is running",
+    )
+    output_size = fields.Integer(
+        string="Output Size, bytes", help="Total size of the command output"
+    )
+    output_line_count = fields.Integer(
+        string="Output Lines", help="Total number of lines in the command output"
+    )
+    is_output_truncated = fields.Boolean(
+        string="Output Truncated",
+        help="Only the beginning and the end of the output are kept",
+    )
+    output_attachment_ids = fields.Many2many(
+        comodel_name="ir.attachment",
+        relation="cx_tower_command_log_attachment_rel",
+        column1="command_log_id",
+        column2="attachment_id",
+        string="Full Output",
+        help="Full command output compressed with gzip",
+    )
     use_sudo = fields.Selection(
         string="Use sudo",
         selection=[("n", "Without password"), ("p", "With password")],
@@ -86,6 +118,27 @@ class CxTowerCommandLog(models.Model):
             else:
                 command_log.duration_current = command_log.duration
 
+    def _compute_command_output_live(self):
+        """Compose output of running commands from the saved chunks"""
+        output = {}
+        running_ids = [rec.id for rec in self if rec.is_running and rec.id]
+        if running_ids:
+            self.env.cr.execute(
+                """
+                SELECT command_log_id, string_agg(
+                    COALESCE(command_response, '') || COALESCE(command_error, ''),
+                    '' ORDER BY id
+                )
+                FROM cx_tower_command_log_chunk
+                WHERE command_log_id IN %s
+                GROUP BY command_log_id
+                """,
+                (tuple(running_ids),),
+            )
+            output = dict(self.env.cr.fetchall())
+        for rec in self:
+            rec.command_output_live = output.get(rec.id, False)
+
     def start(self, server_id, command_id, start_date=None, **kwargs):
         """Creates initial log record when command is started
 
@@ -97,11 +150,13 @@ class CxTowerCommandLog(models.Model):
         Returns:
             (cx.tower.command.log()) new command log record or False
         """
+        now = fields.Datetime.now()
         vals = {
             "server_id": server_id,
             "command_id": command_id,
             "is_running": True,
-            "start_date": start_date if start_date else fields.Datetime.now(),
+            "start_date": start_date if start_date else now,
+            "heartbeat_date": now,
         }
         # Apply kwargs
         vals.update(kwargs)
@@ -117,8 +172,12 @@ class CxTowerCommandLog(models.Model):
             log_record (cx.tower.command.log()): Log record
             finish_date (Datetime): command finish date time.
             **kwargs (dict): optional values
+        Context:
+            command_output_streamed (Bool): output is already saved
+                while command was running. Response and error are not updated.
         """
         now = fields.Datetime.now()
+        output_streamed = self._context.get("command_output_streamed")
 
         for rec in self.sudo():
             # Duration
@@ -128,12 +187,21 @@ class CxTowerCommandLog(models.Model):
                 "is_running": False,
                 "finish_date": date_finish,
                 "command_status": -1 if status is None else status,
-                "command_response": response,
-                "command_error": error,
             }
+            if not output_streamed:
+                limiters = rec._get_output_limiters()
+                vals.update(
+                    {
+                        "command_response": limiters["response"].limit(response),
+                        "command_error": limiters["error"].limit(error),
+                    }
+                )
+                vals.update(rec._get_output_values(limiters))
             # Apply kwargs and write
             vals.update(kwargs)
             rec.write(vals)
+            if output_streamed:
+                rec._clear_live_output()
 
             # Trigger post finish hook
             rec._command_finished()
@@ -179,6 +247,219 @@ class CxTowerCommandLog(models.Model):
         rec._command_finished()
         return rec
 
+    def _append_output(self, response=None, error=None):
+        """Append command output to the log while command is running.
+        SQL is used to avoid reading the whole output back into memory.
+        Output is saved in the current transaction and is duplicated
+        as a live output chunk visible to other transactions.
+
+        Args:
+            response (Text, optional): response to append
+            error (Text, optional): error to append
+        """
+        self.ensure_one()
+        self.flush(["command_response", "command_error"])
+        self.env.cr.execute(
+            """
+            UPDATE cx_tower_command_log
+            SET command_response = CASE WHEN %(response)s IS NULL
+                    THEN command_response
+                    ELSE COALESCE(command_response, '') || %(response)s END,
+                command_error = CASE WHEN %(error)s IS NULL
+                    THEN command_error
+                    ELSE COALESCE(command_error, '') || %(error)s END
+            WHERE id = %(id)s
+            """,
+            {"response": response or None, "error": error or None, "id": self.id},
+        )
+        self.invalidate_cache(["command_response", "command_error"], self.ids)
+        self._save_live_output(response, error)
+
+    def _save_live_output(self, response=None, error=None):
+        """Save output chunk in a separate transaction
+        so it can be seen while the command is running.
+        Nothing is saved if the log is not committed yet
+        because it cannot be seen by other transactions anyway.
+        Log record itself is never updated here so the final write
+        of the transaction running the command does not conflict with it.
+
+        Args:
+            response (Text, optional): response to save
+            error (Text, optional): error to save
+        """
+        self.ensure_one()
+        if not (response or error):
+            return
+        with self.pool.cursor() as cr:
+            cr.execute(
+                """
+                INSERT INTO cx_tower_command_log_chunk
+                    (command_log_id, command_response, command_error)
+                SELECT id, %(response)s, %(error)s
+                FROM cx_tower_command_log
+                WHERE id = %(id)s
+                """,
+                {"response": response or None, "error": error or None, "id": self.id},
+            )
+
+    def _clear_live_output(self):
+        """Remove output chunks saved while the command was running.
+        Chunks are committed by other transactions so they are removed
+        the same way.
+        """
+        if not self.ids:
+            return
+        with self.pool.cursor() as cr:
+            cr.execute(
+                "DELETE FROM cx_tower_command_log_chunk WHERE command_log_id IN %s",
+                (tuple(self.ids),),
+            )
+
+    @api.model
+    def _reap_stale_runs(self):
+        # Remove chunks left by commands whose final transaction failed
+        self.env.cr.execute(
+            """
+            DELETE FROM cx_tower_command_log_chunk chunk
+            USING cx_tower_command_log log
+            WHERE log.id = chunk.command_log_id AND NOT log.is_running
+            """
+        )
+        return super()._reap_stale_runs()
+
+    def _get_output_collector(self, key_values=None):
+        """Get collector that saves command output into this log record.
+
+        Args:
+            key_values (list, optional): secrets to remove from output
+
+        Returns:
+            CommandOutputCollector: output collector
+        """
+        self.ensure_one()
+        get_param = self.env["ir.config_parameter"].sudo().get_param
+        key_model = self.env["cx.tower.key"]
+        return CommandOutputCollector(
+            self._append_output,
+            flush_interval=float(
+                get_param(
+                    "cetmix_tower_server.command_output_flush_interval",
+                    COMMAND_OUTPUT_FLUSH_INTERVAL,
+                )
+            ),
+            buffer_size=int(
+                get_param(
+                    "cetmix_tower_server.command_output_buffer_size",
+                    COMMAND_OUTPUT_BUFFER_SIZE,
+                )
+            ),
+            scrubber=(
+                key_model._get_secret_scrubber(key_values) if key_values else None
+            ),
+            limiters=self._get_output_limiters(),
+            on_finish=self._output_finished,
+        )
+
+    def _get_output_limiters(self):
+        """Get output limiters according to the command output policy.
+
+        Returns:
+            dict: {"response": OutputLimiter(), "error": OutputLimiter()}
+        """
+        self.ensure_one()
+        policy = self.command_id._get_output_policy(self.server_id)
+        return {
+            "response": OutputLimiter(**policy),
+            "error": OutputLimiter(**policy),
+        }
+
+    def _get_output_values(self, limiters):
+        """Compose output statistics values.
+        Saves full output as attachments if output was truncated.
+
+        Args:
+            limiters (dict): {"response": OutputLimiter(),
+                "error": OutputLimiter()}
+
+        Returns:
+            dict: values to write
+        """
+        self.ensure_one()
+        attachment_obj = self.env["ir.attachment"].sudo()
+        attachment_ids = []
+        for stream, limiter in limiters.items():
+            full_output = limiter.get_full_output()
+            if full_output and limiter.skipped:
+                attachment = attachment_obj.create(
+                    {
+                        "name": f"command_log_{self.id}_{stream}.txt.gz",
+                        "raw": full_output,
+                        "mimetype": "application/gzip",
+                        "res_model": self._name,
+                        "res_id": self.id,
+                    }
+                )
+                attachment_ids.append((4, attachment.id))
+        values = {
+            "output_size": sum(limiter.size for limiter in limiters.values()),
+            "output_line_count": sum(
+                limiter.line_count for limiter in limiters.values()
+            ),
+            "is_output_truncated": any(
+                limiter.skipped for limiter in limiters.values()
+            ),
+        }
+        if attachment_ids:
+            values["output_attachment_ids"] = attachment_ids
+        return values
+
+    def _output_finished(self, limiters):
+        """Save output statistics when streamed output is complete.
+
+        Args:
+            limiters (dict): {"response": OutputLimiter(),
+                "error": OutputLimiter()}
+        """
+        self.sudo().write(self._get_output_values(limiters))
+
+    # Check cx.tower.heartbeat.mixin for the function documentation
+    def _get_heartbeat_runs(self):
+        # Flight plans are not considered interrupted while their commands run
+        plan_logs = self.env["cx.tower.plan.log"]
+        plan_log = self.sudo().plan_log_id
+        while plan_log:
+            plan_logs |= plan_log
+            plan_log = plan_log.parent_flight_plan_log_id
+        runs = super()._get_heartbeat_runs()
+        if plan_logs:
+            runs.append(plan_logs)
+        return runs
+
+    # Check cx.tower.heartbeat.mixin for the function documentation
+    def _get_alive_run_ids(self):
+        # Command that runs a flight plan is alive while the plan is alive
+        plan_commands = self.filtered("triggered_plan_log_id")
+        if not plan_commands:
+            return set()
+        alive_plan_ids = self.env["cx.tower.plan.log"]._get_alive_plan_log_ids()
+        return {
+            command_log.id
+            for command_log in plan_commands
+            if command_log.triggered_plan_log_id.id in alive_plan_ids
+        }
+
+    # Check cx.tower.heartbeat.mixin for the function documentation
+    def _get_interrupted_run_values(self):
+        # Finish hooks are not triggered so flight plans are not continued
+        values = super()._get_interrupted_run_values()
+        values.update(
+            {
+                "command_status": COMMAND_INTERRUPTED,
+                "command_error": _("Command was interrupted"),
+            }
+        )
+        return values
+
     def _command_finished(self):
         """Triggered when command is finished
         Inherit to implement your own hooks
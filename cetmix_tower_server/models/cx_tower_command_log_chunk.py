@@ -0,0 +1,25 @@
+# Copyright (C) 2024 Cetmix OÜ
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+from odoo import fields, models
+
+
+class CxTowerCommandLogChunk(models.Model):
+    """Command output saved while the command is running.
+    Chunks are inserted using separate transactions so the output
+    is visible before the transaction running the command is committed.
+    They are removed once the command is finished.
+    """
+
+    _name = "cx.tower.command.log.chunk"
+    _description = "Cetmix Tower Command Log Output Chunk"
+    _order = "id"
+    _log_access = False
+
+    command_log_id = fields.Many2one(
+        comodel_name="cx.tower.command.log",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    command_response = fields.Text(string="Response")
+    command_error = fields.Text(string="Error")
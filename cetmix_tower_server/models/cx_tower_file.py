@@ -8,6 +8,8 @@ from odoo import _, api, fields, models
 from odoo.exceptions import AccessError, UserError, ValidationError
 from odoo.tools import exception_to_unicode
 
+from .cx_tower_server import SSH
+
 # mapping of field names from template and field names from file
 TEMPLATE_FILE_FIELD_MAPPING = {
     "code": "code",
@@ -191,12 +193,8 @@ class CxTowerFile(models.Model):
         Compute file name, directory and code
         """
         for file in self:
-            variables = list(
-                set(
-                    file.get_variables_from_code(file.name)
-                    + file.get_variables_from_code(file.server_dir)
-                    + file.get_variables_from_code(file.code)
-                )
+            variables = file._get_variable_references(
+                file.name, file.server_dir, file.code
             )
             render_code_custom = file.render_code_custom
             var_vals = file.server_id.get_variable_values(variables).get(
@@ -507,6 +505,7 @@ class CxTowerFile(models.Model):
         self,
         tower_key_obj,
         is_server_code_version_process=False,
+        ssh_connection=None,
     ):
         """
         Processing of file download.
@@ -519,6 +518,7 @@ class CxTowerFile(models.Model):
             is_server_code_version_process (bool):
                 Flag to fetch actual file content from server
                 for a `tower` type file.
+            ssh_connection (SSH client instance, optional): SSH connection to reuse.
 
         Returns:
             [dict|str|None]:
@@ -530,6 +530,7 @@ class CxTowerFile(models.Model):
         self.ensure_one()
         code = self.server_id.download_file(
             tower_key_obj._parse_code(self.full_server_path),
+            ssh_connection=ssh_connection,
         )
         if self.file_type == "text" and b"\x00" in code:
             return {
@@ -554,6 +555,44 @@ class CxTowerFile(models.Model):
         else:
             self.code = code
 
+    def _process_upload(self, tower_key_obj, ssh_connection=None):
+        """
+        Processing of file upload.
+
+        Args:
+            tower_key_obj (RecordSet): `cx.tower.key`
+                recordset to parse file code and path.
+            ssh_connection (SSH client instance, optional): SSH connection to reuse.
+        """
+        self.ensure_one()
+        if self.file_type == "binary":
+            file_content = b64decode(self.file)
+        else:
+            file_content = tower_key_obj._parse_code(self.rendered_code)
+        self.server_id.upload_file(
+            file_content,
+            tower_key_obj._parse_code(self.full_server_path),
+            ssh_connection=ssh_connection,
+        )
+
+    def _get_ssh_connection(self, ssh_connections):
+        """
+        Get SSH connection for the file server.
+        Connection is opened once per server and stored in `ssh_connections`.
+
+        Args:
+            ssh_connections (dict): {cx.tower.server(): SSH()} connections
+                opened so far.
+
+        Returns:
+            SSH: SSH client
+        """
+        self.ensure_one()
+        server = self.server_id
+        if server not in ssh_connections:
+            ssh_connections[server] = server._connect(raise_on_error=False)
+        return ssh_connections[server]
+
     def _process(self, action, raise_error=False):
         """Upload or download file to/from server.
         Important!
@@ -589,75 +628,79 @@ class CxTowerFile(models.Model):
         is_server_code_version_process = self.env.context.get(
             "is_server_code_version_process"
         )
-        for file in self:
-            if not is_server_code_version_process and (
-                (action == "download" and file.source != "server")
-                or (action == "upload" and file.source != "tower")
-                or (action == "delete" and file.source != "tower")
-            ):
-                if raise_error:
-                    raise UserError(
-                        _(
-                            "File %(f)s shouldn't have the '%(src)s' source "
-                            " for the '%(act)s' action",
-                            f=file.name,
-                            src=file.source,
-                            act=action,
-                        )
-                    )
-                return False
-
-            if action == "delete":
-                try:
-                    file.check_access_rights("unlink")
-                    file.check_access_rule("unlink")
-                except AccessError as e:
+        ssh_connections = {}
+        try:
+            for file in self:
+                if not is_server_code_version_process and (
+                    (action == "download" and file.source != "server")
+                    or (action == "upload" and file.source != "tower")
+                    or (action == "delete" and file.source != "tower")
+                ):
                     if raise_error:
-                        raise AccessError(
+                        raise UserError(
                             _(
-                                "Due to security restrictions you are "
-                                "not allowed to delete %(fp)s",
-                                fp=file.full_server_path,
+                                "File %(f)s shouldn't have the '%(src)s' source "
+                                " for the '%(act)s' action",
+                                f=file.name,
+                                src=file.source,
+                                act=action,
                             )
-                        ) from e
+                        )
                     return False
 
-            try:
-                if action == "download":
-                    res = file._process_download(
-                        tower_key_obj, is_server_code_version_process
-                    )
-                    if res:
-                        return res
-                elif action == "upload":
-                    if file.file_type == "binary":
-                        file_content = b64decode(file.file)
-                    else:
-                        file_content = tower_key_obj._parse_code(file.rendered_code)
-                    file.server_id.upload_file(
-                        file_content,
-                        tower_key_obj._parse_code(file.full_server_path),
-                    )
-                elif action == "delete":
-                    file.server_id.delete_file(
-                        tower_key_obj._parse_code(file.full_server_path)
-                    )
-                else:
-                    return False
-                file.server_response = "ok"
-            except Exception as error:
-                if raise_error:
-                    raise ValidationError(
-                        _(
-                            "Cannot pull %(f)s from server: %(err)s",
-                            f=file.rendered_name,
-                            err=exception_to_unicode(error),
+                if action == "delete":
+                    try:
+                        file.check_access_rights("unlink")
+                        file.check_access_rule("unlink")
+                    except AccessError as e:
+                        if raise_error:
+                            raise AccessError(
+                                _(
+                                    "Due to security restrictions you are "
+                                    "not allowed to delete %(fp)s",
+                                    fp=file.full_server_path,
+                                )
+                            ) from e
+                        return False
+
+                # Files of the same server share a single SSH connection
+                ssh_connection = file._get_ssh_connection(ssh_connections)
+                try:
+                    if action == "download":
+                        res = file._process_download(
+                            tower_key_obj,
+                            is_server_code_version_process,
+                            ssh_connection=ssh_connection,
                         )
-                    ) from error
-                file.server_response = repr(error)
-
-        if not is_server_code_version_process:
-            self._update_file_sync_date(fields.Datetime.now())
+                        if res:
+                            return res
+                    elif action == "upload":
+                        file._process_upload(tower_key_obj, ssh_connection)
+                    elif action == "delete":
+                        file.server_id.delete_file(
+                            tower_key_obj._parse_code(file.full_server_path),
+                            ssh_connection=ssh_connection,
+                        )
+                    else:
+                        return False
+                    file.server_response = "ok"
+                except Exception as error:
+                    if raise_error:
+                        raise ValidationError(
+                            _(
+                                "Cannot pull %(f)s from server: %(err)s",
+                                f=file.rendered_name,
+                                err=exception_to_unicode(error),
+                            )
+                        ) from error
+                    file.server_response = repr(error)
+
+            if not is_server_code_version_process:
+                self._update_file_sync_date(fields.Datetime.now())
+        finally:
+            for ssh_connection in ssh_connections.values():
+                if isinstance(ssh_connection, SSH):
+                    ssh_connection.disconnect()
 
     @api.model
     def _get_tower_sync_field_names(self):
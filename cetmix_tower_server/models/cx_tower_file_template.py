@@ -107,6 +107,61 @@ class CxTowerFileTemplate(models.Model):
         action["domain"] = [("id", "in", self.file_ids.ids)]
         return action
 
+    def render_for_servers(self, servers, server_dir=None):
+        """Render file name, directory and content for several servers at once.
+        Variable values of all servers are fetched together.
+
+        Args:
+            servers (cx.tower.server()): servers to render the template for
+            server_dir (Char, optional): directory on server.
+                Template directory is used if not provided.
+
+        Returns:
+            dict: {server_id: {
+                    "rendered_name": rendered file name,
+                    "rendered_server_dir": rendered directory,
+                    "rendered_code": rendered file content
+                }}
+        """
+        self.ensure_one()
+        server_dir = server_dir or self.server_dir
+        variables = self._get_variable_references(
+            self.file_name, self.server_dir, self.code
+        )
+        if server_dir and server_dir != self.server_dir:
+            for ve in self.get_variables_from_code(server_dir):
+                if ve not in variables:
+                    variables.append(ve)
+        variable_values_dict = (
+            servers.get_variable_values(variables) if variables else {}
+        )
+        render_code_custom = self.render_code_custom
+        render_content = self.file_type == "text" and self.source == "tower"
+
+        res = {}
+        for server in servers:
+            var_vals = variable_values_dict.get(server.id)
+            rendered_code = ""
+            if render_content:
+                rendered_code = (
+                    var_vals
+                    and self.code
+                    and render_code_custom(self.code, **var_vals)
+                    or self.code
+                )
+            res[server.id] = {
+                "rendered_name": var_vals
+                and self.file_name
+                and render_code_custom(self.file_name, **var_vals)
+                or self.file_name,
+                "rendered_server_dir": var_vals
+                and server_dir
+                and render_code_custom(server_dir, **var_vals)
+                or server_dir,
+                "rendered_code": rendered_code,
+            }
+        return res
+
     def create_file(self, server, server_dir="", raise_if_exists=False):
         """
         Create a new file using the current template for the selected server.
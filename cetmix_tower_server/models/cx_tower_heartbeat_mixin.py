@@ -0,0 +1,199 @@
+# Copyright (C) 2024 Cetmix OÜ
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+import contextlib
+import logging
+import threading
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+# Default number of minutes after which a running record without heartbeats
+# is considered interrupted. Can be overridden using
+# the `cetmix_tower_server.heartbeat_timeout` system parameter.
+HEARTBEAT_TIMEOUT = 60
+
+# Default number of seconds between heartbeats of a running command.
+# Can be overridden using the `cetmix_tower_server.heartbeat_interval`
+# system parameter.
+HEARTBEAT_INTERVAL = 60
+
+
+class CxTowerHeartbeatMixin(models.AbstractModel):
+    """Used to detect runs interrupted without being finished.
+    Inherit in models that have `is_running` and `start_date` fields.
+    """
+
+    _name = "cx.tower.heartbeat.mixin"
+    _description = "Cetmix Tower heartbeat mixin"
+
+    heartbeat_date = fields.Datetime(
+        string="Heartbeat",
+        help="Last time the run reported its progress",
+    )
+
+    @contextlib.contextmanager
+    def _keep_heartbeat(self):
+        """Report heartbeats from a background thread until the block is left.
+        Used while a command is running because it can block
+        the current thread for a long time without producing any output.
+        Nothing is done for an empty recordset.
+        """
+        runs = self._get_heartbeat_runs() if self else []
+        if not runs:
+            yield
+            return
+        interval = float(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("cetmix_tower_server.heartbeat_interval", HEARTBEAT_INTERVAL)
+        )
+        stop = threading.Event()
+
+        def report_heartbeats():
+            while not stop.wait(interval):
+                for records in runs:
+                    try:
+                        records._touch_heartbeat()
+                    except Exception as e:
+                        _logger.warning("Failed to save heartbeat: %s", e)
+
+        thread = threading.Thread(
+            target=report_heartbeats, name=f"{self._name} heartbeat", daemon=True
+        )
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def _get_heartbeat_runs(self):
+        """Get records whose heartbeats are reported by `_keep_heartbeat()`.
+        Inherit to report heartbeats of the related runs too.
+
+        Returns:
+            list of recordsets: records of the heartbeat models
+        """
+        return [self]
+
+    def _touch_heartbeat(self):
+        """Update heartbeat of running records in a separate transaction
+        so it is visible while the current transaction is not committed.
+        Records locked by any transaction including the current one
+        or not committed yet are skipped instead of waiting for them.
+        """
+        if not self:
+            return
+        with self.pool.cursor() as cr:
+            # Table name is taken from the model, not from user input
+            cr.execute(  # pylint: disable=sql-injection
+                f"""
+                UPDATE {self._table}
+                SET heartbeat_date = %s
+                WHERE id IN (
+                    SELECT id FROM {self._table}
+                    WHERE id IN %s AND is_running
+                    FOR NO KEY UPDATE SKIP LOCKED
+                )
+                """,
+                (fields.Datetime.now(), tuple(self.ids)),
+            )
+
+    @api.model
+    def _get_heartbeat_expire_date(self):
+        """Get date before which the last heartbeat is considered expired
+
+        Returns:
+            datetime: expire date
+        """
+        timeout = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("cetmix_tower_server.heartbeat_timeout", HEARTBEAT_TIMEOUT)
+        )
+        return fields.Datetime.now() - timedelta(minutes=timeout)
+
+    @api.model
+    def _get_stale_runs(self):
+        """Get running records whose heartbeat is expired.
+        Start date is used for records without heartbeat.
+
+        Returns:
+            recordset: stale records
+        """
+        expire_date = self._get_heartbeat_expire_date()
+        return self.sudo().search(
+            [
+                ("is_running", "=", True),
+                "|",
+                ("heartbeat_date", "<", expire_date),
+                "&",
+                ("heartbeat_date", "=", False),
+                ("start_date", "<", expire_date),
+            ]
+        )
+
+    @api.model
+    def _reap_stale_runs(self):
+        """Finish running records that stopped reporting heartbeats.
+        Records kept alive by other running records are not finished.
+
+        Called by cron.
+
+        Returns:
+            recordset: finished records
+        """
+        stale_runs = self._get_stale_runs()
+        alive_ids = stale_runs._get_alive_run_ids()
+        stale_runs = stale_runs.filtered(lambda rec: rec.id not in alive_ids)
+        stale_runs = stale_runs._lock_stale_runs()
+        stale_runs._finish_interrupted_runs()
+        return stale_runs
+
+    def _lock_stale_runs(self):
+        """Lock records before they are finished.
+        Records locked by other transactions are being updated by their
+        runners so they are alive. Such records are skipped without waiting.
+
+        Returns:
+            recordset: locked records
+        """
+        if not self:
+            return self
+        # Table name is taken from the model, not from user input
+        self.env.cr.execute(  # pylint: disable=sql-injection
+            f"""
+            SELECT id FROM {self._table}
+            WHERE id IN %s
+            FOR NO KEY UPDATE SKIP LOCKED
+            """,
+            (tuple(self.ids),),
+        )
+        locked_ids = {row[0] for row in self.env.cr.fetchall()}
+        return self.filtered(lambda rec: rec.id in locked_ids)
+
+    def _get_alive_run_ids(self):
+        """Get ids of stale records that are kept alive
+        by other running records.
+        Inherit to implement your own rules.
+
+        Returns:
+            set: record ids
+        """
+        return set()
+
+    def _finish_interrupted_runs(self):
+        """Finish interrupted records.
+        Inherit `_get_interrupted_run_values()` to set the model status.
+        """
+        self.sudo().write(self._get_interrupted_run_values())
+
+    def _get_interrupted_run_values(self):
+        """Get values saved to interrupted records.
+
+        Returns:
+            dict: values to write
+        """
+        return {"is_running": False, "finish_date": fields.Datetime.now()}
@@ -1,10 +1,46 @@
 # Copyright (C) 2022 Cetmix OÜ
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+import contextlib
 import re
+import threading
+from collections import namedtuple
+from functools import lru_cache
 
 from odoo import _, api, fields, models
 from odoo.exceptions import ValidationError
-from odoo.osv.expression import OR
+from odoo.osv.expression import AND, OR
+
+from .command_output import SecretScrubber
+from .ssh_key_cache import SSH_KEY_CACHE
+from .ssh_pool import SSH_POOL
+
+# Key string found in code.
+# `key_type` and `reference` are None if key string is malformed.
+KeyToken = namedtuple(
+    "KeyToken", ["start", "end", "key_string", "key_type", "reference"]
+)
+
+# Secrets resolved by the current thread while a flight plan is being run.
+# `caches` attribute:
+# {(database name, user id, server id, partner id): {(key type, reference): value}}
+SECRET_CACHES = threading.local()
+
+
+@lru_cache(maxsize=None)
+def compile_key_pattern(key_prefix, key_terminator):
+    """Compile pattern that matches key strings.
+    Key body between prefix and the first terminator is captured.
+
+    Args:
+        key_prefix (Char): key prefix. Eg "#!cxtower"
+        key_terminator (Char): key terminator. Eg "!#"
+
+    Returns:
+        re.Pattern: compiled pattern
+    """
+    return re.compile(
+        re.escape(key_prefix) + "(.*?)" + re.escape(key_terminator), re.DOTALL
+    )
 
 
 class CxTowerKey(models.Model):
@@ -157,6 +193,11 @@ class CxTowerKey(models.Model):
         Returns:
             Result of the super `write` call.
         """
+        # Drop pooled SSH connections and parsed keys of the previous key value
+        if "secret_value" in vals:
+            SSH_POOL.invalidate(self.sudo().server_ssh_ids._get_ssh_pool_keys())
+            SSH_KEY_CACHE.invalidate(self.ids)
+
         if "reference" in vals:
             reference = vals.get("reference", vals.get("name"))
             server_id = vals.get("server_id")
@@ -285,6 +326,12 @@ class CxTowerKey(models.Model):
                                   strings and wrapped in double quotes.
                                   Default is False.
             kwargs (dict): optional arguments
+                Following are supported but not limited to:
+                    - "server_id": server id used to resolve secrets
+                    - "partner_id": partner id used to resolve secrets
+                    - "key_cache": dict where resolved secrets are kept.
+                        Pass the same dict to reuse secrets between calls.
+                        Cache of `_cache_secrets()` is used if not provided.
 
         Returns:
             Dict(): 'code': Command text, 'key_values': List of key values
@@ -296,30 +343,40 @@ class CxTowerKey(models.Model):
         ):  # at least one dot separator and two symbols
             return {"code": code, "key_values": None}
 
-        # Get key strings
-        key_strings = self._extract_key_strings(code)
+        # Find keys in a single pass and resolve them at once
+        tokens = self._tokenize_code(code)
+        resolved_values = self._resolve_key_tokens(tokens, **kwargs)
 
         # Set key values
         key_values = []
         # Replace keys with values
-        for key_string in key_strings:
+        code_parts = []
+        position = 0
+        for token in tokens:
+            key_value = resolved_values.get(token.key_string)
+            if not key_value:
+                continue
+            if pythonic_mode:
+                # save key value as string in pythonic mode
+                key_value = f'"{key_value}"'
+                # Escape newline characters to ensure the key value remains
+                # a valid single-line string. This prevents syntax errors
+                # when the string is used in contexts where unescaped
+                # newlines would break Python syntax or evaluation logic.
+                key_value = key_value.replace("\n", "\\n")
+
             # Replace key including key terminator
-            key_value = self._parse_key_string(key_string, **kwargs)
-            if key_value:
-                if pythonic_mode:
-                    # save key value as string in pythonic mode
-                    key_value = f'"{key_value}"'
-                    # Escape newline characters to ensure the key value remains
-                    # a valid single-line string. This prevents syntax errors
-                    # when the string is used in contexts where unescaped
-                    # newlines would break Python syntax or evaluation logic.
-                    key_value = key_value.replace("\n", "\\n")
-
-                code = code.replace(key_string, key_value)
-
-                # Save key value if not saved yet
-                if key_value not in key_values:
-                    key_values.append(key_value)
+            code_parts.append(code[position : token.start])
+            code_parts.append(key_value)
+            position = token.end
+
+            # Save key value if not saved yet
+            if key_value not in key_values:
+                key_values.append(key_value)
+
+        if code_parts:
+            code_parts.append(code[position:])
+            code = "".join(code_parts)
 
         return {"code": code, "key_values": key_values}
 
@@ -337,42 +394,132 @@ class CxTowerKey(models.Model):
 
         return self._parse_code_and_return_key_values(code, **kwargs)["code"]
 
+    def _tokenize_code(self, code):
+        """Find all key strings in code in a single pass.
+
+        Args:
+            code (Text): code to process
+
+        Returns:
+            list of KeyToken: keys in the order they appear in code
+        """
+        if not code:
+            return []
+        pattern = compile_key_pattern(self.KEY_PREFIX, self.KEY_TERMINATOR)
+        tokens = []
+        for match in pattern.finditer(code):
+            key_parts = self._split_key_body(match.group(1))
+            key_type, reference = key_parts or (None, None)
+            tokens.append(
+                KeyToken(
+                    match.start(), match.end(), match.group(0), key_type, reference
+                )
+            )
+        return tokens
+
     def _extract_key_strings(self, code):
         """Extract all keys from code
 
         Args:
-            code (Text): _description_
-            **kwargs (dict): optional arguments
+            code (Text): code to process
 
         Returns:
-            [str]: list of key stings
+            [str]: list of unique key stings
         """
         key_strings = []
-        key_terminator_len = len(self.KEY_TERMINATOR)
-        index_from = 0  # initial position
-        while index_from > -1:
-            index_from = code.find(self.KEY_PREFIX, index_from)
-
-            if index_from > 0:
-                # Key end
-                index_to = code.find(self.KEY_TERMINATOR, index_from)
-
-                # Extract key value only if key terminator is found
-                if index_to > 0:
-                    # Extract key string including key terminator
-                    extract_to = index_to + key_terminator_len
-                    key_string = code[index_from:extract_to]
-
-                    # Add only if not added before
-                    if key_string not in key_strings:
-                        key_strings.append(key_string)
-                    # Update index from
-                    index_from = extract_to
-                else:
-                    break
-
+        for token in self._tokenize_code(code):
+            # Add only if not added before
+            if token.key_string not in key_strings:
+                key_strings.append(token.key_string)
         return key_strings
 
+    def _resolve_key_tokens(self, tokens, **kwargs):
+        """Resolve several keys at once.
+        All secrets are prefetched using a single query.
+        Each key is then resolved using `_parse_key_string()`
+        so custom resolvers are applied too.
+
+        Args:
+            tokens (list of KeyToken): keys returned by `_tokenize_code()`
+            **kwargs (dict) optional values
+                "key_cache" (dict): secrets resolved before for the same
+                    server and partner. New secrets are added to it.
+
+        Returns:
+            dict: {key string: key value or None if not able to parse}
+        """
+        key_cache = kwargs.pop("key_cache", None)
+        if key_cache is None:
+            key_cache = self._get_secret_cache(**kwargs)
+
+        key_parts = {
+            token.key_string: (token.key_type, token.reference)
+            if token.key_type
+            else None
+            for token in tokens
+        }
+
+        # Prefetch all secrets that are not cached yet
+        references = {
+            parts[1]
+            for parts in key_parts.values()
+            if parts and parts[0] == "secret" and parts not in key_cache
+        }
+        if references:
+            secret_values = self._resolve_key_type_secrets(list(references), **kwargs)
+            kwargs["secret_values"] = {
+                reference: secret_values.get(reference) for reference in references
+            }
+
+        result = {}
+        for key_string, parts in key_parts.items():
+            if parts and parts[0] == "secret":
+                if parts not in key_cache:
+                    key_cache[parts] = self._parse_key_string(key_string, **kwargs)
+                result[key_string] = key_cache[parts]
+            else:
+                result[key_string] = self._parse_key_string(key_string, **kwargs)
+        return result
+
+    @contextlib.contextmanager
+    def _cache_secrets(self):
+        """Reuse secrets resolved by the current thread until the block is left.
+        Used to resolve each secret once per flight plan run.
+        Cache that is already active is kept and reused by nested blocks.
+        Secrets are removed from memory on exit even if an error is raised.
+        """
+        if getattr(SECRET_CACHES, "caches", None) is not None:
+            yield
+            return
+        SECRET_CACHES.caches = {}
+        try:
+            yield
+        finally:
+            SECRET_CACHES.caches = None
+
+    def _get_secret_cache(self, **kwargs):
+        """Get secrets cached by `_cache_secrets()` for the server and partner.
+
+        Args:
+            **kwargs (dict) optional values
+                "server_id" (int): server id
+                "partner_id" (int): partner id
+
+        Returns:
+            dict: {(key type, reference): value}.
+                New dict that is not kept if no cache is active.
+        """
+        caches = getattr(SECRET_CACHES, "caches", None)
+        if caches is None:
+            return {}
+        key = (
+            self.env.cr.dbname,
+            self.env.uid,
+            kwargs.get("server_id"),
+            kwargs.get("partner_id"),
+        )
+        return caches.setdefault(key, {})
+
     def _parse_key_string(self, key_string, **kwargs):
         """Parse key string and call resolver based on the key type.
         Each key string consists of 3 parts:
@@ -407,12 +554,25 @@ class CxTowerKey(models.Model):
         Returns:
             tuple: (key_type, reference) if valid, else None
         """
-        key_parts = (
-            key_string.replace(" ", "").replace(self.KEY_TERMINATOR, "").split(".")
+        match = compile_key_pattern(self.KEY_PREFIX, self.KEY_TERMINATOR).fullmatch(
+            key_string.strip()
         )
+        return self._split_key_body(match.group(1)) if match else None
+
+    def _split_key_body(self, key_body):
+        """Split key body into key type and reference.
+        Eg ".secret.GITHUB_TOKEN" for "#!cxtower.secret.GITHUB_TOKEN!#"
 
-        # Must be 3 parts including pre!
-        if len(key_parts) == 3 and key_parts[0] == self.KEY_PREFIX:
+        Args:
+            key_body (str): part of key string between prefix and terminator
+
+        Returns:
+            tuple: (key_type, reference) if valid, else None
+        """
+        key_parts = key_body.replace(" ", "").split(".")
+
+        # Must be 3 parts including empty prefix part!
+        if len(key_parts) == 3 and not key_parts[0]:
             return key_parts[1], key_parts[2]
 
         return None
@@ -438,12 +598,33 @@ class CxTowerKey(models.Model):
         Args:
             reference (str): key reference
             **kwargs (dict) optional values
+                "secret_values" (dict): {reference: value} secrets
+                    prefetched by `_resolve_key_tokens()`
 
         Returns:
             str: value or False if not able to parse
         """
         if not reference:
             return
+        # Use values prefetched by `_resolve_key_tokens()`
+        secret_values = kwargs.get("secret_values")
+        if secret_values and reference in secret_values:
+            return secret_values[reference]
+        return self._resolve_key_type_secrets([reference], **kwargs).get(reference)
+
+    def _resolve_key_type_secrets(self, references, **kwargs):
+        """Resolve several keys of type "secret" using a single query.
+
+        Args:
+            references (list of str): key references
+            **kwargs (dict) optional values
+
+        Returns:
+            dict: {reference: value}. Missing keys are not included.
+        """
+        references = [reference for reference in references if reference]
+        if not references:
+            return {}
 
         # Compose domain used to fetch keys
         #
@@ -454,47 +635,29 @@ class CxTowerKey(models.Model):
         server_id = kwargs.get("server_id")
         partner_id = kwargs.get("partner_id")
 
-        key_domain = [
-            ("reference", "=", reference),
-            ("server_id", "=", False),
-            ("partner_id", "=", False),
-        ]
-
+        owner_domains = [[("server_id", "=", False), ("partner_id", "=", False)]]
         if server_id:
-            key_domain = OR(
-                [
-                    key_domain,
-                    [("reference", "=", reference), ("server_id", "=", server_id)],
-                ]
-            )
+            owner_domains.append([("server_id", "=", server_id)])
         if partner_id:
-            key_domain = OR(
-                [
-                    key_domain,
-                    [("reference", "=", reference), ("partner_id", "=", partner_id)],
-                ]
-            )
-
-        # Fetch keys
-        keys = self.search(key_domain).sudo()
-        if not keys:
-            return
-
-        # Try to get server specific key first
-        key = False
-        if server_id:
-            key = keys.filtered(lambda k: k.server_id.id == server_id)
-
-        # Try to get partner specific key next
-        if not key and partner_id:
-            key = keys.filtered(lambda k: k.partner_id.id == partner_id)
-
-        if not key:
-            # Fallback to a global key
-            key = keys
+            owner_domains.append([("partner_id", "=", partner_id)])
+        key_domain = AND([[("reference", "in", references)], OR(owner_domains)])
+
+        # Fetch keys and keep the most specific one for each reference
+        best_keys = {}
+        for key in self.search(key_domain).sudo():
+            if server_id and key.server_id.id == server_id:
+                priority = 0
+            elif partner_id and key.partner_id.id == partner_id:
+                priority = 1
+            else:
+                priority = 2
+            best_key = best_keys.get(key.reference)
+            if best_key is None or priority < best_key[0]:
+                best_keys[key.reference] = (priority, key)
 
-        key_value = key[0].secret_value
-        return key_value
+        return {
+            reference: key.secret_value for reference, (__, key) in best_keys.items()
+        }
 
     def _replace_with_spoiler(self, code, key_values):
         """Helper function that replaces clean text keys in code with spoiler.
@@ -515,14 +678,22 @@ class CxTowerKey(models.Model):
 
         if not key_values:
             return code
+        return self._get_secret_scrubber(key_values).scrub(code)
 
-        # Replace keys with values
-        for key_value in key_values:
+    def _get_secret_scrubber(self, key_values):
+        """Get scrubber that replaces key values with spoiler.
+        Build it once and reuse for all output of the same command.
+
+        Args:
+            key_values (List): secret values to be cleaned from text
+
+        Returns:
+            SecretScrubber: scrubber
+        """
+        secrets = []
+        for key_value in key_values or []:
             # If key_value includes quotes, remove them for the replacement
             key_value = key_value.strip('"')
             # If key_value contains an escaped line break replace then remove escaping
-            key_value = key_value.replace("\\n", "\n")
-            # Replace key including key terminator
-            code = code.replace(key_value, self.SECRET_VALUE_SPOILER)
-
-        return code
+            secrets.append(key_value.replace("\\n", "\n"))
+        return SecretScrubber(secrets, self.SECRET_VALUE_SPOILER)
@@ -46,13 +46,11 @@ class CxTowerKeyMixin(models.AbstractModel):
             list: List of secret IDs corresponding to the references in `code`.
         """
         key_model = self.env["cx.tower.key"]
-        key_strings = key_model._extract_key_strings(code)
-
-        key_refs = []
-        for key_string in key_strings:
-            key_parts = key_model._extract_key_parts(key_string)
-            if key_parts:
-                key_refs.append(key_parts[1])
+        key_refs = [
+            token.reference
+            for token in key_model._tokenize_code(code)
+            if token.reference
+        ]
 
         return key_model.search(self._compose_secret_search_domain(key_refs))
 
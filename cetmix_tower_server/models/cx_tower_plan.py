@@ -1,6 +1,7 @@
 # Copyright (C) 2022 Cetmix OÜ
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
-from operator import indexOf
+import operator
+from types import MappingProxyType
 
 from odoo import _, api, fields, models
 from odoo.tools.safe_eval import expr_eval
@@ -11,6 +12,17 @@ from .constants import (
     PLAN_LINE_NOT_ASSIGNED,
     PLAN_NOT_ASSIGNED,
 )
+from .plan_graph import PLAN_GRAPHS, PlanGraph, PlanGraphAction, PlanGraphLine
+
+# Python operators used to evaluate action conditions
+ACTION_CONDITION_OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+}
 
 
 class CxTowerPlan(models.Model):
@@ -79,6 +91,83 @@ class CxTowerPlan(models.Model):
             for plan in self:
                 plan._execute_single(server, **kwargs)
 
+    def execute_fleet(
+        self, servers, max_parallel_servers=1, max_failed_servers=0, **kwargs
+    ):
+        """Execute plan on multiple servers and save summary in the fleet log.
+        Plan is executed on `max_parallel_servers` servers at a time.
+        Remaining servers are not started once the plan has failed
+        on `max_failed_servers` servers. A server where the plan
+        could not be run because of an error is counted as failed
+        and does not stop the other servers.
+
+        Fleet log is saved in its own transaction so the plan logs
+        created for the servers in parallel can refer to it
+        without committing the current transaction.
+
+        Args:
+            servers (cx.tower.server()): server records
+            max_parallel_servers (Int, optional): number of servers
+                processed at a time. Defaults to 1.
+            max_failed_servers (Int, optional): stop after this number of
+                failed servers. Defaults to 0 which means never stop.
+            kwargs (dict): Optional arguments
+                Following are supported but not limited to:
+                    - "plan_log": {values passed to flightplan logger}
+                    - "log": {values passed to logger}
+                    - "key": {values passed to key parser}
+
+        Returns:
+            cx.tower.plan.fleet.log(): fleet log record
+        """
+        self.ensure_one()
+        plan_log_values = kwargs.get("plan_log") or {}
+        with self.pool.cursor() as cr:
+            fleet_log_id = (
+                self.env(cr=cr)["cx.tower.plan.fleet.log"]
+                .sudo()
+                .create(
+                    {
+                        "plan_id": self.id,
+                        "label": plan_log_values.get("label"),
+                        "server_ids": [(6, 0, servers.ids)],
+                        "max_parallel_servers": max_parallel_servers,
+                        "max_failed_servers": max_failed_servers,
+                        "start_date": fields.Datetime.now(),
+                        "is_running": True,
+                    }
+                )
+                .id
+            )
+        kwargs["plan_log"] = dict(plan_log_values, fleet_log_id=fleet_log_id)
+        plan_id = self.id
+        failed = []
+
+        def run(server):
+            plan = server.env["cx.tower.plan"].browse(plan_id)
+            return plan._execute_single(server, **kwargs)
+
+        def stop(plan_status):
+            if plan_status:
+                failed.append(plan_status)
+            return bool(max_failed_servers) and len(failed) >= max_failed_servers
+
+        results = servers._run_in_parallel(
+            run, max_workers=max_parallel_servers, stop=stop
+        )
+        errors = {
+            server: str(results[index])
+            for index, server in enumerate(servers)
+            if isinstance(results[index], Exception)
+        }
+        with self.pool.cursor() as cr:
+            self.env(cr=cr)["cx.tower.plan.fleet.log"].browse(fleet_log_id).finish(
+                is_stopped=None in results, errors=errors
+            )
+        fleet_log = self.env["cx.tower.plan.fleet.log"].browse(fleet_log_id)
+        fleet_log.invalidate_cache()
+        return fleet_log
+
     def _execute_single(self, server, **kwargs):
         """Execute Flight Plan
 
@@ -118,7 +207,7 @@ class CxTowerPlan(models.Model):
             server, self, fields.Datetime.now(), **kwargs
         ).plan_status
 
-    def _get_next_action_values(self, command_log):
+    def _get_next_action_values(self, command_log, graph=None):
         """Get next action values based of previous command result:
 
             - Action to proceed
@@ -127,6 +216,8 @@ class CxTowerPlan(models.Model):
 
         Args:
             command_log (cx.tower.command.log()): Command log record
+            graph (PlanGraph, optional): compiled plan of the current line.
+                Compiled on demand if not provided.
 
         Returns:
             action, exit_code, next_line (Selection, Integer, cx.tower.plan.line())
@@ -143,79 +234,134 @@ class CxTowerPlan(models.Model):
         if not current_line:
             return "ec", PLAN_LINE_NOT_ASSIGNED, None
 
-        # Default values
-        exit_code = command_log.command_status
-        server = command_log.server_id
-        server_variable_values = server.variable_value_ids
+        if graph is None:
+            graph = current_line.plan_id._get_plan_graph()
+        graph_line = graph.lines.get(current_line.id)
+        if not graph_line:
+            return "ec", PLAN_LINE_NOT_ASSIGNED, None
+
+        action, exit_code = self._get_line_action(current_line, command_log, graph_line)
+        return self._get_next_action_state(action, exit_code, current_line, graph=graph)
+
+    def _get_line_action(self, line, command_log, graph_line):
+        """Get action triggered by the command result of a plan line.
+        Variable values of the matched action are saved to the server.
 
+        Args:
+            line (cx.tower.plan.line()): finished plan line
+            command_log (cx.tower.command.log()): command log of the line
+            graph_line (PlanGraphLine): compiled line
+
+        Returns:
+            action, exit_code (Selection, Integer): action is None
+                if no action condition is matched
+        """
+        return self._get_line_status_action(
+            line, command_log.server_id, command_log.command_status, graph_line
+        )
+
+    def _get_line_status_action(self, line, server, exit_code, graph_line):
+        """Get action triggered by the command exit code of a plan line.
+        Check `_get_line_action` for details.
+
+        Args:
+            line (cx.tower.plan.line()): finished plan line
+            server (cx.tower.server()): server the line was run on
+            exit_code (Int): command exit code
+            graph_line (PlanGraphLine): compiled line
+
+        Returns:
+            action, exit_code (Selection, Integer): action is None
+                if no action condition is matched
+        """
         # Check line condition
-        if not current_line._is_executable_line(server):
+        if not line._is_executable_line(server, graph_line=graph_line):
             # Immediately return to the next line if condition fails
-            return self._get_next_action_state(
-                "n", PLAN_LINE_CONDITION_CHECK_FAILED, current_line
-            )
+            return "n", PLAN_LINE_CONDITION_CHECK_FAILED
 
         # Check plan action lines
-        for action_line in current_line.action_ids:
-            conditional_expression = (
-                f"{exit_code} {action_line.condition} {action_line.value_char}"
-            )
-            # Evaluate expression using safe_eval
-            if expr_eval(conditional_expression):
-                action = action_line.action
+        for graph_action in graph_line.actions:
+            if graph_action.predicate(exit_code):
+                action = graph_action.action
                 # Use custom exit code if action requires it
-                if action == "ec" and action_line.custom_exit_code:
-                    exit_code = action_line.custom_exit_code
-
-                variable_value_obj = self.env["cx.tower.variable.value"]
-                for variable_value in action_line.variable_value_ids:
-                    variable = variable_value.variable_id
-                    server_variable_value = server_variable_values.filtered(
-                        lambda rec, variable=variable: rec.variable_id == variable,
+                if action == "ec" and graph_action.custom_exit_code:
+                    exit_code = graph_action.custom_exit_code
+
+                if graph_action.variable_values:
+                    self._apply_action_variable_values(
+                        server, graph_action.variable_values
                     )
-                    if server_variable_value:
-                        # update exist server value
-                        server_variable_value.value_char = variable_value.value_char
-                    else:
-                        # create new value
-                        variable_value_obj.create(
-                            {
-                                "variable_id": variable.id,
-                                "value_char": variable_value.value_char,
-                                "server_id": server.id,
-                            }
-                        )
-
-                return self._get_next_action_state(action, exit_code, current_line)
-
-        # If no action matched, fallback to default ones
-        return self._get_next_action_state(None, exit_code, current_line)
-
-    def _get_next_action_state(self, action, exit_code, current_line):
+                return action, exit_code
+
+        return None, exit_code
+
+    def _apply_action_variable_values(self, server, variable_values):
+        """Save variable values set by a plan line action to server
+
+        Args:
+            server (cx.tower.server()): server record
+            variable_values (tuple): ((variable id, value), ...)
+        """
+        server_variable_values = server.variable_value_ids
+        variable_value_obj = self.env["cx.tower.variable.value"]
+        for variable_id, value_char in variable_values:
+            server_variable_value = server_variable_values.filtered(
+                lambda rec, variable_id=variable_id: rec.variable_id.id == variable_id,
+            )
+            if server_variable_value:
+                # update exist server value
+                server_variable_value.value_char = value_char
+            else:
+                # create new value
+                variable_value_obj.create(
+                    {
+                        "variable_id": variable_id,
+                        "value_char": value_char,
+                        "server_id": server.id,
+                    }
+                )
+
+    def _get_next_action_state(self, action, exit_code, current_line, graph=None):
         """
         Determine the next action, exit code, and next line based on the current state.
         """
-        lines = current_line.plan_id.line_ids
-        is_last_line = current_line == lines[-1]
+        if graph is None:
+            graph = current_line.plan_id._get_plan_graph()
+        graph_line = graph.lines.get(current_line.id)
+        next_line_id = graph_line.next_line_id if graph_line else None
+        is_last_line = next_line_id is None
 
         # If no conditions were met fallback to default ones
         if not action:
-            action = "n" if exit_code == 0 else current_line.plan_id.on_error_action
-
-            # Exit with custom code
-            if action == "ec":
-                exit_code = current_line.plan_id.custom_exit_code
+            action, exit_code = self._get_default_action(exit_code, graph)
 
         # Determine the next line if current is not the last one
         next_line = None
         if action == "n" and not is_last_line:
-            next_line = lines[indexOf(lines, current_line) + 1]
+            next_line = current_line.browse(next_line_id)
 
         if is_last_line:
             action = "e"
 
         return action, exit_code, next_line
 
+    def _get_default_action(self, exit_code, graph):
+        """Get plan action used when no line action is matched
+
+        Args:
+            exit_code (Int): command exit code
+            graph (PlanGraph): compiled plan
+
+        Returns:
+            action, exit_code (Selection, Integer)
+        """
+        action = "n" if exit_code == 0 else graph.on_error_action
+
+        # Exit with custom code
+        if action == "ec":
+            exit_code = graph.custom_exit_code
+        return action, exit_code
+
     def _run_next_action(self, command_log):
         """Run next action based on command execution result
 
@@ -223,21 +369,72 @@ class CxTowerPlan(models.Model):
             command_log (cx.tower.command.log()): Command log record
         """
         self.ensure_one()
-        action, exit_code, plan_line_id = self._get_next_action_values(command_log)
+        graph = self._get_plan_graph()
         plan_log = command_log.plan_log_id
+        completed_line = plan_log.plan_line_executed_id
+        action, exit_code, plan_line_id = self._get_next_action_values(
+            command_log, graph=graph
+        )
 
-        # Update log message
-        if exit_code == PLAN_LINE_CONDITION_CHECK_FAILED:
-            # save log exit code as success
-            exit_code = 0
+        self._run_plan_action(
+            plan_log,
+            action,
+            exit_code,
+            plan_line_id,
+            graph=graph,
+            completed_line=completed_line,
+        )
+
+    def _run_plan_action(
+        self,
+        plan_log,
+        action,
+        exit_code,
+        plan_line_id,
+        graph=None,
+        completed_line=None,
+    ):
+        """Run next plan line or finish the plan.
+        Parallel groups are run one after another until a single line
+        is started or the plan is finished.
+        Progress is saved before each line or group is run.
+
+        Args:
+            plan_log (cx.tower.plan.log()): plan log record
+            action (Selection): action to proceed
+            exit_code (Int): exit code
+            plan_line_id (cx.tower.plan.line()): next line if any
+            graph (PlanGraph, optional): compiled plan.
+                Compiled on demand if not provided.
+            completed_line (cx.tower.plan.line(), optional): line
+                whose result triggered this action
+        """
+        self.ensure_one()
+        if graph is None:
+            graph = self._get_plan_graph()
+        server = plan_log.server_id
 
         # Execute next line
-        if action == "n" and plan_line_id:
-            server = command_log.server_id
-            if plan_line_id._is_executable_line(server):
+        while action == "n" and plan_line_id:
+            plan_log._save_plan_checkpoint(completed_line, plan_line_id)
+            graph_line = graph.lines.get(plan_line_id.id)
+            if graph_line and graph_line.group_line_ids:
+                group_lines = plan_line_id.browse(graph_line.group_line_ids)
+                action, exit_code, plan_line_id = self._run_plan_line_group(
+                    plan_log, group_lines, graph
+                )
+                completed_line = group_lines[-1]
+                continue
+            if plan_line_id._is_executable_line(server, graph_line=graph_line):
                 plan_line_id._execute(server, plan_log)
             else:
                 plan_line_id._skip(server, plan_log)
+            break
+
+        # Update log message
+        if exit_code == PLAN_LINE_CONDITION_CHECK_FAILED:
+            # save log exit code as success
+            exit_code = 0
 
         # Exit
         if action in ["e", "ec"]:
@@ -246,6 +443,171 @@ class CxTowerPlan(models.Model):
         # NB: we are not putting any fallback here in case
         # someone needs to inherit and extend this function
 
+    def _run_plan_line_group(self, plan_log, lines, graph):
+        """Run lines of a parallel group at the same time
+        and wait until all of them are finished.
+        Line actions are applied to each line in the line order.
+        The first line that exits the plan defines the group result.
+
+        Args:
+            plan_log (cx.tower.plan.log()): plan log record
+            lines (cx.tower.plan.line()): lines of the group
+            graph (PlanGraph): compiled plan
+
+        Returns:
+            action, exit_code, next_line (Selection, Integer, cx.tower.plan.line())
+        """
+        self.ensure_one()
+        # Command logs can be created in other transactions
+        # and cannot be read here, so returned values are used
+        line_results = lines._run_parallel_group(plan_log, graph)
+        plan_log.plan_line_executed_id = lines[-1]
+
+        result = None
+        exit_code = 0
+        for index, line in enumerate(lines):
+            if not line_results[index]:
+                continue
+            action, exit_code = self._get_line_status_action(
+                line,
+                plan_log.server_id,
+                line_results[index]["command_status"],
+                graph.lines.get(line.id),
+            )
+            if not action:
+                action, exit_code = self._get_default_action(exit_code, graph)
+            if result is None and action in ["e", "ec"]:
+                result = action, exit_code, None
+        if result:
+            return result
+        return self._get_next_action_state("n", exit_code, lines[-1], graph=graph)
+
+    def _get_plan_graph(self):
+        """Get compiled plan.
+        Plan is compiled once and is reused until the plan, its lines,
+        actions or action variable values are modified.
+
+        Returns:
+            PlanGraph: compiled plan
+        """
+        self.ensure_one()
+        return PLAN_GRAPHS.get(
+            (self.env.cr.dbname, self.id),
+            self._get_plan_graph_signature(),
+            self._build_plan_graph,
+        )
+
+    def _get_plan_graph_signature(self):
+        """Compose plan signature used to detect outdated compiled plans
+
+        Returns:
+            tuple: write dates and counts of the plan records
+        """
+        self.ensure_one()
+        self.flush()
+        self.env.cr.execute(
+            """
+            SELECT p.write_date,
+                count(DISTINCT l.id), max(l.write_date),
+                count(DISTINCT a.id), max(a.write_date),
+                count(DISTINCT v.id), max(v.write_date)
+            FROM cx_tower_plan p
+            LEFT JOIN cx_tower_plan_line l ON l.plan_id = p.id
+            LEFT JOIN cx_tower_plan_line_action a ON a.line_id = l.id
+            LEFT JOIN cx_tower_variable_value v ON v.plan_line_action_id = a.id
+            WHERE p.id = %s
+            GROUP BY p.id
+            """,
+            (self.id,),
+        )
+        return self.env.cr.fetchone()
+
+    def _build_plan_graph(self):
+        """Compile plan into an execution graph.
+        Plan is read using superuser so the same graph
+        can be shared by all users.
+
+        Returns:
+            PlanGraph: compiled plan
+        """
+        self.ensure_one()
+        plan = self.sudo()
+        lines = plan.line_ids
+        line_ids = lines.ids
+        # Consecutive lines with the same parallel group are run together
+        groups = []
+        for line in lines:
+            group = line.parallel_group
+            if group and groups and groups[-1][0] == group:
+                groups[-1][1].append(line.id)
+            else:
+                groups.append((group, [line.id]))
+        group_line_ids = {}
+        for group, group_ids in groups:
+            if group and len(group_ids) > 1:
+                for line_id in group_ids:
+                    group_line_ids[line_id] = tuple(group_ids)
+
+        graph_lines = {}
+        for index, line in enumerate(lines, start=1):
+            next_line_id = line_ids[index] if index < len(line_ids) else None
+            condition = line.condition
+            variable_references = ()
+            if condition:
+                variable_references = tuple(
+                    line.variable_ids.mapped("reference")
+                    + line.command_id._get_system_variable_references(condition)
+                )
+            actions = tuple(
+                PlanGraphAction(
+                    action=action.action,
+                    predicate=self._compile_action_predicate(
+                        action.condition, action.value_char
+                    ),
+                    custom_exit_code=action.custom_exit_code,
+                    variable_values=tuple(
+                        (variable_value.variable_id.id, variable_value.value_char)
+                        for variable_value in action.variable_value_ids
+                    ),
+                )
+                for action in line.action_ids
+            )
+            graph_lines[line.id] = PlanGraphLine(
+                next_line_id=next_line_id,
+                condition=condition,
+                variable_references=variable_references,
+                actions=actions,
+                group_line_ids=group_line_ids.get(line.id, ()),
+            )
+        return PlanGraph(
+            first_line_id=line_ids[0] if line_ids else None,
+            lines=MappingProxyType(graph_lines),
+            on_error_action=plan.on_error_action,
+            custom_exit_code=plan.custom_exit_code,
+        )
+
+    @api.model
+    def _compile_action_predicate(self, condition, value_char):
+        """Compile plan line action condition.
+        Integer values are compared directly, other values
+        are evaluated the same way as before using `expr_eval`.
+
+        Args:
+            condition (Selection): comparison operator. Eg '>='
+            value_char (Char): value to compare exit code with
+
+        Returns:
+            callable: function that receives exit code and returns bool
+        """
+        compare = ACTION_CONDITION_OPERATORS.get(condition)
+        try:
+            value = int(value_char)
+        except (TypeError, ValueError):
+            value = None
+        if compare and value is not None:
+            return lambda exit_code: compare(exit_code, value)
+        return lambda exit_code: expr_eval(f"{exit_code} {condition} {value_char}")
+
     @api.depends("line_ids.command_id.access_level", "access_level")
     def _compute_command_access_level(self):
         """Check if the access level of a command in the plan
@@ -279,6 +641,15 @@ class CxTowerPlan(models.Model):
         action["domain"] = [("plan_id", "=", self.id)]
         return action
 
+    def write(self, vals):
+        # Records modified in the same transaction keep the same write date
+        PLAN_GRAPHS.clear()
+        return super().write(vals)
+
+    def unlink(self):
+        PLAN_GRAPHS.clear()
+        return super().unlink()
+
     def copy(self, default=None):
         # Call the super method to handle basic duplication
         default = dict(default or {})
@@ -0,0 +1,135 @@
+# Copyright (C) 2024 Cetmix OÜ
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+from odoo import api, fields, models
+
+
+class CxTowerPlanFleetLog(models.Model):
+    """Summary of a Flight Plan executed on multiple servers"""
+
+    _name = "cx.tower.plan.fleet.log"
+    _description = "Cetmix Tower Flight Plan Fleet Log"
+    _order = "start_date desc, id desc"
+
+    name = fields.Char(compute="_compute_name", compute_sudo=True, store=True)
+    label = fields.Char(help="Custom label. Can be used for search/tracking")
+    plan_id = fields.Many2one(
+        string="Flight Plan",
+        comodel_name="cx.tower.plan",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    server_ids = fields.Many2many(
+        comodel_name="cx.tower.server",
+        relation="cx_tower_plan_fleet_log_server_rel",
+        column1="fleet_log_id",
+        column2="server_id",
+        string="Servers",
+    )
+    max_parallel_servers = fields.Integer(
+        string="Servers at a Time",
+        help="Number of servers the Flight Plan is executed on at the same time",
+    )
+    max_failed_servers = fields.Integer(
+        string="Stop After Failures",
+        help="Do not start the Flight Plan on the remaining servers "
+        "after it fails on this number of servers. Leave 0 to never stop.",
+    )
+
+    # -- Time
+    start_date = fields.Datetime(string="Started")
+    finish_date = fields.Datetime(string="Finished")
+    duration = fields.Float(
+        help="Time consumed for execution, seconds",
+        compute="_compute_duration",
+        store=True,
+    )
+    is_running = fields.Boolean(help="Plan is being executed right now")
+    is_stopped = fields.Boolean(
+        string="Stopped",
+        help="Execution was stopped because the failed servers limit was reached",
+    )
+    error_server_ids = fields.Many2many(
+        comodel_name="cx.tower.server",
+        relation="cx_tower_plan_fleet_log_error_server_rel",
+        column1="fleet_log_id",
+        column2="server_id",
+        string="Servers with Errors",
+        help="Servers where the Flight Plan could not be run because of an error",
+    )
+    error_message = fields.Text(string="Errors")
+
+    # -- Results
+    plan_log_ids = fields.One2many(
+        comodel_name="cx.tower.plan.log",
+        inverse_name="fleet_log_id",
+        string="Flight Plan Logs",
+    )
+    server_count = fields.Integer(string="Servers", compute="_compute_counts")
+    success_count = fields.Integer(string="Succeeded", compute="_compute_counts")
+    failed_count = fields.Integer(string="Failed", compute="_compute_counts")
+    running_count = fields.Integer(string="Running", compute="_compute_counts")
+    not_started_count = fields.Integer(string="Not Started", compute="_compute_counts")
+
+    @api.depends("plan_id.name")
+    def _compute_name(self):
+        for rec in self:
+            rec.name = rec.plan_id.name
+
+    @api.depends("finish_date")
+    def _compute_duration(self):
+        for fleet_log in self:
+            if fleet_log.finish_date and fleet_log.start_date:
+                fleet_log.duration = (
+                    fleet_log.finish_date - fleet_log.start_date
+                ).total_seconds()
+
+    # Plan logs are created in separate transactions when servers are
+    # processed in parallel so counts are not stored.
+    def _compute_counts(self):
+        for fleet_log in self:
+            plan_logs = fleet_log.plan_log_ids
+            running = plan_logs.filtered("is_running")
+            finished = plan_logs - running
+            fleet_log.server_count = len(fleet_log.server_ids)
+            fleet_log.running_count = len(running)
+            fleet_log.success_count = len(
+                finished.filtered(lambda log: log.plan_status == 0)
+            )
+            fleet_log.failed_count = (
+                len(finished)
+                - fleet_log.success_count
+                + len(fleet_log.error_server_ids)
+            )
+            fleet_log.not_started_count = len(
+                fleet_log.server_ids
+                - plan_logs.mapped("server_id")
+                - fleet_log.error_server_ids
+            )
+
+    def finish(self, is_stopped=False, errors=None):
+        """Finish fleet execution
+
+        Args:
+            is_stopped (bool, optional): execution was stopped
+                because of the failed servers limit. Defaults to False.
+            errors (dict, optional): {server record: error message}
+                servers where the plan could not be run.
+        """
+        errors = errors or {}
+        vals = {
+            "is_running": False,
+            "is_stopped": is_stopped,
+            "finish_date": fields.Datetime.now(),
+        }
+        if errors:
+            vals.update(
+                {
+                    "error_server_ids": [(6, 0, [server.id for server in errors])],
+                    "error_message": "\n".join(
+                        f"[{server.name}]: {message}"
+                        for server, message in errors.items()
+                    ),
+                }
+            )
+        self.sudo().write(vals)
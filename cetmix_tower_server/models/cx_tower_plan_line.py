@@ -5,7 +5,14 @@ from odoo import _, api, fields, models
 from odoo.exceptions import ValidationError
 from odoo.tools.safe_eval import safe_eval
 
-from .constants import PLAN_LINE_CONDITION_CHECK_FAILED
+from .constants import PLAN_LINE_CONDITION_CHECK_FAILED, PLAN_LINE_FAILED
+from .plan_graph import PLAN_GRAPHS
+from .tools import run_in_parallel
+
+# Default number of parallel group lines run at the same time.
+# Can be overridden using the `cetmix_tower_server.max_parallel_plan_lines`
+# system parameter.
+MAX_PARALLEL_PLAN_LINES = 4
 
 
 class CxTowerPlanLine(models.Model):
@@ -36,6 +43,11 @@ class CxTowerPlanLine(models.Model):
         help="Will use sudo based on server settings."
         "If no sudo is configured will run without sudo"
     )
+    parallel_group = fields.Char(
+        help="Consecutive lines with the same parallel group are run "
+        "at the same time. Next line is run once all lines of the group "
+        "are finished. Leave blank to run the line alone",
+    )
     action_ids = fields.One2many(
         string="Actions",
         comodel_name="cx.tower.plan.line.action",
@@ -66,6 +78,25 @@ class CxTowerPlanLine(models.Model):
         compute="_compute_variable_ids",
         store=True,
     )
+    missing_variable_references = fields.Char(
+        compute="_compute_variable_ids",
+        store=True,
+        index=True,
+        help="References used in templates that do not match any variable yet",
+    )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        PLAN_GRAPHS.clear()
+        return super().create(vals_list)
+
+    def write(self, vals):
+        PLAN_GRAPHS.clear()
+        return super().write(vals)
+
+    def unlink(self):
+        PLAN_GRAPHS.clear()
+        return super().unlink()
 
     @api.depends("condition")
     def _compute_variable_ids(self):
@@ -77,6 +108,11 @@ class CxTowerPlanLine(models.Model):
             record.variable_ids = template_mixin_obj._prepare_variable_commands(
                 ["condition"], force_record=record
             )
+            record.missing_variable_references = (
+                template_mixin_obj._get_missing_variable_references(
+                    ["condition"], force_record=record
+                )
+            )
 
     @api.constrains("command_id")
     def _check_command_id(self):
@@ -121,8 +157,17 @@ class CxTowerPlanLine(models.Model):
         """
         self.ensure_one()
 
-        # Set current line as currently executed in log
-        plan_log_record.plan_line_executed_id = self
+        # Set current line as currently executed in log.
+        # Log is not modified if the line is already set by a checkpoint.
+        if plan_log_record.plan_line_executed_id != self:
+            plan_log_record.plan_line_executed_id = self
+        self._run_command(server, plan_log_record, **kwargs)
+
+    def _run_command(self, server, plan_log_record, **kwargs):
+        """Run command of the line without updating the plan log.
+        Check `_execute()` for the arguments.
+        """
+        self.ensure_one()
 
         # It is necessary to save information about which plan log
         # was created for a command log that has the command action “plan”
@@ -142,22 +187,38 @@ class CxTowerPlanLine(models.Model):
 
         # Set path
         path = self.path or self.command_id.path
-        server.execute_command(command_id, path, sudo=use_sudo, **kwargs)
+        server.execute_command(
+            command_id,
+            path,
+            sudo=use_sudo,
+            ssh_connection=plan_log_record._get_ssh_connection(),
+            **kwargs,
+        )
 
-    def _is_executable_line(self, server):
+    def _is_executable_line(self, server, graph_line=None):
         """
         Check if this line can be executed based on its condition.
 
         Args:
             server (cx.tower.server()): The server on which conditions are checked.
+            graph_line (PlanGraphLine, optional): compiled line.
+                Condition and its variables are taken from it if provided.
 
         Returns:
             bool: True if the line can be executed, otherwise False.
         """
         self.ensure_one()
-        condition = self.condition
+        if graph_line:
+            condition = graph_line.condition
+        else:
+            condition = self.condition
         if condition:
-            variables = self.command_id.get_variables_from_code(condition)
+            if graph_line:
+                variables = list(graph_line.variable_references)
+            else:
+                variables = self.variable_ids.mapped(
+                    "reference"
+                ) + self.command_id._get_system_variable_references(condition)
             if variables:
                 variable_values_dict = (
                     server.get_variable_values(variables) if variables else {}
@@ -180,8 +241,17 @@ class CxTowerPlanLine(models.Model):
         """
         self.ensure_one()
 
-        # Set current line as currently executed in log
-        plan_log_record.plan_line_executed_id = self
+        # Set current line as currently executed in log.
+        # Log is not modified if the line is already set by a checkpoint.
+        if plan_log_record.plan_line_executed_id != self:
+            plan_log_record.plan_line_executed_id = self
+        self._record_skip(server, plan_log_record, **kwargs)
+
+    def _record_skip(self, server, plan_log_record, **kwargs):
+        """Log skipped line without updating the plan log.
+        Check `_skip()` for the arguments.
+        """
+        self.ensure_one()
 
         # Log the unsuccessful execution attempt
         now = fields.Datetime.now()
@@ -201,6 +271,63 @@ class CxTowerPlanLine(models.Model):
             **log_vals,
         )
 
+    def _run_parallel_group(self, plan_log_record, graph, max_workers=None):
+        """Run lines at the same time.
+        Finished commands do not trigger the next plan line.
+        Their results are returned to the caller instead.
+        Lines can be run in other transactions so plain values are returned.
+        A line that fails with an error is returned as failed
+        with the `PLAN_LINE_FAILED` status.
+
+        Args:
+            plan_log_record (cx.tower.plan.log()): Log record object
+            graph (PlanGraph): compiled plan
+            max_workers (Int, optional): number of lines run at a time.
+                Defaults to the `cetmix_tower_server.max_parallel_plan_lines`
+                system parameter.
+
+        Returns:
+            list: {"command_log_id": Int, "command_status": Int} results
+                in the same order as lines.
+                None is returned for lines that were not finished.
+        """
+        if max_workers is None:
+            max_workers = int(
+                self.env["ir.config_parameter"]
+                .sudo()
+                .get_param(
+                    "cetmix_tower_server.max_parallel_plan_lines",
+                    MAX_PARALLEL_PLAN_LINES,
+                )
+            )
+        plan_log_id = plan_log_record.id
+        server_id = plan_log_record.server_id.id
+
+        def run(line):
+            plan_log = line.env["cx.tower.plan.log"].browse(plan_log_id)
+            server = line.env["cx.tower.server"].browse(server_id)
+            with plan_log._collect_plan_steps() as steps:
+                if line._is_executable_line(
+                    server, graph_line=graph.lines.get(line.id)
+                ):
+                    line._run_command(server, plan_log)
+                else:
+                    line._record_skip(server, plan_log)
+                if not steps:
+                    return None
+                return {
+                    "command_log_id": steps[0].id,
+                    "command_status": steps[0].command_status,
+                }
+
+        results = run_in_parallel(self, run, max_workers)
+        return [
+            {"command_log_id": None, "command_status": PLAN_LINE_FAILED}
+            if isinstance(result, Exception)
+            else result
+            for result in results
+        ]
+
     # Check cx.tower.reference.mixin for the function documentation
     def _get_pre_populated_model_data(self):
         res = super()._get_pre_populated_model_data()
@@ -3,6 +3,8 @@
 
 from odoo import _, api, fields, models
 
+from .plan_graph import PLAN_GRAPHS
+
 
 class CxTowerPlanLineAction(models.Model):
     _inherit = ["cx.tower.variable.mixin", "cx.tower.reference.mixin"]
@@ -49,6 +51,19 @@ class CxTowerPlanLineAction(models.Model):
         inverse_name="plan_line_action_id"
     )
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        PLAN_GRAPHS.clear()
+        return super().create(vals_list)
+
+    def write(self, vals):
+        PLAN_GRAPHS.clear()
+        return super().write(vals)
+
+    def unlink(self):
+        PLAN_GRAPHS.clear()
+        return super().unlink()
+
     @api.depends("condition", "action", "value_char")
     def _compute_name(self):
         action_selection_vals = dict(self._fields["action"].selection)  # type: ignore
@@ -1,12 +1,28 @@
 # Copyright (C) 2022 Cetmix OÜ
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
-from odoo import api, fields, models
+import collections
+import contextlib
+import threading
 
-from .constants import PLAN_IS_EMPTY
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+
+from .constants import ANOTHER_PLAN_RUNNING, PLAN_INTERRUPTED, PLAN_IS_EMPTY
+from .cx_tower_server import SSH
+
+# SSH connections shared by all lines of a running flight plan.
+# Connections are not shared between threads.
+# {(database name, plan log id, thread id): SSH()}
+PLAN_SSH_CONNECTIONS = {}
+
+# Finished commands of the flight plans being run by the current thread.
+# `steps` attribute: {(database name, plan log id): deque of command logs}
+PLAN_STEPS = threading.local()
 
 
 class CxTowerPlanLog(models.Model):
     _name = "cx.tower.plan.log"
+    _inherit = ["cx.tower.heartbeat.mixin"]
     _description = "Cetmix Tower Flight Plan Log"
     _order = "start_date desc, id desc"
 
@@ -44,6 +60,18 @@ class CxTowerPlanLog(models.Model):
         comodel_name="cx.tower.plan.line",
         help="Flight Plan line that is being currently executed",
     )
+    plan_line_completed_id = fields.Many2one(
+        comodel_name="cx.tower.plan.line",
+        string="Last Completed Line",
+        help="Last Flight Plan line that was completed. "
+        "Interrupted plan is resumed from the next line",
+    )
+    resumed_from_log_id = fields.Many2one(
+        "cx.tower.plan.log",
+        string="Resumed From",
+        ondelete="set null",
+        help="Interrupted plan log this run is resumed from",
+    )
     command_log_ids = fields.One2many(
         comodel_name="cx.tower.command.log", inverse_name="plan_log_id", auto_join=True
     )
@@ -51,6 +79,13 @@ class CxTowerPlanLog(models.Model):
     parent_flight_plan_log_id = fields.Many2one(
         "cx.tower.plan.log", string="Main Log", ondelete="cascade"
     )
+    fleet_log_id = fields.Many2one(
+        "cx.tower.plan.fleet.log",
+        string="Fleet Log",
+        index=True,
+        ondelete="set null",
+        help="Summary of the Flight Plan executed on multiple servers",
+    )
 
     @api.depends("server_id.name", "name")
     def _compute_name(self):
@@ -97,18 +132,27 @@ class CxTowerPlanLog(models.Model):
             cx.tower.plan.log(): New flightplan log record.
         """
 
-        def get_executable_line(plan, server):
+        graph = plan._get_plan_graph()
+
+        def get_executable_line(lines, server):
             """
             Generator to get each line and check if it's executable.
+            Lines of a parallel group are checked when the group is run.
             """
-            for line in plan.line_ids:
-                yield line, line._is_executable_line(server)
+            for line in lines:
+                graph_line = graph.lines.get(line.id)
+                if graph_line and graph_line.group_line_ids:
+                    yield line, None
+                else:
+                    yield line, line._is_executable_line(server, graph_line=graph_line)
 
+        now = fields.Datetime.now()
         vals = {
             "server_id": server.id,
             "plan_id": plan.id,
             "is_running": True,
-            "start_date": start_date or fields.Datetime.now(),
+            "start_date": start_date or now,
+            "heartbeat_date": now,
         }
 
         # Extract and apply plan log kwargs
@@ -118,24 +162,51 @@ class CxTowerPlanLog(models.Model):
 
         plan_log = self.sudo().create(vals)
 
-        # Process each line until the first executable one is found
-        for line, is_executable in get_executable_line(plan, server):
-            if is_executable:
-                line._execute(server, plan_log, **kwargs)
-                break
-            else:
-                if self._context.get("no_log"):
-                    continue
-                line._skip(server, plan_log)
-                break
-        else:
-            plan_log.sudo().write(
-                {
-                    "is_running": False,
-                    "finish_date": fields.Datetime.now(),
-                    "plan_status": PLAN_IS_EMPTY,
-                }
-            )
+        # Resumed plan is started from the line next to the last completed one
+        lines = plan.line_ids
+        completed_line = plan_log.resumed_from_log_id.plan_line_completed_id
+        if completed_line and completed_line in lines:
+            line_ids = lines.ids
+            lines = lines[line_ids.index(completed_line.id) + 1 :]
+
+        # Open SSH connection shared by all plan lines.
+        # Nested plans reuse the connection of the parent plan.
+        connection_opened = plan_log._open_ssh_connection()
+        try:
+            # Secrets are resolved once per run and removed once it is left
+            with self.env["cx.tower.key"]._cache_secrets():
+                with plan_log._collect_plan_steps() as steps:
+                    # Process each line until the first executable one is found
+                    for line, is_executable in get_executable_line(lines, server):
+                        if is_executable is None:
+                            plan._run_plan_action(plan_log, "n", 0, line, graph=graph)
+                            break
+                        if is_executable:
+                            # Save new log so its heartbeat is visible while running
+                            plan_log._save_plan_checkpoint(executed_line=line)
+                            line._execute(server, plan_log, **kwargs)
+                            break
+                        else:
+                            if self._context.get("no_log"):
+                                continue
+                            line._skip(server, plan_log)
+                            break
+                    else:
+                        plan_log.sudo().write(
+                            {
+                                "is_running": False,
+                                "finish_date": fields.Datetime.now(),
+                                "plan_status": PLAN_IS_EMPTY,
+                            }
+                        )
+
+                    # Run the rest of the plan
+                    plan_log._run_plan_steps(steps)
+        finally:
+            # Plan lines can be still running asynchronously.
+            # They will open their own connections in this case.
+            if connection_opened:
+                plan_log._close_ssh_connection()
 
         return plan_log
 
@@ -156,8 +227,53 @@ class CxTowerPlanLog(models.Model):
         if kwargs:
             values.update(kwargs)
         self.sudo().write(values)
+        self._close_ssh_connection()
         self._plan_finished()
 
+    def _open_ssh_connection(self):
+        """Open SSH connection that will be shared by all plan lines.
+        Connection is not opened if parent plan already has one.
+
+        Returns:
+            bool: True if a new connection was opened
+        """
+        self.ensure_one()
+        if self._get_ssh_connection():
+            return False
+        client = self.server_id._connect(raise_on_error=False)
+        if not isinstance(client, SSH):
+            return False
+        key = (self.env.cr.dbname, self.id, threading.get_ident())
+        PLAN_SSH_CONNECTIONS[key] = client
+        return True
+
+    def _get_ssh_connection(self):
+        """Get SSH connection of the running plan.
+        Nested plans use connection of the parent plan.
+
+        Returns:
+            SSH: SSH client or None if no connection is opened
+        """
+        self.ensure_one()
+        dbname = self.env.cr.dbname
+        thread_id = threading.get_ident()
+        plan_log = self
+        while plan_log:
+            client = PLAN_SSH_CONNECTIONS.get((dbname, plan_log.id, thread_id))
+            if client and plan_log.server_id == self.server_id:
+                return client
+            plan_log = plan_log.parent_flight_plan_log_id
+        return None
+
+    def _close_ssh_connection(self):
+        """Close SSH connections opened for selected plan logs"""
+        dbname = self.env.cr.dbname
+        thread_id = threading.get_ident()
+        for plan_log in self:
+            client = PLAN_SSH_CONNECTIONS.pop((dbname, plan_log.id, thread_id), None)
+            if client:
+                client.disconnect()
+
     def _plan_finished(self):
         """Triggered when flightplan in finished
         Inherit to implement your own hooks
@@ -173,5 +289,196 @@ class CxTowerPlanLog(models.Model):
 
         """
         self.ensure_one()
-        # Get next line to execute
-        self.plan_id._run_next_action(command_log)  # type: ignore
+        # Plan is being run by this thread already.
+        # Next line will be executed once the current step returns.
+        steps = self._get_plan_steps()
+        if steps is not None:
+            steps.append(command_log)
+            return
+
+        # Command was finished outside of the plan loop, eg asynchronously
+        with self.env["cx.tower.key"]._cache_secrets():
+            with self._collect_plan_steps() as steps:
+                steps.append(command_log)
+                self._run_plan_steps(steps)
+
+    def _get_plan_steps(self):
+        """Get queue of finished commands if the plan
+        is being run by the current thread.
+
+        Returns:
+            collections.deque: command logs or None
+        """
+        self.ensure_one()
+        running_steps = getattr(PLAN_STEPS, "steps", None)
+        if not running_steps:
+            return None
+        return running_steps.get((self.env.cr.dbname, self.id))
+
+    @contextlib.contextmanager
+    def _collect_plan_steps(self):
+        """Collect commands finished while the plan is being run.
+        Commands are queued instead of triggering the next line directly
+        so the call stack does not grow with each plan line.
+        Queue that is already collected is restored on exit.
+
+        Yields:
+            collections.deque: command logs
+        """
+        self.ensure_one()
+        if not hasattr(PLAN_STEPS, "steps"):
+            PLAN_STEPS.steps = {}
+        key = (self.env.cr.dbname, self.id)
+        previous_steps = PLAN_STEPS.steps.get(key)
+        steps = PLAN_STEPS.steps[key] = collections.deque()
+        try:
+            yield steps
+        finally:
+            if previous_steps is None:
+                PLAN_STEPS.steps.pop(key, None)
+            else:
+                PLAN_STEPS.steps[key] = previous_steps
+
+    def _run_plan_steps(self, steps):
+        """Run plan lines one by one until no finished command is left.
+        Each step runs the next action for a finished command
+        which in turn can queue a new finished command.
+
+        Args:
+            steps (collections.deque): finished command logs
+        """
+        self.ensure_one()
+        while steps:
+            command_log = steps.popleft()
+            # Get next line to execute
+            self.plan_id._run_next_action(command_log)  # type: ignore
+
+    def _save_plan_checkpoint(self, completed_line=None, executed_line=None):
+        """Save plan progress and commit it.
+        Heartbeat is updated so the plan is not considered interrupted.
+        Log is not modified again while the next line is running
+        so its heartbeat can be updated by the command runner.
+
+        Args:
+            completed_line (cx.tower.plan.line(), optional): line
+                that is completed and will not be run again on resume
+            executed_line (cx.tower.plan.line(), optional): line
+                that is going to be run next
+        """
+        self.ensure_one()
+        vals = {"heartbeat_date": fields.Datetime.now()}
+        if completed_line:
+            vals["plan_line_completed_id"] = completed_line.id
+        if executed_line:
+            vals["plan_line_executed_id"] = executed_line.id
+        self.sudo().write(vals)
+        self._commit_plan_checkpoint()
+
+    def _commit_plan_checkpoint(self):
+        """Commit plan progress between plan lines.
+        So finished lines are saved even if the plan is interrupted later.
+        Check `_can_commit_plan_checkpoint` for the conditions.
+        """
+        if self._can_commit_plan_checkpoint():
+            self.env.cr.commit()  # pylint: disable=invalid-commit
+
+    def _can_commit_plan_checkpoint(self):
+        """Check if plan progress can be committed.
+        Transaction is committed only if the plan runs in a cursor
+        opened for it, eg by `tools.run_in_parallel`. Such cursors set the
+        `cx_tower_commit_allowed` context key. Cursors of the requests that
+        start the plan are never committed unless the
+        `cetmix_tower_server.plan_checkpoint_commit` system parameter is set.
+        Never committed in test mode.
+
+        Returns:
+            bool: True if transaction can be committed
+        """
+        if self.pool.in_test_mode():
+            return False
+        commit_allowed = self.env.context.get("cx_tower_commit_allowed")
+        if commit_allowed is not None:
+            return bool(commit_allowed)
+        return self.env["ir.config_parameter"].sudo().get_param(
+            "cetmix_tower_server.plan_checkpoint_commit", "False"
+        ) in ("True", "1")
+
+    def action_resume(self):
+        """Resume interrupted plan from the line next
+        to the last completed one.
+
+        Returns:
+            dict: action that opens the new plan log
+        """
+        self.ensure_one()
+        if self.is_running or self.plan_status != PLAN_INTERRUPTED:
+            raise UserError(_("Only interrupted flight plans can be resumed"))
+        completed_line = self.plan_line_completed_id
+        if completed_line:
+            graph_line = self.plan_id._get_plan_graph().lines.get(completed_line.id)
+            if not graph_line:
+                raise UserError(
+                    _(
+                        "Flight plan cannot be resumed because "
+                        "the last completed line was removed from it"
+                    )
+                )
+            if not graph_line.next_line_id:
+                raise UserError(_("All lines of the flight plan are completed"))
+
+        plan_status = self.plan_id._execute_single(
+            self.server_id,
+            plan_log={"label": self.label, "resumed_from_log_id": self.id},
+        )
+        if plan_status == ANOTHER_PLAN_RUNNING:
+            raise UserError(_("Flight plan is already running on this server"))
+
+        resumed_log = self.search([("resumed_from_log_id", "=", self.id)], limit=1)
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": resumed_log.id,
+            "view_mode": "form",
+            "target": "current",
+        }
+
+    @api.model
+    def _get_alive_plan_log_ids(self):
+        """Get ids of running plans that are still reporting heartbeats.
+        Plan is alive if its heartbeat or heartbeat of any of its running
+        commands is not expired. Nested plans keep their parent plans alive.
+
+        Returns:
+            set: plan log ids
+        """
+        expire_date = self._get_heartbeat_expire_date()
+        plan_logs = self.sudo().search(
+            [("is_running", "=", True), ("heartbeat_date", ">=", expire_date)]
+        )
+        plan_logs |= (
+            self.env["cx.tower.command.log"]
+            .sudo()
+            .search(
+                [
+                    ("is_running", "=", True),
+                    ("plan_log_id", "!=", False),
+                    ("heartbeat_date", ">=", expire_date),
+                ]
+            )
+            .mapped("plan_log_id")
+        )
+        alive_ids = set()
+        for plan_log in plan_logs:
+            while plan_log and plan_log.id not in alive_ids:
+                alive_ids.add(plan_log.id)
+                plan_log = plan_log.parent_flight_plan_log_id
+        return alive_ids
+
+    # Check cx.tower.heartbeat.mixin for the function documentation
+    def _get_alive_run_ids(self):
+        return set(self.ids) & self._get_alive_plan_log_ids()
+
+    # Check cx.tower.heartbeat.mixin for the function documentation
+    def _finish_interrupted_runs(self):
+        for plan_log in self:
+            plan_log.finish(PLAN_INTERRUPTED)
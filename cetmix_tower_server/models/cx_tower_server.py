@@ -3,21 +3,42 @@
 import ast
 import io
 import logging
+import os
+import select
+import shlex
+from functools import partial
 
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError, ValidationError
+from odoo.tools import ormcache
 from odoo.tools.safe_eval import safe_eval
 
+from .command_output import COMMAND_OUTPUT_CHUNK_SIZE, StatusMarkerFilter
 from .constants import (
     ANOTHER_COMMAND_RUNNING,
     FILE_CREATION_FAILED,
     NO_COMMAND_RUNNER_FOUND,
     PYTHON_COMMAND_ERROR,
 )
-from .tools import generate_random_id
+from .cx_tower_template_mixin import SYSTEM_VARIABLE_REFERENCES
+from .ssh_host_keys import SSH_HOST_KEYS, TrustedHostKeyPolicy
+from .ssh_key_cache import SSH_KEY_CACHE
+from .ssh_pool import (
+    SSH_POOL,
+    SSH_POOL_ACQUIRE_TIMEOUT,
+    SSH_POOL_IDLE_TIMEOUT,
+    SSH_POOL_MAX_PER_SERVER,
+    SSH_POOL_MAX_TOTAL,
+)
+from .tools import generate_random_id, run_in_parallel
+from .variable_snapshot import VARIABLE_SNAPSHOTS
 
 _logger = logging.getLogger(__name__)
 
+# Default number of servers processed in parallel.
+# Can be overridden using the `cetmix_tower_server.max_parallel_servers`
+# system parameter.
+MAX_PARALLEL_SERVERS = 8
 
 try:
     from paramiko import (
@@ -25,6 +46,7 @@ try:
         DSSKey,
         ECDSAKey,
         Ed25519Key,
+        HostKeys,
         RSAKey,
         SFTPClient,
         SSHClient,
@@ -34,7 +56,7 @@ except ImportError:
     _logger.error(
         "import 'paramiko' error, please try to install: pip install paramiko"
     )
-    AutoAddPolicy = RSAKey = SSHClient = None
+    AutoAddPolicy = HostKeys = RSAKey = SSHClient = None
 
 
 class SSH(object):
@@ -52,6 +74,10 @@ class SSH(object):
         mode="p",
         allow_agent=False,
         timeout=5000,
+        use_pool=True,
+        ssh_key_id=None,
+        host_keys=None,
+        on_new_host_key=None,
     ):
         self.host = host
         self.port = port
@@ -59,10 +85,19 @@ class SSH(object):
         self.mode = mode
         self.password = password
         self.ssh_key = ssh_key
+        # Id of the `cx.tower.key` record. Used to cache the parsed key.
+        self.ssh_key_id = ssh_key_id
         self.timeout = timeout
         # NB: allow_agent=False is for avoiding
         # ssh-agent related connection issues~
         self.allow_agent = allow_agent
+        # Take connections from the process-wide pool
+        self.use_pool = use_pool
+        # Trusted host keys {key type: base64 key}.
+        # System known hosts file is used if not set.
+        self.host_keys = host_keys
+        self.on_new_host_key = on_new_host_key
+        self.pool_key = SSH_POOL.make_key(host, port, username, mode, password, ssh_key)
 
         self._ssh = None
         self._sftp = None
@@ -77,8 +112,26 @@ class SSH(object):
         """
         Retrieve the SSH key object for establishing an SSH connection.
 
-        This function attempts to load the key using supported formats
-        (RSA, DSS, ECDSA, Ed25519).
+        Keys of `cx.tower.key` records are taken from the parsed keys cache.
+
+        Returns:
+            pkey object: The SSH key object for use in connection parameters.
+
+        Raises:
+            ValidationError: If the key format is unsupported or the key is
+            incorrect.
+        """
+        if self.ssh_key_id:
+            return SSH_KEY_CACHE.get(self.ssh_key_id, self.ssh_key, self._load_ssh_key)
+        return self._load_ssh_key()
+
+    def _load_ssh_key(self, key_class=None):
+        """
+        Parse the SSH key trying supported formats (RSA, DSS, ECDSA, Ed25519).
+
+        Args:
+            key_class (PKey subclass, optional): format tried first.
+                Eg the one detected for this key previously.
 
         Returns:
             pkey object: The SSH key object for use in connection parameters.
@@ -87,15 +140,20 @@ class SSH(object):
             ValidationError: If the key format is unsupported or the key is
             incorrect.
         """
+        pkey_classes = [RSAKey, DSSKey, ECDSAKey, Ed25519Key]
+        if key_class in pkey_classes:
+            pkey_classes.remove(key_class)
+            pkey_classes.insert(0, key_class)
+
         ssh_key_file = io.StringIO(self.ssh_key)
-        for pkey_class in (RSAKey, DSSKey, ECDSAKey, Ed25519Key):
+        for pkey_class in pkey_classes:
             try:
                 # reset file pointer to the start for each key format attempt
                 ssh_key_file.seek(0)
                 return pkey_class.from_private_key(ssh_key_file)
             except SSHException:
-                _logger.warning(
-                    f"{pkey_class.__name__} failed to load key, trying next format."
+                _logger.debug(
+                    "%s failed to load key, trying next format.", pkey_class.__name__
                 )
 
         _logger.error("Failed to load SSH key: unsupported format or incorrect key.")
@@ -103,13 +161,40 @@ class SSH(object):
             _("Error loading a private key. Unsupported key format or incorrect key.")
         )
 
+    def _load_system_host_keys(self):
+        """Load host keys from the system known hosts file.
+        Used to check the host key on the first connection
+        when no keys are trusted for the server yet.
+
+        Returns:
+            HostKeys: system host keys. Empty if the file cannot be read.
+        """
+        host_keys = HostKeys()
+        try:
+            host_keys.load(os.path.expanduser("~/.ssh/known_hosts"))
+        except IOError:
+            pass
+        return host_keys
+
     def _connect(self):
         """
         Connect to remote host
         """
         self._ssh = SSHClient()  # type: ignore
-        self._ssh.load_system_host_keys()
-        self._ssh.set_missing_host_key_policy(AutoAddPolicy())  # type: ignore
+        if self.host_keys is None:
+            self._ssh.load_system_host_keys()
+            self._ssh.set_missing_host_key_policy(AutoAddPolicy())  # type: ignore
+        else:
+            # Client has no host keys so each key is checked by the policy
+            self._ssh.set_missing_host_key_policy(
+                TrustedHostKeyPolicy(
+                    self.host_keys,
+                    self.on_new_host_key,
+                    system_host_keys=(
+                        None if self.host_keys else self._load_system_host_keys()
+                    ),
+                )
+            )
         kwargs = {
             "hostname": self.host,
             "port": self.port,
@@ -129,37 +214,88 @@ class SSH(object):
                     "pkey": self._get_ssh_key(),
                 }
             )
-        self._ssh.connect(**kwargs)
+        try:
+            self._ssh.connect(**kwargs)
+        except Exception:
+            self._ssh.close()
+            self._ssh = None
+            raise
         return self._ssh
 
     @property
     def connection(self):
         """
-        Open SSH connection to remote host.
+        Get SSH connection to remote host.
+        Connection is taken from the pool and is kept until `disconnect()`
+        is called. A new connection is opened if the current one is broken.
+        Only the transport state is checked here, the pool probes
+        the connection when it is taken from the pool.
         """
-        return self._connect()
+        if self._ssh and SSH_POOL.is_alive(self._ssh):
+            return self._ssh
+        if self._ssh:
+            self.disconnect()
+        if self.use_pool:
+            self._ssh = SSH_POOL.acquire(self.pool_key, self._connect)
+        else:
+            self._connect()
+        return self._ssh
 
     @property
     def sftp(self):
         """
-        Open SFTP connection to remote host.
+        Get SFTP client for remote host.
+        SFTP session is opened on first access and is reused until
+        `disconnect()` is called or the underlying connection is broken.
         """
+        if self._sftp and self._is_sftp_alive():
+            return self._sftp
+        self._close_sftp()
         self._sftp = SFTPClient.from_transport(self.connection.get_transport())  # type: ignore
         return self._sftp
 
+    def _is_sftp_alive(self):
+        """Check if the cached SFTP session can be used.
+
+        Returns:
+            bool: True if SFTP channel is open and belongs
+                to the current SSH connection
+        """
+        channel = self._sftp.get_channel()
+        if not channel or channel.closed or not self._ssh:
+            return False
+        if channel.get_transport() is not self._ssh.get_transport():
+            return False
+        return SSH_POOL.is_alive(self._ssh)
+
+    def _close_sftp(self):
+        """Close SFTP session ignoring errors"""
+        if not self._sftp:
+            return
+        logging.getLogger("paramiko").info("Disconnect SFTP connection")
+        try:
+            self._sftp.close()
+        except Exception as e:
+            _logger.debug("Error closing SFTP connection: %s", e)
+        self._sftp = None
+
     def disconnect(self):
         """
-        Close SSH & SFTP connection.
+        Close SFTP connection and return SSH connection to the pool.
+        SSH connection is closed if pool is not used.
         """
         logger = logging.getLogger("paramiko")
+        self._close_sftp()
         if self._ssh:
-            logger.info("Disconnect SSH connection")
-            self._ssh.close()
-        if self._sftp:
-            logger.info("Disconnect SFTP connection")
-            self._sftp.close()
+            if self.use_pool:
+                logger.info("Release SSH connection")
+                SSH_POOL.release(self.pool_key, self._ssh)
+            else:
+                logger.info("Disconnect SSH connection")
+                self._ssh.close()
+            self._ssh = None
 
-    def exec_command(self, command, sudo=None):
+    def exec_command(self, command, sudo=None, output_collector=None):
         """_summary_
 
         Args:
@@ -168,6 +304,9 @@ class SSH(object):
                 - 'n': no password
                 - 'p': with password
                 - Defaults to None.
+            output_collector (CommandOutputCollector, optional): collector
+                that receives output while command is running.
+                Response and error are not returned in this case.
 
         Returns:
             status, response, error
@@ -190,11 +329,42 @@ class SSH(object):
             stdin.flush()
             # TODO: add password error check
 
+        if output_collector is not None:
+            status = self._read_output(stdout.channel, output_collector)
+            return status, [], []
+
         status = stdout.channel.recv_exit_status()
         response = stdout.readlines()
         error = stderr.readlines()
         return status, response, error
 
+    def _read_output(self, channel, output_collector):
+        """Read command output in chunks while the command is running.
+        Only the unsaved part of the output is kept in memory.
+
+        Args:
+            channel (paramiko.Channel): command channel
+            output_collector (CommandOutputCollector): output collector
+
+        Returns:
+            Int: command exit status
+        """
+        while True:
+            while channel.recv_ready():
+                output_collector.add_response(channel.recv(COMMAND_OUTPUT_CHUNK_SIZE))
+            while channel.recv_stderr_ready():
+                output_collector.add_error(
+                    channel.recv_stderr(COMMAND_OUTPUT_CHUNK_SIZE)
+                )
+            if (channel.eof_received or channel.closed) and not (
+                channel.recv_ready() or channel.recv_stderr_ready()
+            ):
+                break
+            # Wait for new data
+            select.select([channel], [], [], 1)
+            output_collector.flush_if_due()
+        return channel.recv_exit_status()
+
     def delete_file(self, remote_path):
         """
         Delete file from remote server
@@ -246,8 +416,10 @@ class SSH(object):
         Returns:
             Result (Bytes): file content.
         """
-        file = self.sftp.open(remote_path)
-        return file.read()
+        with self.sftp.open(remote_path) as file:
+            # Request all file blocks at once instead of one by one
+            file.prefetch()
+            return file.read()
 
 
 class CxTowerServer(models.Model):
@@ -298,15 +470,59 @@ class CxTowerServer(models.Model):
         default="p",
         required=True,
     )
+    ssh_host_keys = fields.Text(
+        string="SSH Host Keys",
+        copy=False,
+        groups="cetmix_tower_server.group_manager",
+        help="Trusted SSH host keys, one '<key type> <base64 key>' per line. "
+        "Host key is saved automatically on the first connection. "
+        "Clear this field to accept a new host key.",
+    )
     use_sudo = fields.Selection(
         string="Use sudo",
         selection=[("n", "Without password"), ("p", "With password")],
         help="Run commands using 'sudo'",
     )
+    sudo_single_session = fields.Boolean(
+        string="Sudo in Single Session",
+        help="Run all parts of a command chain in a single remote shell "
+        "when using 'sudo' with password. "
+        "Password is sent only once and the chain stops on the first error",
+    )
+    output_policy = fields.Selection(
+        selection=[
+            ("full", "Keep Full Output"),
+            ("limit", "Keep Head and Tail"),
+        ],
+        default="full",
+        required=True,
+        help="How output of the commands run on this server is saved "
+        "in the command log. Can be overridden in the command",
+    )
+    output_head_kb = fields.Integer(
+        string="Output Head, KB",
+        default=64,
+        help="Amount of output kept from the beginning",
+    )
+    output_tail_kb = fields.Integer(
+        string="Output Tail, KB",
+        default=64,
+        help="Amount of output kept from the end",
+    )
+    output_attachment = fields.Boolean(
+        string="Save Full Output",
+        help="Save full output as a compressed attachment of the command log "
+        "when the output is truncated",
+    )
     # ---- Variables
     variable_value_ids = fields.One2many(
         inverse_name="server_id"  # Other field properties are defined in mixin
     )
+    variable_version = fields.Integer(
+        copy=False,
+        readonly=True,
+        help="Increased when any variable value used by the server is modified",
+    )
 
     # ---- Keys
     secret_ids = fields.One2many(
@@ -435,6 +651,23 @@ class CxTowerServer(models.Model):
                 validation_error = "\n".join(validation_errors)
                 raise ValidationError(validation_error)
 
+    def write(self, vals):
+        """Drop pooled SSH connections if connection settings are changed"""
+        pool_keys = []
+        if any(field in vals for field in self._get_ssh_connection_fields()):
+            pool_keys = self._get_ssh_pool_keys()
+        result = super().write(vals)
+        if pool_keys:
+            SSH_POOL.invalidate(pool_keys)
+        return result
+
+    def unlink(self):
+        """Drop pooled SSH connections of deleted servers"""
+        pool_keys = self._get_ssh_pool_keys()
+        result = super().unlink()
+        SSH_POOL.invalidate(pool_keys)
+        return result
+
     @api.returns("self", lambda value: value.id)
     def copy(self, default=None):
         default = default or {}
@@ -531,8 +764,159 @@ class CxTowerServer(models.Model):
         command = "uname -a"
         return command
 
+    def _get_ssh_connection_fields(self):
+        """Fields that affect SSH connection.
+        Pooled connections are dropped when any of these fields is modified.
+
+        Returns:
+            list: field names
+        """
+        return [
+            "ip_v4_address",
+            "ip_v6_address",
+            "ssh_port",
+            "ssh_username",
+            "ssh_password",
+            "ssh_key_id",
+            "ssh_auth_mode",
+        ]
+
+    def _get_ssh_pool_keys(self):
+        """Get SSH connection pool keys for selected servers
+
+        Returns:
+            list: pool keys
+        """
+        return [
+            SSH_POOL.make_key(
+                server.ip_v4_address or server.ip_v6_address,
+                server.ssh_port,
+                server.ssh_username,
+                server.ssh_auth_mode,
+                server._get_password(),
+                server._get_ssh_key(),
+            )
+            for server in self
+        ]
+
+    def _get_ssh_host_keys(self):
+        """Get trusted host keys of the server.
+
+        Returns:
+            dict: {key type: base64 key}
+        """
+        self.ensure_one()
+        return self._parse_ssh_host_keys(self.sudo().ssh_host_keys)
+
+    @api.model
+    def _parse_ssh_host_keys(self, text):
+        """Parse host keys text.
+
+        Args:
+            text (Text): host keys, one '<key type> <base64 key>' per line
+
+        Returns:
+            dict: {key type: base64 key}
+        """
+        host_keys = {}
+        for line in (text or "").splitlines():
+            parts = line.split()
+            if len(parts) >= 2:
+                host_keys[parts[0]] = parts[1]
+        return host_keys
+
+    def _save_ssh_host_keys(self):
+        """Save host keys accepted on first connection to these servers.
+        Keys collected for other servers are left for the threads
+        that connect to them.
+        """
+        new_host_keys = SSH_HOST_KEYS.pop(self.env.cr.dbname, self.ids)
+        if not new_host_keys:
+            return
+        servers = self.sudo().browse(list(new_host_keys)).exists()
+        for server in servers:
+            host_keys = self._parse_ssh_host_keys(server.ssh_host_keys)
+            for key_type, key in new_host_keys[server.id].items():
+                host_keys.setdefault(key_type, key)
+            server.ssh_host_keys = "\n".join(
+                f"{key_type} {key}" for key_type, key in host_keys.items()
+            )
+
+    @api.model
+    def _configure_ssh_pool(self):
+        """Apply SSH connection pool settings from system parameters"""
+        SSH_POOL.configure(**self._get_ssh_pool_settings())
+
+    @api.model
+    @ormcache()
+    def _get_ssh_pool_settings(self):
+        """Get SSH connection pool settings from system parameters.
+        Cached until system parameters are modified.
+
+        Returns:
+            dict: keyword arguments for `SSHConnectionPool.configure()`
+        """
+        get_param = self.env["ir.config_parameter"].sudo().get_param
+        return {
+            "idle_timeout": int(
+                get_param(
+                    "cetmix_tower_server.ssh_pool_idle_timeout", SSH_POOL_IDLE_TIMEOUT
+                )
+            ),
+            "max_per_server": int(
+                get_param(
+                    "cetmix_tower_server.ssh_pool_max_per_server",
+                    SSH_POOL_MAX_PER_SERVER,
+                )
+            ),
+            "max_total": int(
+                get_param("cetmix_tower_server.ssh_pool_max_total", SSH_POOL_MAX_TOTAL)
+            ),
+            "acquire_timeout": int(
+                get_param(
+                    "cetmix_tower_server.ssh_pool_acquire_timeout",
+                    SSH_POOL_ACQUIRE_TIMEOUT,
+                )
+            ),
+        }
+
+    def _run_in_parallel(self, func, max_workers=None, stop=None):
+        """Run function for each server of the recordset in parallel.
+        Each thread uses its own cursor which is committed
+        when the function is finished. Threads can see only committed data,
+        so servers are processed one by one in the current transaction
+        if it has uncommitted changes. Check `tools.run_in_parallel`
+        for details.
+
+        Args:
+            func (callable): function that receives a single server record.
+                Use `server.env` to access other records and return plain values
+                because the thread cursor is closed after the function is finished.
+            max_workers (Int, optional): number of servers processed at a time.
+                Defaults to the `cetmix_tower_server.max_parallel_servers`
+                system parameter.
+            stop (callable, optional): function that receives a function
+                result or exception. If it returns True no more servers
+                are started. Servers that are already running are finished anyway.
+
+        Returns:
+            list: function results or exceptions in the same order as servers.
+                None is returned for servers that were not started.
+        """
+        if max_workers is None:
+            max_workers = int(
+                self.env["ir.config_parameter"]
+                .sudo()
+                .get_param(
+                    "cetmix_tower_server.max_parallel_servers", MAX_PARALLEL_SERVERS
+                )
+            )
+        return run_in_parallel(self, func, max_workers, stop=stop)
+
     def _connect(self, raise_on_error=True):
-        """_summary_
+        """Get SSH client for the server.
+        Connection itself is taken from the SSH connection pool
+        when the client is used for the first time.
 
         Args:
             raise_on_error (bool, optional): If true will raise exception
@@ -540,6 +924,8 @@ class CxTowerServer(models.Model):
             Defaults to True.
         """
         self.ensure_one()
+        self._configure_ssh_pool()
+        self._save_ssh_host_keys()
         try:
             client = SSH(
                 host=self.ip_v4_address or self.ip_v6_address,
@@ -548,6 +934,9 @@ class CxTowerServer(models.Model):
                 mode=self.ssh_auth_mode,
                 password=self._get_password(),
                 ssh_key=self._get_ssh_key(),
+                ssh_key_id=self.ssh_key_id.id,
+                host_keys=self._get_ssh_host_keys(),
+                on_new_host_key=partial(SSH_HOST_KEYS.add, self.env.cr.dbname, self.id),
             )
         except Exception as e:
             if raise_on_error:
@@ -617,6 +1006,172 @@ class CxTowerServer(models.Model):
         }
         return notification
 
+    def init(self):
+        """Create sequence used for variable versions
+        and the single row table holding the global version
+        """
+        self._cr.execute(
+            "CREATE SEQUENCE IF NOT EXISTS cx_tower_server_variable_version_seq"
+        )
+        self._cr.execute(
+            "CREATE TABLE IF NOT EXISTS cx_tower_server_variable_global_version "
+            "(version BIGINT NOT NULL)"
+        )
+        self._cr.execute(
+            "INSERT INTO cx_tower_server_variable_global_version (version) "
+            "SELECT 0 WHERE NOT EXISTS "
+            "(SELECT 1 FROM cx_tower_server_variable_global_version)"
+        )
+
+    @api.model
+    def _increase_variable_version(self, server_ids=None):
+        """Mark cached variable values of servers as outdated.
+        Versions are taken from a database sequence so the same version
+        is never reused even if the transaction is rolled back.
+
+        Args:
+            server_ids (list of Int, optional): server ids.
+                If not provided the global version shared by all servers
+                is increased instead of updating each server.
+        """
+        if server_ids is None:
+            # Plain update, config parameters would clear all registry caches
+            self._cr.execute(
+                "UPDATE cx_tower_server_variable_global_version SET version = "
+                "nextval('cx_tower_server_variable_version_seq')"
+            )
+        elif server_ids:
+            self._cr.execute(
+                "UPDATE cx_tower_server SET variable_version = "
+                "nextval('cx_tower_server_variable_version_seq') WHERE id IN %s",
+                (tuple(server_ids),),
+            )
+            self.invalidate_cache(["variable_version"], server_ids)
+
+    @api.model
+    def _get_global_variable_version(self):
+        """Get version of the values shared by all servers.
+        Read in the current transaction so it always matches the values read.
+
+        Returns:
+            Int: version
+        """
+        self._cr.execute("SELECT version FROM cx_tower_server_variable_global_version")
+        row = self._cr.fetchone()
+        return row[0] if row else None
+
+    def get_variable_values(self, variable_references):
+        """Get variable values for selected servers.
+        Values are taken from the server variable snapshots when possible.
+        Missing values are rendered in bulk for all servers and saved
+        to the snapshots.
+        System variables and values that use them are resolved every time.
+
+        Args:
+            variable_references (list of Char): variable names
+
+        Returns:
+            dict {record_id: {variable_reference: value}}
+        """
+        if not variable_references:
+            return super().get_variable_values(variable_references)
+
+        res = {}
+        snapshots = {}
+        # {missing references: server ids}
+        pending = {}
+        global_version = self._get_global_variable_version()
+        for server in self:
+            snapshot = server._get_variable_snapshot(global_version)
+            snapshot_values = snapshot["values"] if snapshot else {}
+            values = {}
+            missing = []
+            for reference in variable_references:
+                if reference in snapshot_values:
+                    values[reference] = snapshot_values[reference]
+                else:
+                    missing.append(reference)
+            res[server.id] = values
+            snapshots[server.id] = snapshot
+            if missing:
+                pending.setdefault(tuple(missing), set()).add(server.id)
+
+        for references, server_ids in pending.items():
+            servers = self.filtered(lambda rec, ids=server_ids: rec.id in ids)
+            rendered = servers._render_variable_snapshot_values(list(references))
+            for server in servers:
+                values, volatile = rendered[server.id]
+                res[server.id].update(values)
+                snapshot = snapshots[server.id]
+                if snapshot is not None:
+                    snapshot["values"].update(
+                        {
+                            reference: value
+                            for reference, value in values.items()
+                            if reference not in volatile
+                        }
+                    )
+        return res
+
+    def _get_variable_snapshot(self, global_version=None):
+        """Get rendered variable values of the server.
+        Snapshot is filled with values as they are requested
+        and is replaced once the variable version is changed.
+
+        Args:
+            global_version (Int, optional): global variable version.
+                Read from the database if not provided.
+
+        Returns:
+            dict: {"values": {variable_reference: value}}
+                or None if snapshot cannot be used
+        """
+        self.ensure_one()
+        if not isinstance(self.id, int):
+            return None
+        if global_version is None:
+            global_version = self._get_global_variable_version()
+        key = (self.env.cr.dbname, self.id, self.env.uid, self.env.su)
+        version = (self.variable_version, global_version)
+        snapshot = VARIABLE_SNAPSHOTS.get(key, version)
+        if snapshot is None:
+            snapshot = {"values": {}}
+            VARIABLE_SNAPSHOTS.set(key, version, snapshot)
+        return snapshot
+
+    def _render_variable_snapshot_values(self, variable_references):
+        """Render variable values of selected servers.
+        Raw values of all servers are read in bulk.
+
+        Args:
+            variable_references (list of Char): variable names
+
+        Returns:
+            dict: {server id: ({variable_reference: value},
+                {references of values that use system variables})}
+        """
+        raw_values = self._get_variable_values_raw(variable_references)
+        res = {}
+        for server in self:
+            values = raw_values.get(server.id, {})
+            graph = server._render_variable_values(values)
+
+            # Values using system variables directly or through other values
+            volatile = set(SYSTEM_VARIABLE_REFERENCES).union(
+                reference
+                for reference, used in graph.items()
+                if set(used).intersection(SYSTEM_VARIABLE_REFERENCES)
+            )
+            changed = True
+            while changed:
+                changed = False
+                for reference, used in graph.items():
+                    if reference not in volatile and volatile.intersection(used):
+                        volatile.add(reference)
+                        changed = True
+            res[server.id] = (values, volatile)
+        return res
+
     def _render_command(self, command, path=None):
         """Renders command code for selected command for current server
 
@@ -633,55 +1188,7 @@ class CxTowerServer(models.Model):
                 }
         """
         self.ensure_one()
-
-        variables = []
-
-        # Get variables from code
-        if command.code:
-            variables_extracted = command.get_variables_from_code(command.code)
-            for ve in variables_extracted:
-                if ve not in variables:
-                    variables.append(ve)
-
-        # Get variables from path
-        path = path if path else command.path
-        if path:
-            variables_extracted = command.get_variables_from_code(path)
-            for ve in variables_extracted:
-                if ve not in variables:
-                    variables.append(ve)
-
-        # Get variable values for current server
-        variable_values_dict = (
-            self.get_variable_values(variables)  # pylint: disable=no-member
-            if variables
-            else False
-        )
-
-        # Extract variable values for current server
-        variable_values = (
-            variable_values_dict.get(self.id) if variable_values_dict else False
-        )  # pylint: disable=no-member
-
-        # Render command code using variables
-        if variable_values:
-            if command.action == "python_code":
-                variable_values["pythonic_mode"] = True
-
-            rendered_code = (
-                command.render_code_custom(command.code, **variable_values)
-                if command.code
-                else False
-            )
-            rendered_path = (
-                command.render_code_custom(path, **variable_values) if path else False
-            )
-
-        else:
-            rendered_code = command.code
-            rendered_path = path
-
-        return {"rendered_code": rendered_code, "rendered_path": rendered_path}
+        return command.render_for_servers(self, path=path)[self.id]
 
     def execute_command(
         self, command, path=None, sudo=None, ssh_connection=None, **kwargs
@@ -768,7 +1275,9 @@ class CxTowerServer(models.Model):
         rendered_command_path = rendered_command["rendered_path"]
 
         # Prepare key renderer values
-        key_vals = kwargs.get("key", {})  # Get vals from kwargs
+        # Get vals from kwargs. Copy them because kwargs can be shared
+        # by several servers, eg when a plan is run on a fleet.
+        key_vals = dict(kwargs.get("key", {}))
         key_vals.update({"server_id": self.id})  # pylint: disable=no-member
         if self.partner_id:
             key_vals.update({"partner_id": self.partner_id.id})
@@ -864,38 +1373,41 @@ class CxTowerServer(models.Model):
         """
         response = None
         need_check_server_status = True
-        if command.action == "ssh_command":
-            response = self._command_runner_ssh(
-                log_record,
-                rendered_command_code,
-                rendered_command_path,
-                ssh_connection,
-                **kwargs,
-            )
-        elif command.action == "file_using_template":
-            response = self._command_runner_file_using_template(
-                log_record,
-                command.file_template_id,
-                rendered_command_path,
-                **kwargs,
-            )
-        elif command.action == "python_code":
-            response = self._command_runner_python_code(
-                log_record,
-                rendered_command_code,
-                **kwargs,
-            )
-        elif command.action == "plan":
-            response = self.with_context(
-                prevent_plan_recursion=True
-            )._command_runner_flight_plan(
-                log_record,
-                command.flight_plan_id,
-                **kwargs,
-            )
-            need_check_server_status = True
-        else:
-            need_check_server_status = False
+        # Report heartbeats while the command is running
+        heartbeat_runs = log_record or self.env["cx.tower.command.log"]
+        with heartbeat_runs._keep_heartbeat():
+            if command.action == "ssh_command":
+                response = self._command_runner_ssh(
+                    log_record,
+                    rendered_command_code,
+                    rendered_command_path,
+                    ssh_connection,
+                    **kwargs,
+                )
+            elif command.action == "file_using_template":
+                response = self._command_runner_file_using_template(
+                    log_record,
+                    command.file_template_id,
+                    rendered_command_path,
+                    **kwargs,
+                )
+            elif command.action == "python_code":
+                response = self._command_runner_python_code(
+                    log_record,
+                    rendered_command_code,
+                    **kwargs,
+                )
+            elif command.action == "plan":
+                response = self.with_context(
+                    prevent_plan_recursion=True
+                )._command_runner_flight_plan(
+                    log_record,
+                    command.flight_plan_id,
+                    **kwargs,
+                )
+                need_check_server_status = True
+            else:
+                need_check_server_status = False
 
         if (
             need_check_server_status
@@ -1048,17 +1560,28 @@ class CxTowerServer(models.Model):
             command_path=rendered_command_path,
             raise_on_error=False,
             sudo=self._context.get("use_sudo"),
+            stream_log_record=log_record,
             **kwargs,
         )
 
         # Log result
         if log_record:
-            log_record.finish(
-                fields.Datetime.now(),
-                command_result["status"],
-                command_result["response"],
-                command_result["error"],
-            )
+            if command_result.get("streamed"):
+                # Output is already saved in the log while command was running
+                if command_result["response"] or command_result["error"]:
+                    log_record._append_output(
+                        command_result["response"], command_result["error"]
+                    )
+                log_record.with_context(command_output_streamed=True).finish(
+                    fields.Datetime.now(), command_result["status"]
+                )
+            else:
+                log_record.finish(
+                    fields.Datetime.now(),
+                    command_result["status"],
+                    command_result["response"],
+                    command_result["error"],
+                )
         else:
             return command_result
 
@@ -1179,6 +1702,8 @@ class CxTowerServer(models.Model):
                     Following keys are supported by default:
                         - "log": {values passed to logger}
                         - "key": {values passed to key parser}
+                        - "stream_log_record": cx.tower.command.log() to save
+                            output into while command is running
 
         Raises:
             ValidationError: if client is not valid
@@ -1188,7 +1713,8 @@ class CxTowerServer(models.Model):
             dict: {
                 "status": <int>,
                 "response": Text,
-                "error": Text
+                "error": Text,
+                "streamed": <bool>, only if output was saved to the log
             }
         """
         if not client:
@@ -1201,6 +1727,17 @@ class CxTowerServer(models.Model):
         command_code = code_and_secrets["code"]
         secrets = code_and_secrets["key_values"]
 
+        # Run the whole chain in a single shell session
+        if sudo == "p" and self.sudo_single_session:
+            return self._execute_command_using_ssh_single_session(
+                client,
+                command_code,
+                secrets,
+                command_path=command_path,
+                raise_on_error=raise_on_error,
+                **kwargs,
+            )
+
         # Prepare ssh command
         prepared_command_code = self._prepare_ssh_command(
             command_code,
@@ -1208,6 +1745,14 @@ class CxTowerServer(models.Model):
             sudo,
         )
 
+        # Save output to the log while command is running
+        stream_log_record = kwargs.get("stream_log_record")
+        output_collector = (
+            stream_log_record._get_output_collector(secrets)
+            if stream_log_record
+            else None
+        )
+
         try:
             status = []
             response = []
@@ -1216,13 +1761,17 @@ class CxTowerServer(models.Model):
             # Command is a single sting. No 'sudo' or 'sudo' w/o password
             if isinstance(prepared_command_code, str):
                 status, response, error = client.exec_command(
-                    prepared_command_code, sudo=sudo
+                    prepared_command_code,
+                    sudo=sudo,
+                    output_collector=output_collector,
                 )
 
             # Multiple commands: sudo with password
             elif isinstance(prepared_command_code, list):
                 for cmd in prepared_command_code:
-                    st, resp, err = client.exec_command(cmd, sudo=sudo)
+                    st, resp, err = client.exec_command(
+                        cmd, sudo=sudo, output_collector=output_collector
+                    )
                     status.append(st)
                     response += resp
                     error += err
@@ -1241,8 +1790,166 @@ class CxTowerServer(models.Model):
                 status = -1
                 response = []
                 error = [e]
+        finally:
+            if output_collector:
+                output_collector.flush(final=True)
+
+        self._save_ssh_host_keys()
+        result = self._parse_command_results(status, response, error, secrets, **kwargs)
+        if output_collector:
+            result["streamed"] = True
+        return result
 
-        return self._parse_command_results(status, response, error, secrets, **kwargs)
+    def _execute_command_using_ssh_single_session(
+        self,
+        client,
+        command_code,
+        secrets,
+        command_path=None,
+        raise_on_error=True,
+        **kwargs,
+    ):
+        """Execute command chain using 'sudo' with password in a single channel.
+        Password is sent once and all commands are run in the same shell.
+        Exit code of each command is reported back so the result
+        is the same as if commands were run one by one.
+
+        Args:
+            client (Connection): valid server ssh connection object
+            command_code (Text): command text with secrets already parsed
+            secrets (list): secrets discovered in the command code
+            command_path (Char, optional): directory where command should be executed
+            raise_on_error (bool, optional): raise error on error
+            kwargs (dict):  extra arguments. Use to pass external values.
+                Same keys as in `_execute_command_using_ssh()` are supported.
+
+        Raises:
+            ValidationError: command execution error
+
+        Returns:
+            dict: {
+                "status": <int>,
+                "response": Text,
+                "error": Text,
+                "streamed": <bool>, only if output was saved to the log
+            }
+        """
+        status_marker = f"__cxtower_status_{generate_random_id(2)}__"
+        prepared_command_code = self._prepare_ssh_command_single_session(
+            command_code, status_marker, command_path
+        )
+
+        # Save output to the log while command is running.
+        # Status lines are taken out of stderr before it is saved.
+        stream_log_record = kwargs.get("stream_log_record")
+        output_collector = (
+            stream_log_record._get_output_collector(secrets)
+            if stream_log_record
+            else None
+        )
+        output_filter = (
+            StatusMarkerFilter(output_collector, status_marker)
+            if output_collector
+            else None
+        )
+
+        try:
+            status, response, error = client.exec_command(
+                prepared_command_code, sudo="p", output_collector=output_filter
+            )
+            if output_filter:
+                output_filter.finish()
+                error = output_filter.status_lines
+            status, error = self._parse_single_session_status(
+                status, error, status_marker
+            )
+        except Exception as e:
+            if raise_on_error:
+                _logger.error(f"SSH execute command error: {e}")
+                raise ValidationError(
+                    _("SSH execute command error %(err)s", err=e)
+                ) from e
+            status = -1
+            response = []
+            error = [e]
+        finally:
+            if output_collector:
+                output_filter.finish()
+                output_collector.flush(final=True)
+
+        self._save_ssh_host_keys()
+        result = self._parse_command_results(status, response, error, secrets, **kwargs)
+        if output_collector:
+            result["streamed"] = True
+        return result
+
+    def _prepare_ssh_command_single_session(
+        self, command_code, status_marker, path=None
+    ):
+        """Prepare command chain to run with 'sudo' with password in a single shell.
+        Each command is followed by a line with its exit code
+        printed to stderr. Chain stops on the first failed command.
+        Example:
+        "pwd && ls -l" will be executed as:
+            sudo -S -p '' sh -c 'pwd
+            st=$?; printf ... >&2; [ $st -eq 0 ] || exit $st
+            ls -l
+            st=$?; printf ... >&2; [ $st -eq 0 ] || exit $st'
+
+        Args:
+            command_code (text): initial command
+            status_marker (Char): marker used to report exit codes
+            path (str, optional): directory where command should be executed
+
+        Returns:
+            Text: command to run
+        """
+        # Split the same way as `_prepare_ssh_command` does
+        if "&&" in command_code or ";" in command_code:
+            commands = [
+                cmd.strip()
+                for cmd in command_code.replace("\\", "").replace("\n", "").split("&&")
+            ]
+        else:
+            commands = [command_code]
+        if path:
+            commands.insert(0, f"cd {path}")
+
+        status_check = (
+            f"st=$?; printf '%s%s\\n' '{status_marker}' \"$st\" >&2; "
+            f'[ "$st" -eq 0 ] || exit "$st"'
+        )
+        script = "\n".join(f"{cmd}\n{status_check}" for cmd in commands)
+        return f"sudo -S -p '' sh -c {shlex.quote(script)}"
+
+    def _parse_single_session_status(self, status, error, status_marker):
+        """Extract exit codes of the chained commands from stderr.
+
+        Args:
+            status (Int): exit code of the whole chain
+            error (list): stderr lines
+            status_marker (Char): marker used to report exit codes
+
+        Returns:
+            tuple: (list of exit codes, stderr lines without markers)
+        """
+        statuses = []
+        clean_error = []
+        for line in error:
+            position = line.find(status_marker)
+            if position < 0:
+                clean_error.append(line)
+                continue
+            code = line[position + len(status_marker) :].strip()
+            statuses.append(int(code) if code.lstrip("-").isdigit() else -1)
+            # Command output may not end with a new line
+            if position:
+                clean_error.append(line[:position])
+
+        # Chain failed before the command was run. Eg wrong sudo password.
+        if status != 0 and (not statuses or statuses[-1] == 0):
+            statuses.append(status)
+        return statuses or [status], clean_error
 
     def _execute_python_code(
         self,
@@ -1432,20 +2139,20 @@ class CxTowerServer(models.Model):
 
             status = final_status
 
-        # This is needed to remove keys
-        if key_values:
-            key_model = self.env["cx.tower.key"]
+        # This is needed to remove keys.
+        # Scrubber is built once for both response and error.
+        scrubber = (
+            self.env["cx.tower.key"]._get_secret_scrubber(key_values)
+            if key_values
+            else None
+        )
 
         # Compose response message
         if response and isinstance(response, list):
+            response = "".join(str(r) for r in response)
             # Replace secrets with spoiler
-            response_vals = [
-                key_model._replace_with_spoiler(str(r), key_values)
-                if key_values
-                else str(r)
-                for r in response
-            ]
-            response = "".join(response_vals)
+            if scrubber:
+                response = scrubber.scrub(response)
 
         elif not response:
             # For not to save an empty list `[]` in log
@@ -1453,14 +2160,10 @@ class CxTowerServer(models.Model):
 
         # Compose error message
         if error and isinstance(error, list):
+            error = "".join(str(e) for e in error)
             # Replace secrets with spoiler
-            error_vals = [
-                key_model._replace_with_spoiler(str(e), key_values)
-                if key_values
-                else str(e)
-                for e in error
-            ]
-            error = "".join(error_vals)
+            if scrubber:
+                error = scrubber.scrub(error)
         elif not error:
             # For not to save an empty list `[]` in log
             error = None
@@ -1507,19 +2210,23 @@ class CxTowerServer(models.Model):
             "context": context,
         }
 
-    def delete_file(self, remote_path):
+    def delete_file(self, remote_path, ssh_connection=None):
         """
         Delete file from remote server
 
         Args:
             remote_path (Text): full path file location with file type
              (e.g. /test/my_file.txt).
+            ssh_connection (SSH client instance, optional): SSH connection to reuse.
         """
         self.ensure_one()
-        client = self._connect(raise_on_error=False)
-        client.delete_file(remote_path)
+        client = ssh_connection or self._connect(raise_on_error=False)
+        try:
+            client.delete_file(remote_path)
+        finally:
+            self._release_ssh_connection(client, ssh_connection)
 
-    def upload_file(self, data, remote_path, from_path=False):
+    def upload_file(self, data, remote_path, from_path=False, ssh_connection=None):
         """
         Upload file to remote server.
 
@@ -1529,6 +2236,7 @@ class CxTowerServer(models.Model):
             remote_path (Text): full path file location with file type
              (e.g. /test/my_file.txt).
             from_path (Boolean): set True if `data` is file path.
+            ssh_connection (SSH client instance, optional): SSH connection to reuse.
 
         Raise:
             TypeError: incorrect type of file.
@@ -1538,24 +2246,28 @@ class CxTowerServer(models.Model):
              uploaded file.
         """
         self.ensure_one()
-        client = self._connect(raise_on_error=False)
-        if from_path:
-            result = client.upload_file(data, remote_path)
-        else:
-            # Convert string to bytes
-            if isinstance(data, str):
-                data = data.encode()
-            file = io.BytesIO(data)
-            result = client.upload_file(file, remote_path)
+        client = ssh_connection or self._connect(raise_on_error=False)
+        try:
+            if from_path:
+                result = client.upload_file(data, remote_path)
+            else:
+                # Convert string to bytes
+                if isinstance(data, str):
+                    data = data.encode()
+                file = io.BytesIO(data)
+                result = client.upload_file(file, remote_path)
+        finally:
+            self._release_ssh_connection(client, ssh_connection)
         return result
 
-    def download_file(self, remote_path):
+    def download_file(self, remote_path, ssh_connection=None):
         """
         Download file from remote server
 
         Args:
             remote_path (Text): full path file location with file type
              (e.g. /test/my_file.txt).
+            ssh_connection (SSH client instance, optional): SSH connection to reuse.
 
         Raise:
             ValidationError: raise if file not found.
@@ -1564,15 +2276,130 @@ class CxTowerServer(models.Model):
             Result (Bytes): file content.
         """
         self.ensure_one()
-        client = self._connect(raise_on_error=False)
+        client = ssh_connection or self._connect(raise_on_error=False)
         try:
             result = client.download_file(remote_path)
         except FileNotFoundError as fe:
             raise ValidationError(
                 _("The file %(f_path)s not found.", f_path=remote_path)
             ) from fe
+        finally:
+            self._release_ssh_connection(client, ssh_connection)
         return result
 
+    def delete_files(self, remote_paths, ssh_connection=None, raise_on_error=True):
+        """
+        Delete several files from remote server using a single connection.
+
+        Args:
+            remote_paths (list of Text): full paths of the files to delete.
+            ssh_connection (SSH client instance, optional): SSH connection to reuse.
+            raise_on_error (bool, optional): raise on the first error.
+                Otherwise the exception is returned in place of the file result.
+                Defaults to True.
+
+        Returns:
+            list: results in the same order as `remote_paths`.
+        """
+        return self._process_files(
+            self.delete_file,
+            [(remote_path,) for remote_path in remote_paths],
+            ssh_connection=ssh_connection,
+            raise_on_error=raise_on_error,
+        )
+
+    def upload_files(
+        self, files, from_path=False, ssh_connection=None, raise_on_error=True
+    ):
+        """
+        Upload several files to remote server using a single connection.
+
+        Args:
+            files (list of tuple): (data, remote_path) pairs.
+                See `upload_file()` for details.
+            from_path (Boolean): set True if `data` is file path.
+            ssh_connection (SSH client instance, optional): SSH connection to reuse.
+            raise_on_error (bool, optional): raise on the first error.
+                Otherwise the exception is returned in place of the file result.
+                Defaults to True.
+
+        Returns:
+            list: results in the same order as `files`.
+        """
+        return self._process_files(
+            self.upload_file,
+            [(data, remote_path, from_path) for data, remote_path in files],
+            ssh_connection=ssh_connection,
+            raise_on_error=raise_on_error,
+        )
+
+    def download_files(self, remote_paths, ssh_connection=None, raise_on_error=True):
+        """
+        Download several files from remote server using a single connection.
+
+        Args:
+            remote_paths (list of Text): full paths of the files to download.
+            ssh_connection (SSH client instance, optional): SSH connection to reuse.
+            raise_on_error (bool, optional): raise on the first error.
+                Otherwise the exception is returned in place of the file content.
+                Defaults to True.
+
+        Returns:
+            list: file contents in the same order as `remote_paths`.
+        """
+        return self._process_files(
+            self.download_file,
+            [(remote_path,) for remote_path in remote_paths],
+            ssh_connection=ssh_connection,
+            raise_on_error=raise_on_error,
+        )
+
+    def _process_files(
+        self, operation, args_list, ssh_connection=None, raise_on_error=True
+    ):
+        """
+        Run file operation for several files sharing the same connection.
+        Connection opened by this method is closed when all files are processed.
+
+        Args:
+            operation (callable): one of `upload_file`, `download_file`
+                or `delete_file`.
+            args_list (list of tuple): positional arguments for each call.
+            ssh_connection (SSH client instance, optional): SSH connection to reuse.
+            raise_on_error (bool, optional): raise on the first error.
+                Defaults to True.
+
+        Returns:
+            list: operation results in the same order as `args_list`.
+        """
+        self.ensure_one()
+        client = ssh_connection or self._connect(raise_on_error=False)
+        results = []
+        try:
+            for args in args_list:
+                try:
+                    results.append(operation(*args, ssh_connection=client))
+                except Exception as e:
+                    if raise_on_error:
+                        raise
+                    results.append(e)
+        finally:
+            self._release_ssh_connection(client, ssh_connection)
+        self._save_ssh_host_keys()
+        return results
+
+    def _release_ssh_connection(self, client, ssh_connection=None):
+        """Return SSH connection opened for a file operation to the pool.
+        Connection passed by the caller is kept open.
+
+        Args:
+            client (SSH client instance): client used for the operation
+            ssh_connection (SSH client instance, optional): connection
+                passed by the caller
+        """
+        if not ssh_connection and isinstance(client, SSH):
+            client.disconnect()
+
     def action_open_files(self):
         """
         Open current server files
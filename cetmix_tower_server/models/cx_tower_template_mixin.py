@@ -1,11 +1,16 @@
 # Copyright (C) 2024 Cetmix OÜ
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
-from jinja2 import Environment, Template, meta
 from jinja2 import exceptions as jn_exceptions
 
 from odoo import api, fields, models
 from odoo.exceptions import UserError
 
+from .template_cache import TEMPLATE_CACHE
+from .tools import LazyValues
+
+# Variables that are not stored as `cx.tower.variable` records
+SYSTEM_VARIABLE_REFERENCES = ("tower",)
+
 
 class CxTowerTemplateMixin(models.AbstractModel):
     """Used to implement template rendering functions.
@@ -22,6 +27,12 @@ class CxTowerTemplateMixin(models.AbstractModel):
         compute="_compute_variable_ids",
         store=True,
     )
+    missing_variable_references = fields.Char(
+        compute="_compute_variable_ids",
+        store=True,
+        index=True,
+        help="References used in templates that do not match any variable yet",
+    )
 
     @classmethod
     def _get_depends_fields(cls):
@@ -75,8 +86,12 @@ class CxTowerTemplateMixin(models.AbstractModel):
         for record in self:
             if depends_fields:
                 record.variable_ids = record._prepare_variable_commands(depends_fields)
+                record.missing_variable_references = (
+                    record._get_missing_variable_references(depends_fields)
+                )
             else:
                 record.variable_ids = [(5, 0, 0)]
+                record.missing_variable_references = False
 
     def get_variables(self):
         """Get the list of variables for templates
@@ -86,7 +101,6 @@ class CxTowerTemplateMixin(models.AbstractModel):
             dict {'record_id': {variables}...}
                 NB: 'record_id' is String
         """
-        Environment()
         res = {}
         for rec in self:
             res.update({str(rec.id): self.get_variables_from_code(rec.code)})
@@ -101,10 +115,51 @@ class CxTowerTemplateMixin(models.AbstractModel):
         Returns:
             variables (List) variables (eg ['var','var2',..])
         """
-        env = Environment()
-        ast = env.parse(code)
-        undeclared_variables = meta.find_undeclared_variables(ast)
-        return list(undeclared_variables) if undeclared_variables else []
+        return list(TEMPLATE_CACHE.get_variables(code))
+
+    def _get_variable_references(self, *codes):
+        """Get references of the variables used in the record templates.
+        Stored `variable_ids` are used so templates are not parsed again.
+
+        Args:
+            *codes (Text): record templates. Used to detect system variables.
+
+        Returns:
+            list: variable references (eg ['var','var2',..])
+        """
+        self.ensure_one()
+        references = self.variable_ids.mapped("reference")
+        return references + self._get_system_variable_references(*codes)
+
+    @api.model
+    def _get_system_variable_references(self, *codes):
+        """Get references of the system variables used in templates.
+
+        Args:
+            *codes (Text): templates
+
+        Returns:
+            list: system variable references (eg ['tower'])
+        """
+        return [
+            reference
+            for reference in SYSTEM_VARIABLE_REFERENCES
+            if any(
+                code
+                and reference in code
+                and reference in TEMPLATE_CACHE.get_variables(code)
+                for code in codes
+            )
+        ]
+
+    @api.model
+    def get_template_cache_stats(self):
+        """Get statistics of the compiled templates cache of the current worker
+
+        Returns:
+            dict: {"hits": int, "misses": int, "size": int, "max_size": int}
+        """
+        return TEMPLATE_CACHE.stats()
 
     def _prepare_variable_commands(self, field_names, force_record=None):
         """
@@ -136,6 +191,34 @@ class CxTowerTemplateMixin(models.AbstractModel):
 
         return command
 
+    def _get_missing_variable_references(self, field_names, force_record=None):
+        """Get references used in the given fields that do not match
+        any variable. Stored so records can be linked to a variable
+        created later without searching through the templates.
+        Call after `variable_ids` is updated.
+
+        Args:
+            field_names (list): List of field names to extract variable references from.
+            force_record (record, optional): A record to use instead of the current one.
+
+        Returns:
+            Char: space separated references or False if all variables exist
+        """
+        record = force_record or self
+        record.ensure_one()
+
+        all_references = set()
+        for field_name in field_names:
+            value = getattr(record, field_name, None)
+            if value:
+                all_references.update(self.get_variables_from_code(value))
+        missing_references = (
+            all_references
+            - set(record.variable_ids.mapped("reference"))
+            - set(SYSTEM_VARIABLE_REFERENCES)
+        )
+        return " ".join(sorted(missing_references)) or False
+
     def render_code(self, pythonic_mode=False, **kwargs):
         """Render record 'code' field using variables from kwargs
         Call to render recordset of the inheriting models
@@ -179,7 +262,7 @@ class CxTowerTemplateMixin(models.AbstractModel):
                     key: self._make_value_pythonic(value)
                     for key, value in kwargs.items()
                 }
-            return Template(code, trim_blocks=True).render(kwargs)
+            return TEMPLATE_CACHE.get_template(code).render(kwargs)
         except jn_exceptions.UndefinedError as e:
             raise UserError(e) from e
 
@@ -198,7 +281,11 @@ class CxTowerTemplateMixin(models.AbstractModel):
         if isinstance(value, bool) or value is None:
             result = value
 
-        # Handle nested dicts such as system variables
+        # System variables are converted when accessed
+        elif isinstance(value, LazyValues):
+            result = value.map(self._make_value_pythonic)
+
+        # Handle nested dicts
         elif isinstance(value, dict):
             result = {}
             for key, val in value.items():
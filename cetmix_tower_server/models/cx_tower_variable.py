@@ -34,6 +34,111 @@ class TowerVariable(models.Model):
 
     _sql_constraints = [("name_uniq", "unique (name)", "Variable names must be unique")]
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Link new variables to the records that already use them"""
+        records = super().create(vals_list)
+        records._update_template_variable_ids(records.mapped("reference"))
+        return records
+
+    def write(self, vals):
+        """Update variable links of the records if reference is modified"""
+        old_references = self.mapped("reference") if "reference" in vals else []
+        result = super().write(vals)
+        if old_references:
+            self._update_template_variable_ids(
+                old_references + self.mapped("reference")
+            )
+            self.env["cx.tower.server"]._increase_variable_version()
+        return result
+
+    def unlink(self):
+        """Values of deleted variables are removed by the database.
+        Records that used the variables keep their references as missing.
+        """
+        self.env["cx.tower.server"]._increase_variable_version()
+        records_list = self._get_template_records(self.mapped("reference"))
+        result = super().unlink()
+        self._recompute_template_variable_ids(records_list)
+        return result
+
+    def _get_template_models(self):
+        """Get models where variables can be used.
+        These models store `variable_ids` and `missing_variable_references`
+        computed from their templates.
+
+        Returns:
+            list: model names
+        """
+        return [
+            "cx.tower.command",
+            "cx.tower.file",
+            "cx.tower.file.template",
+            "cx.tower.plan.line",
+            "cx.tower.variable.value",
+        ]
+
+    def _get_template_records(self, references):
+        """Get records that use the variables or mention the references
+        of variables that do not exist.
+        Stored relations and missing references are used
+        so templates are not searched.
+
+        Args:
+            references (list of Char): variable references
+
+        Returns:
+            list: records of each template model
+        """
+        references = set(references)
+
+        def is_affected(rec):
+            return rec.variable_ids & self or references.intersection(
+                rec.missing_variable_references.split()
+            )
+
+        result = []
+        for model_name in self._get_template_models():
+            model = self.env[model_name].sudo().with_context(active_test=False)
+            records = model.search(
+                [
+                    "|",
+                    ("variable_ids", "in", self.ids),
+                    ("missing_variable_references", "!=", False),
+                ]
+            )
+            records = records.filtered(is_affected)
+            if records:
+                result.append(records)
+        return result
+
+    def _update_template_variable_ids(self, references):
+        """Recompute stored variable references of the records
+        that use selected variables. This keeps `variable_ids` valid
+        when a variable is created, renamed or deleted after the records
+        were saved.
+
+        Args:
+            references (list of Char): variable references
+        """
+        if not references:
+            return
+        self._recompute_template_variable_ids(self._get_template_records(references))
+
+    @api.model
+    def _recompute_template_variable_ids(self, records_list):
+        """Recompute stored variable references of the records.
+
+        Args:
+            records_list (list): records of the template models
+        """
+        for records in records_list:
+            records = records.exists()
+            if records:
+                for field_name in ("variable_ids", "missing_variable_references"):
+                    self.env.add_to_compute(records._fields[field_name], records)
+                records.flush(["variable_ids", "missing_variable_references"])
+
     @api.depends("value_ids", "value_ids.variable_id")
     def _compute_value_ids_count(self):
         """Count number of values for the variable"""
@@ -2,7 +2,10 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 import uuid
 
-from odoo import fields, models
+from odoo import _, fields, models
+from odoo.exceptions import ValidationError
+
+from .tools import LazyValues
 
 
 class TowerVariableMixin(models.AbstractModel):
@@ -23,6 +26,25 @@ class TowerVariableMixin(models.AbstractModel):
     def get_variable_values(self, variable_references):
         """Get variable values for selected records
 
+        Args:
+            variable_references (list of Char): variable names
+
+        Returns:
+            dict {record_id: {variable_reference: value}}
+        """
+        res = self._get_variable_values_raw(variable_references)
+
+        # Render templates in values
+        for rec in self:
+            if rec.id in res:
+                rec._render_variable_values(res[rec.id])
+
+        return res
+
+    def _get_variable_values_raw(self, variable_references):
+        """Get variable values for selected records.
+        Templates used in values are not rendered.
+
         Args:
             variable_references (list of Char): variable names
 
@@ -34,6 +56,7 @@ class TowerVariableMixin(models.AbstractModel):
         # Get global values first
         if variable_references:
             global_values = self.get_global_variable_values(variable_references)
+            record_values = self._get_record_variable_values(variable_references)
 
             # Get record wise values
             for rec in self:
@@ -42,26 +65,57 @@ class TowerVariableMixin(models.AbstractModel):
                 )  # set global values as defaults
                 for variable_reference in variable_references:
                     # Check if this is a system variable
-                    system_value = self._get_system_variable_value(variable_reference)
+                    system_value = rec._get_system_variable_value(variable_reference)
                     if system_value:
                         res_vars.update({variable_reference: system_value})
 
                     # Get regular value
-                    else:
-                        value = rec.variable_value_ids.filtered(
-                            lambda v,
-                            variable_reference=variable_reference: v.variable_reference
-                            == variable_reference
+                    elif (rec.id, variable_reference) in record_values:
+                        res_vars.update(
+                            {
+                                variable_reference: record_values[
+                                    (rec.id, variable_reference)
+                                ]
+                            }
                         )
-                        if value:
-                            res_vars.update({variable_reference: value.value_char})
 
                 res.update({rec.id: res_vars})
 
-            # Render templates in values
-            for variables in res.values():
-                self._render_variable_values(variables)
+        return res
+
+    def _get_record_variable_values(self, variable_references):
+        """Get values that belong to selected records.
+        Values of all records are read using a single query.
+
+        Args:
+            variable_references (list of Char): variable names
 
+        Returns:
+            dict {(record_id, variable_reference): value}
+        """
+        res = {}
+        inverse_name = self._fields["variable_value_ids"].inverse_name
+        record_ids = [rec.id for rec in self if isinstance(rec.id, int)]
+        if record_ids:
+            values = self.env["cx.tower.variable.value"].search_read(
+                [
+                    (inverse_name, "in", record_ids),
+                    ("variable_reference", "in", variable_references),
+                ],
+                [inverse_name, "variable_reference", "value_char"],
+            )
+            for value in values:
+                res[(value[inverse_name][0], value["variable_reference"])] = value[
+                    "value_char"
+                ]
+
+        # Records that are not saved yet
+        for rec in self:
+            if isinstance(rec.id, int):
+                continue
+            for value in rec.variable_value_ids:
+                if value.variable_reference in variable_references:
+                    res[(rec.id, value.variable_reference)] = value.value_char
         return res
 
     def get_global_variable_values(self, variable_references):
@@ -80,20 +134,15 @@ class TowerVariableMixin(models.AbstractModel):
         res = {}
 
         if variable_references:
-            values = self.env["cx.tower.variable.value"].search(
-                self._compose_variable_global_values_domain(variable_references)
+            values = self.env["cx.tower.variable.value"].search_read(
+                self._compose_variable_global_values_domain(variable_references),
+                ["variable_reference", "value_char"],
             )
+            global_values = dict.fromkeys(variable_references)
+            for value in values:
+                global_values[value["variable_reference"]] = value["value_char"] or None
             for rec in self:
-                res_vars = {}
-                for variable_reference in variable_references:
-                    # Get variable value
-                    value = values.filtered(
-                        lambda v,
-                        variable_reference=variable_reference: v.variable_reference
-                        == variable_reference
-                    )
-                    res_vars.update({variable_reference: value.value_char or None})
-                res.update({rec.id: res_vars})
+                res.update({rec.id: dict(global_values)})
         return res
 
     def _get_current_server(self):
@@ -115,12 +164,14 @@ class TowerVariableMixin(models.AbstractModel):
 
     def _get_system_variable_value(self, variable_reference):
         """Get the value of a system variable. Eg `tower.server.partner_name`
+        Values are computed only when accessed, eg while rendering a template,
+        and are kept for the lifetime of the returned value.
 
         Args:
             variable_reference (Char): variable value
 
         Returns:
-            dict(): populates `tower` variable with with values.
+            LazyValues: populates `tower` variable with with values.
                 {
                     'server': {..server vals..},
                     'tools': {..helper tools vals...}
@@ -132,10 +183,10 @@ class TowerVariableMixin(models.AbstractModel):
 
         variable_value = {}
         if variable_reference == "tower":
-            variable_value.update(
+            variable_value = LazyValues(
                 {
-                    "server": self._parse_system_variable_server(),
-                    "tools": self._parse_system_variable_tools(),
+                    "server": self._parse_system_variable_server,
+                    "tools": self._parse_system_variable_tools,
                 }
             )
 
@@ -145,35 +196,41 @@ class TowerVariableMixin(models.AbstractModel):
         """Parser system variable of `server` type.
 
         Returns:
-            dict(): `server` values of the `tower` variable.
+            LazyValues: `server` values of the `tower` variable.
         """
         # Get current server
-        values = {}
+        values = LazyValues()
         server = self._get_current_server()
         if server:
-            values = {
-                "name": server.name,
-                "reference": server.reference,
-                "username": server.ssh_username,
-                "partner_name": server.partner_id.name if server.partner_id else False,
-                "ipv4": server.ip_v4_address,
-                "ipv6": server.ip_v6_address,
-                "status": server.status,
-                "os": server.os_id.name if server.os_id else False,
-            }
+            values = LazyValues(
+                {
+                    "name": lambda: server.name,
+                    "reference": lambda: server.reference,
+                    "username": lambda: server.ssh_username,
+                    "partner_name": lambda: (
+                        server.partner_id.name if server.partner_id else False
+                    ),
+                    "ipv4": lambda: server.ip_v4_address,
+                    "ipv6": lambda: server.ip_v6_address,
+                    "status": lambda: server.status,
+                    "os": lambda: server.os_id.name if server.os_id else False,
+                }
+            )
         return values
 
     def _parse_system_variable_tools(self):
         """Parser system variable of `tools` type.
 
         Returns:
-            dict(): `server` values of the `tower` variable.
+            LazyValues: `tools` values of the `tower` variable.
         """
-        values = {
-            "uuid": uuid.uuid4(),
-            "today": str(fields.Date.today()),
-            "now": str(fields.Datetime.now()),
-        }
+        values = LazyValues(
+            {
+                "uuid": lambda: uuid.uuid4(),
+                "today": lambda: str(fields.Date.today()),
+                "now": lambda: str(fields.Datetime.now()),
+            }
+        )
         return values
 
     def _compose_variable_global_values_domain(self, variable_references):
@@ -199,22 +256,87 @@ class TowerVariableMixin(models.AbstractModel):
         This function will render the "server_assets" variable:
             "server_assets": "/opt/server/assets"
 
+        Values of nested variables are read level by level in bulk.
+        Then values are rendered once each in the dependency order.
+
         Args:
             variables (dict): values to complete
+
+        Raises:
+            ValidationError: variable values reference each other
+
+        Returns:
+            dict: {variable reference: [references used in its value]}
+                for the values and all nested values
         """
         self.ensure_one()
         TemplateMixin = self.env["cx.tower.template.mixin"]
-        for key in variables:
-            var_value = variables[key]
-            # Render only if template is found
-            if var_value and "{{ " in var_value:
-                # Get variables used in value
-                value_vars = TemplateMixin.get_variables_from_code(var_value)
-
-                # Render variables used in value
-                res = self.get_variable_values(value_vars)
-
-                # Render value using variables
-                variables[key] = TemplateMixin.render_code_custom(
-                    var_value, **res[self.id]
+        values = dict(variables)
+
+        # Build the reference graph {variable reference: [references used]}
+        graph = {}
+        pending = list(values)
+        while pending:
+            missing = set()
+            for key in pending:
+                var_value = values[key]
+                # Render only if template is found
+                if isinstance(var_value, str) and "{{ " in var_value:
+                    graph[key] = TemplateMixin.get_variables_from_code(var_value)
+                    missing.update(ref for ref in graph[key] if ref not in values)
+                else:
+                    graph[key] = []
+            if missing:
+                values.update(
+                    self._get_variable_values_raw(list(missing)).get(self.id, {})
                 )
+            pending = list(missing)
+
+        # Render values in dependency order
+        for key in self._sort_variable_references(graph):
+            if graph[key]:
+                values[key] = TemplateMixin.render_code_custom(
+                    values[key], **{ref: values.get(ref) for ref in graph[key]}
+                )
+        variables.update({key: values[key] for key in variables})
+        return graph
+
+    def _sort_variable_references(self, graph):
+        """Sort variables so each one comes after the variables it uses.
+
+        Args:
+            graph (dict): {variable reference: [references used in its value]}
+
+        Raises:
+            ValidationError: variable values reference each other
+
+        Returns:
+            list: variable references
+        """
+        result = []
+        done = set()
+        for root in graph:
+            if root in done:
+                continue
+            # Depth first search. Path holds references being visited.
+            path = [root]
+            iterators = [iter(graph[root])]
+            while iterators:
+                ref = next(iterators[-1], None)
+                if ref is None:
+                    iterators.pop()
+                    key = path.pop()
+                    done.add(key)
+                    result.append(key)
+                elif ref in path:
+                    cycle = path[path.index(ref) :] + [ref]
+                    raise ValidationError(
+                        _(
+                            "Variable values reference each other: %(cycle)s",
+                            cycle=" -> ".join(cycle),
+                        )
+                    )
+                elif ref not in done and ref in graph:
+                    path.append(ref)
+                    iterators.append(iter(graph[ref]))
+        return result
@@ -1,7 +1,7 @@
 # Copyright (C) 2022 Cetmix OÜ
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
 
-from odoo import fields, models
+from odoo import api, fields, models
 
 
 class TowerVariableOption(models.Model):
@@ -48,6 +48,22 @@ class TowerVariableOption(models.Model):
         )
     ]
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env["cx.tower.server"]._increase_variable_version()
+        return records
+
+    def write(self, vals):
+        result = super().write(vals)
+        # Option values are copied to variable values
+        self.env["cx.tower.server"]._increase_variable_version()
+        return result
+
+    def unlink(self):
+        self.env["cx.tower.server"]._increase_variable_version()
+        return super().unlink()
+
     def _get_pre_populated_model_data(self):
         """
         Define the model relationships for reference generation.
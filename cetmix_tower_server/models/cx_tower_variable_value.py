@@ -6,6 +6,8 @@ from odoo import _, api, fields, models
 from odoo.exceptions import ValidationError
 from odoo.osv.expression import OR
 
+from .plan_graph import PLAN_GRAPHS
+
 
 class TowerVariableValue(models.Model):
     _name = "cx.tower.variable.value"
@@ -76,6 +78,12 @@ class TowerVariableValue(models.Model):
         compute="_compute_variable_ids",
         store=True,
     )
+    missing_variable_references = fields.Char(
+        compute="_compute_variable_ids",
+        store=True,
+        index=True,
+        help="References used in templates that do not match any variable yet",
+    )
     required = fields.Boolean()
 
     _sql_constraints = [
@@ -108,6 +116,64 @@ class TowerVariableValue(models.Model):
         ),
     ]
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        records._increase_server_variable_version()
+        records._reset_plan_graphs()
+        return records
+
+    def write(self, vals):
+        # Values can be moved to another server or made global
+        scope = self._get_variable_version_scope()
+        self._reset_plan_graphs()
+        result = super().write(vals)
+        self._increase_server_variable_version(scope)
+        self._reset_plan_graphs()
+        return result
+
+    def unlink(self):
+        self._increase_server_variable_version()
+        self._reset_plan_graphs()
+        return super().unlink()
+
+    def _get_variable_version_scope(self):
+        """Get servers whose variable version depends on the values.
+
+        Returns:
+            tuple: (is_global, server ids). Global values affect all servers.
+        """
+        values = self.sudo()
+        return any(values.mapped("is_global")), set(values.mapped("server_id").ids)
+
+    def _increase_server_variable_version(self, previous_scope=None):
+        """Mark cached variable values of the affected servers as outdated.
+        Global values affect all servers.
+
+        Args:
+            previous_scope (tuple, optional): scope returned by
+                `_get_variable_version_scope()` before the values were modified
+        """
+        if not self:
+            return
+        is_global, server_ids = self._get_variable_version_scope()
+        if previous_scope:
+            is_global = is_global or previous_scope[0]
+            server_ids |= previous_scope[1]
+        server_obj = self.env["cx.tower.server"]
+        # Global version is a part of each server snapshot version
+        if is_global:
+            server_obj._increase_variable_version()
+        else:
+            server_obj._increase_variable_version(list(server_ids))
+
+    def _reset_plan_graphs(self):
+        """Mark compiled flight plans as outdated
+        if plan line action values are affected.
+        """
+        if any(self.sudo().mapped("plan_line_action_id")):
+            PLAN_GRAPHS.clear()
+
     @api.depends("option_id", "variable_id.option_ids")
     def _compute_option_ids_domain(self):
         """
@@ -179,6 +245,11 @@ class TowerVariableValue(models.Model):
             record.variable_ids = template_mixin_obj._prepare_variable_commands(
                 ["value_char"], force_record=record
             )
+            record.missing_variable_references = (
+                template_mixin_obj._get_missing_variable_references(
+                    ["value_char"], force_record=record
+                )
+            )
 
     def _inverse_value_char(self):
         """Set option_id based on value_char"""
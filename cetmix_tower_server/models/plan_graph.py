@@ -0,0 +1,89 @@
+# Copyright (C) 2024 Cetmix OÜ
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+import collections
+import threading
+
+# Max number of compiled plans kept in the cache
+PLAN_GRAPH_CACHE_SIZE = 256
+
+# Compiled Flight Plan.
+#   - first_line_id (Int): first line id or None if plan has no lines
+#   - lines ({line id: PlanGraphLine}): lines in the execution order
+#   - on_error_action (Char): plan `on_error_action`
+#   - custom_exit_code (Int): plan `custom_exit_code`
+PlanGraph = collections.namedtuple(
+    "PlanGraph", ["first_line_id", "lines", "on_error_action", "custom_exit_code"]
+)
+
+# Compiled Flight Plan line.
+#   - next_line_id (Int): next line id or None for the last line
+#   - condition (Char): line condition template
+#   - variable_references (tuple): references of the variables used in condition
+#   - actions (tuple of PlanGraphAction): line actions in the evaluation order
+#   - group_line_ids (tuple): ids of the lines of the parallel group
+#       the line belongs to. Empty if the line is run alone.
+PlanGraphLine = collections.namedtuple(
+    "PlanGraphLine",
+    ["next_line_id", "condition", "variable_references", "actions", "group_line_ids"],
+)
+
+# Compiled Flight Plan line action.
+#   - action (Char): action to proceed
+#   - predicate (callable): receives command exit code and returns bool
+#   - custom_exit_code (Int): action `custom_exit_code`
+#   - variable_values (tuple): ((variable id, value), ...) to set on server
+PlanGraphAction = collections.namedtuple(
+    "PlanGraphAction", ["action", "predicate", "custom_exit_code", "variable_values"]
+)
+
+
+class PlanGraphCache(object):
+    """
+    Process-wide cache of compiled Flight Plans.
+
+    Each graph is stored together with the plan signature composed
+    of the write dates of the plan, its lines, actions and action values.
+    Graph is rebuilt as soon as the signature changes.
+    """
+
+    def __init__(self, max_size=PLAN_GRAPH_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # {(database name, plan id): (signature, PlanGraph())}
+        self._graphs = collections.OrderedDict()
+
+    def get(self, key, signature, build):
+        """Get compiled plan from the cache or build it.
+
+        Args:
+            key (tuple): cache key
+            signature (tuple): current plan signature
+            build (callable): function that returns a new `PlanGraph`
+
+        Returns:
+            PlanGraph: compiled plan
+        """
+        with self._lock:
+            entry = self._graphs.get(key)
+            if entry and entry[0] == signature:
+                self._graphs.move_to_end(key)
+                return entry[1]
+
+        # Graph is built outside of the lock
+        graph = build()
+
+        with self._lock:
+            self._graphs[key] = (signature, graph)
+            self._graphs.move_to_end(key)
+            while len(self._graphs) > self.max_size:
+                self._graphs.popitem(last=False)
+        return graph
+
+    def clear(self):
+        """Remove all compiled plans"""
+        with self._lock:
+            self._graphs.clear()
+
+
+# Compiled plans shared by all threads of the current worker
+PLAN_GRAPHS = PlanGraphCache()
@@ -0,0 +1,109 @@
+# Copyright (C) 2024 Cetmix OÜ
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+import threading
+
+
+class HostKeyMismatchError(Exception):
+    """Remote host key does not match the trusted one"""
+
+
+class SSHHostKeyStore(object):
+    """
+    Host keys accepted on first connection that are not saved yet.
+
+    Keys are collected while connections are opened and are written
+    to the database in bulk by `cx.tower.server._save_ssh_host_keys()`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {database name: {server id: {key type: base64 key}}}
+        self._pending = {}
+
+    def add(self, dbname, server_id, key_type, key):
+        """Add new host key.
+
+        Args:
+            dbname (Char): database name
+            server_id (Int): `cx.tower.server` record id
+            key_type (Char): key type. Eg 'ssh-ed25519'
+            key (Char): base64 encoded public key
+        """
+        with self._lock:
+            server_keys = self._pending.setdefault(dbname, {}).setdefault(server_id, {})
+            server_keys.setdefault(key_type, key)
+
+    def pop(self, dbname, server_ids):
+        """Get and remove new host keys of the servers.
+
+        Args:
+            dbname (Char): database name
+            server_ids (list): `cx.tower.server` record ids
+
+        Returns:
+            dict: {server id: {key type: base64 key}}
+        """
+        with self._lock:
+            pending = self._pending.get(dbname)
+            if not pending:
+                return {}
+            new_host_keys = {
+                server_id: pending.pop(server_id)
+                for server_id in server_ids
+                if server_id in pending
+            }
+            if not pending:
+                del self._pending[dbname]
+            return new_host_keys
+
+
+class TrustedHostKeyPolicy(object):
+    """
+    Paramiko missing host key policy that checks the remote key
+    against the keys trusted for the server.
+
+    Host is trusted on first use: if no keys are known yet
+    the remote key is checked against the system known hosts if the host
+    is listed there, then accepted and passed to `on_new_host_key`.
+    Otherwise the remote key must match one of the trusted keys.
+    """
+
+    def __init__(self, host_keys, on_new_host_key=None, system_host_keys=None):
+        """
+        Args:
+            host_keys (dict): {key type: base64 key} trusted keys
+            on_new_host_key (callable, optional): function called with
+                key type and base64 key when a key is accepted on first use
+            system_host_keys (paramiko.HostKeys, optional): system known hosts
+                used when no keys are trusted yet
+        """
+        self.host_keys = host_keys
+        self.on_new_host_key = on_new_host_key
+        self.system_host_keys = system_host_keys
+
+    def missing_host_key(self, client, hostname, key):
+        """Called by paramiko for hosts that are not in the client host keys.
+
+        Raises:
+            HostKeyMismatchError: remote key is not trusted
+        """
+        key_type = key.get_name()
+        key_data = key.get_base64()
+        host_keys = self.host_keys
+        if not host_keys and self.system_host_keys is not None:
+            known_keys = self.system_host_keys.lookup(hostname) or {}
+            host_keys = {
+                known_type: known_key.get_base64()
+                for known_type, known_key in known_keys.items()
+            }
+        if host_keys and host_keys.get(key_type) != key_data:
+            raise HostKeyMismatchError(
+                f"Host key for {hostname} does not match the trusted key. "
+                f"Received {key_type} key {key.get_fingerprint().hex()}"
+            )
+        if not self.host_keys and self.on_new_host_key:
+            self.on_new_host_key(key_type, key_data)
+
+
+# New host keys collected by all threads of the current worker
+SSH_HOST_KEYS = SSHHostKeyStore()
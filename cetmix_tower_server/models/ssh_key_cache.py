@@ -0,0 +1,92 @@
+# Copyright (C) 2024 Cetmix OÜ
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+import collections
+import hashlib
+import threading
+
+# Max number of parsed keys kept in the cache
+SSH_KEY_CACHE_SIZE = 256
+
+
+class SSHKeyCache(object):
+    """
+    Process-wide cache of parsed SSH private keys.
+
+    Keys are stored by `cx.tower.key` id and a hash of the key secret
+    so a modified secret is never served from the cache.
+    Detected key type is remembered separately and is tried first
+    when the key is loaded again.
+    """
+
+    def __init__(self, max_size=SSH_KEY_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # {(key id, secret hash): paramiko.PKey()}
+        self._keys = collections.OrderedDict()
+        # {key id: paramiko.PKey subclass}
+        self._key_types = {}
+
+    @staticmethod
+    def make_key(key_id, secret):
+        """Compose cache key.
+
+        Args:
+            key_id (Int): `cx.tower.key` record id
+            secret (Char): SSH private key
+
+        Returns:
+            tuple: (key id, secret hash)
+        """
+        return (key_id, hashlib.sha256((secret or "").encode("utf-8")).hexdigest())
+
+    def get(self, key_id, secret, load):
+        """Get parsed key from the cache or load it.
+
+        Args:
+            key_id (Int): `cx.tower.key` record id
+            secret (Char): SSH private key
+            load (callable): function that parses the key.
+                Receives key class detected previously or None
+                and returns `paramiko.PKey` instance.
+
+        Returns:
+            paramiko.PKey: parsed private key
+        """
+        cache_key = self.make_key(key_id, secret)
+        with self._lock:
+            pkey = self._keys.get(cache_key)
+            if pkey is not None:
+                self._keys.move_to_end(cache_key)
+                return pkey
+            key_type = self._key_types.get(key_id)
+
+        # Key is parsed outside of the lock
+        pkey = load(key_type)
+
+        with self._lock:
+            self._keys[cache_key] = pkey
+            self._key_types[key_id] = type(pkey)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+        return pkey
+
+    def invalidate(self, key_ids):
+        """Remove parsed keys from the cache.
+
+        Args:
+            key_ids (list of Int): `cx.tower.key` record ids
+        """
+        key_ids = set(key_ids)
+        with self._lock:
+            for cache_key in [k for k in self._keys if k[0] in key_ids]:
+                del self._keys[cache_key]
+
+    def clear(self):
+        """Remove all keys from the cache"""
+        with self._lock:
+            self._keys.clear()
+            self._key_types.clear()
+
+
+# Parsed keys shared by all threads of the current worker
+SSH_KEY_CACHE = SSHKeyCache()
@@ -0,0 +1,323 @@
+# Copyright (C) 2024 Cetmix OÜ
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+import hashlib
+import logging
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Default pool settings.
+# Can be overridden using the following system parameters:
+#   - cetmix_tower_server.ssh_pool_idle_timeout
+#   - cetmix_tower_server.ssh_pool_max_per_server
+#   - cetmix_tower_server.ssh_pool_max_total
+#   - cetmix_tower_server.ssh_pool_acquire_timeout
+SSH_POOL_IDLE_TIMEOUT = 300
+SSH_POOL_MAX_PER_SERVER = 4
+SSH_POOL_MAX_TOTAL = 64
+SSH_POOL_ACQUIRE_TIMEOUT = 60
+
+
+class SSHPoolEntry(object):
+    """Single connection kept in the pool"""
+
+    __slots__ = ("client", "in_use", "last_used", "stale")
+
+    def __init__(self, client):
+        self.client = client
+        self.in_use = True
+        self.last_used = time.monotonic()
+        self.stale = False
+
+
+class SSHConnectionPool(object):
+    """
+    Process-wide pool of open SSH connections.
+
+    Connections are grouped by a connection key which is composed of
+    host, port, username and authentication fingerprint.
+    Each connection is handed out to a single user at a time
+    and is returned to the pool when released.
+    No more than `max_per_server` connections per key are used
+    at the same time. Next request waits until a connection is released.
+
+    Connections that cannot be kept in the pool because of the worker limit
+    are still created but closed as soon as they are released.
+    """
+
+    def __init__(
+        self,
+        idle_timeout=SSH_POOL_IDLE_TIMEOUT,
+        max_per_server=SSH_POOL_MAX_PER_SERVER,
+        max_total=SSH_POOL_MAX_TOTAL,
+        acquire_timeout=SSH_POOL_ACQUIRE_TIMEOUT,
+    ):
+        self.idle_timeout = idle_timeout
+        self.max_per_server = max_per_server
+        self.max_total = max_total
+        self.acquire_timeout = acquire_timeout
+        self._lock = threading.RLock()
+        # Notified when a connection is released
+        self._released = threading.Condition(self._lock)
+        # {connection key: [SSHPoolEntry(), ...]}
+        self._entries = {}
+        # {connection key: number of connections handed out}
+        self._in_use = {}
+
+    @staticmethod
+    def make_key(host, port, username, mode="p", password=None, ssh_key=None):
+        """Compose pool key for connection parameters.
+
+        Args:
+            host (Char): host name or IP address
+            port (Char|Int): SSH port
+            username (Char): SSH username
+            mode (Char): SSH auth mode ('p' - password, 'k' - key)
+            password (Char, optional): SSH password
+            ssh_key (Char, optional): SSH private key
+
+        Returns:
+            tuple: (host, port, username, auth fingerprint)
+        """
+        secret = ssh_key if mode == "k" else password
+        fingerprint = hashlib.sha256(
+            f"{mode}:{secret or ''}".encode("utf-8")
+        ).hexdigest()
+        return (host, str(port), username, fingerprint)
+
+    def configure(
+        self,
+        idle_timeout=None,
+        max_per_server=None,
+        max_total=None,
+        acquire_timeout=None,
+    ):
+        """Update pool limits.
+
+        Args:
+            idle_timeout (Int, optional): seconds after which idle
+                connections are closed
+            max_per_server (Int, optional): max number of connections
+                per connection key used at the same time.
+                Set to 0 to disable pooling and the limit.
+            max_total (Int, optional): max number of pooled connections
+                in the current worker
+            acquire_timeout (Int, optional): seconds to wait
+                for a free connection when the server limit is reached
+        """
+        with self._lock:
+            if idle_timeout is not None:
+                self.idle_timeout = idle_timeout
+            if max_per_server is not None and max_per_server != self.max_per_server:
+                self.max_per_server = max_per_server
+                self._released.notify_all()
+            if max_total is not None:
+                self.max_total = max_total
+            if acquire_timeout is not None:
+                self.acquire_timeout = acquire_timeout
+
+    @staticmethod
+    def is_alive(client, probe=False):
+        """Check if connection can be used.
+
+        Args:
+            client (paramiko.SSHClient): SSH client
+            probe (bool, optional): send a packet to detect a broken socket.
+                Used only when an idle connection is taken from the pool.
+                Defaults to False.
+
+        Returns:
+            bool: True if connection transport is active
+        """
+        transport = client.get_transport() if client else None
+        if not transport or not transport.is_active():
+            return False
+        if probe:
+            try:
+                transport.send_ignore()
+            except Exception:
+                return False
+        return True
+
+    def acquire(self, key, connect):
+        """Get a connection from the pool or open a new one.
+        Waits for a released connection if `max_per_server` connections
+        of the key are already used.
+
+        Args:
+            key (tuple): connection key. Use `make_key()` to compose it.
+            connect (callable): function that opens a new connection
+                and returns `paramiko.SSHClient` instance
+
+        Raises:
+            TimeoutError: no connection was released in `acquire_timeout` seconds
+
+        Returns:
+            paramiko.SSHClient: connected SSH client
+        """
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._lock:
+            while True:
+                self._evict_idle()
+                for entry in list(self._entries.get(key, [])):
+                    if entry.in_use or entry.stale:
+                        continue
+                    if self.is_alive(entry.client, probe=True):
+                        entry.in_use = True
+                        entry.last_used = time.monotonic()
+                        self._in_use[key] = self._in_use.get(key, 0) + 1
+                        return entry.client
+                    self._drop(key, entry)
+                if (
+                    not self.max_per_server
+                    or self._in_use.get(key, 0) < self.max_per_server
+                ):
+                    break
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    raise TimeoutError(
+                        f"No free SSH connection to {key[2]}@{key[0]}:{key[1]} "
+                        f"in {self.acquire_timeout} seconds"
+                    )
+                self._released.wait(timeout)
+            # Slot is taken before connecting so other threads wait for it
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+
+        # Network I/O is done outside of the lock
+        try:
+            client = connect()
+        except Exception:
+            with self._lock:
+                self._free_slot(key)
+            raise
+
+        with self._lock:
+            if self._reserve_slot(key):
+                self._entries.setdefault(key, []).append(SSHPoolEntry(client))
+            else:
+                _logger.debug(
+                    "SSH pool limit reached for %s@%s:%s, "
+                    "connection will be closed after use",
+                    key[2],
+                    key[0],
+                    key[1],
+                )
+        return client
+
+    def release(self, key, client):
+        """Return connection to the pool.
+        Connections that are not kept in the pool are closed.
+
+        Args:
+            key (tuple): connection key
+            client (paramiko.SSHClient): SSH client
+        """
+        with self._lock:
+            self._free_slot(key)
+            for entry in self._entries.get(key, []):
+                if entry.client is client:
+                    entry.in_use = False
+                    entry.last_used = time.monotonic()
+                    if entry.stale or not self.is_alive(client):
+                        self._drop(key, entry)
+                    return
+        self._close(client)
+
+    def _free_slot(self, key):
+        """Mark connection of the key as not used and wake up
+        the threads waiting for it. Must be called under lock.
+
+        Args:
+            key (tuple): connection key
+        """
+        in_use = self._in_use.get(key, 0) - 1
+        if in_use > 0:
+            self._in_use[key] = in_use
+        else:
+            self._in_use.pop(key, None)
+        self._released.notify_all()
+
+    def invalidate(self, keys):
+        """Close connections for selected keys.
+        Connections that are currently used are closed on release.
+
+        Args:
+            keys (list of tuple): connection keys
+        """
+        with self._lock:
+            for key in keys:
+                for entry in list(self._entries.get(key, [])):
+                    if entry.in_use:
+                        entry.stale = True
+                    else:
+                        self._drop(key, entry)
+
+    def evict_idle(self):
+        """Close connections that were not used for too long"""
+        with self._lock:
+            self._evict_idle()
+
+    def close_all(self):
+        """Close all idle connections and mark used ones as stale"""
+        with self._lock:
+            self.invalidate(list(self._entries))
+
+    def _evict_idle(self):
+        """Close idle connections. Must be called under lock."""
+        threshold = time.monotonic() - self.idle_timeout
+        for key, entries in list(self._entries.items()):
+            for entry in list(entries):
+                if not entry.in_use and entry.last_used < threshold:
+                    self._drop(key, entry)
+
+    def _reserve_slot(self, key):
+        """Check if a new connection can be kept in the pool.
+        Evicts the least recently used idle connection of another key
+        if the worker limit is reached. Must be called under lock.
+
+        Args:
+            key (tuple): connection key
+
+        Returns:
+            bool: True if connection can be added to the pool
+        """
+        if len(self._entries.get(key, [])) >= self.max_per_server:
+            return False
+        if sum(len(entries) for entries in self._entries.values()) < self.max_total:
+            return True
+
+        idle = [
+            (entry.last_used, entry_key, entry)
+            for entry_key, entries in self._entries.items()
+            for entry in entries
+            if not entry.in_use
+        ]
+        if not idle:
+            return False
+        __, entry_key, entry = min(idle, key=lambda item: item[0])
+        self._drop(entry_key, entry)
+        return True
+
+    def _drop(self, key, entry):
+        """Remove entry from the pool and close its connection.
+        Must be called under lock.
+        """
+        entries = self._entries.get(key)
+        if entries and entry in entries:
+            entries.remove(entry)
+            if not entries:
+                del self._entries[key]
+        self._close(entry.client)
+
+    @staticmethod
+    def _close(client):
+        """Close connection ignoring errors"""
+        try:
+            client.close()
+        except Exception as e:
+            _logger.debug("Error closing SSH connection: %s", e)
+
+
+# Connection pool shared by all threads of the current worker
+SSH_POOL = SSHConnectionPool()
@@ -0,0 +1,135 @@
+# Copyright (C) 2024 Cetmix OÜ
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+import collections
+import hashlib
+import threading
+
+from jinja2 import Environment, meta
+
+# Max number of compiled templates kept in the cache
+TEMPLATE_CACHE_SIZE = 1024
+
+
+class TemplateCache(object):
+    """
+    Process-wide cache of compiled Jinja templates.
+
+    Templates are compiled using a shared Jinja environment and are kept
+    in a LRU cache keyed by a hash of the template source and render options.
+    Variables used in templates are cached the same way.
+    """
+
+    def __init__(self, max_size=TEMPLATE_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # {render options: Environment()}
+        self._environments = {}
+        # {(kind, render options, source hash): compiled template or variables}
+        self._entries = collections.OrderedDict()
+
+    def get_environment(self, trim_blocks=True):
+        """Get shared Jinja environment for render options.
+
+        Args:
+            trim_blocks (bool, optional): remove first newline after a block.
+                Defaults to True.
+
+        Returns:
+            jinja2.Environment: environment
+        """
+        options = (trim_blocks,)
+        environment = self._environments.get(options)
+        if environment is None:
+            environment = self._environments.setdefault(
+                options, Environment(trim_blocks=trim_blocks)
+            )
+        return environment
+
+    def get_template(self, code, trim_blocks=True):
+        """Get compiled template.
+
+        Args:
+            code (Text): template source
+            trim_blocks (bool, optional): remove first newline after a block.
+                Defaults to True.
+
+        Returns:
+            jinja2.Template: compiled template
+        """
+        return self._get(
+            ("template", trim_blocks, self._hash(code)),
+            lambda: self.get_environment(trim_blocks).from_string(code),
+        )
+
+    def get_variables(self, code):
+        """Get names of the variables used in template.
+
+        Args:
+            code (Text): template source
+
+        Returns:
+            frozenset: variable names
+        """
+        return self._get(
+            ("variables", None, self._hash(code)),
+            lambda: frozenset(
+                meta.find_undeclared_variables(self.get_environment().parse(code))
+            ),
+        )
+
+    def stats(self):
+        """Get cache statistics.
+
+        Returns:
+            dict: {"hits": int, "misses": int, "size": int, "max_size": int}
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+    def clear(self):
+        """Remove all entries and reset counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    @staticmethod
+    def _hash(code):
+        return hashlib.sha1((code or "").encode("utf-8")).digest()
+
+    def _get(self, key, compile_entry):
+        """Get entry from the cache or compile it.
+
+        Args:
+            key (tuple): cache key
+            compile_entry (callable): function that returns a new entry
+
+        Returns:
+            entry value
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        # Compile outside of the lock. Syntax errors are not cached.
+        value = compile_entry()
+
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+
+
+# Templates shared by all threads of the current worker
+TEMPLATE_CACHE = TemplateCache()
@@ -1,7 +1,15 @@
 # Copyright (C) 2022 Cetmix OÜ
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+import logging
+from collections.abc import MutableMapping
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
 from random import choices
 
+from odoo import api
+
+_logger = logging.getLogger(__name__)
+
 CHARS = "23456789acefhjkmnprtvwxyz"
 
 
@@ -34,3 +42,170 @@ def generate_random_id(sections=1, population=4, separator="-"):
         i += 1
 
     return separator.join(result)
+
+
+class LazyValues(MutableMapping):
+    """Mapping that computes each value on first access.
+    Computed values are kept for the lifetime of the mapping.
+
+    Used for system variables so only the values that are used
+    in templates are read.
+
+    Args:
+        getters (dict): {key: function that returns the value}
+    """
+
+    def __init__(self, getters=None):
+        self._getters = dict(getters or {})
+        self._values = {}
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            self._values[key] = self._getters[key]()
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        self._getters.setdefault(key, None)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        del self._getters[key]
+        self._values.pop(key, None)
+
+    def __iter__(self):
+        return iter(self._getters)
+
+    def __len__(self):
+        return len(self._getters)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def map(self, func):
+        """Get mapping with `func` applied to each value on access.
+
+        Args:
+            func (callable): function that receives the original value
+
+        Returns:
+            LazyValues: new mapping
+        """
+        return LazyValues({key: partial(self._map_value, func, key) for key in self})
+
+    def _map_value(self, func, key):
+        return func(self[key])
+
+
+def run_in_parallel(records, func, max_workers, stop=None):
+    """Run function for each record in parallel.
+    Each thread uses its own cursor which is committed
+    when the function is finished. Function can also commit it
+    when the `cx_tower_commit_allowed` context key is set.
+    Current transaction is never committed, so threads can see only
+    data that is already committed. If the current transaction has
+    uncommitted changes records are processed one by one in it instead.
+
+    Records are also processed one by one in test mode or if the
+    number of parallel records is less than 2. Each of them is processed
+    in a savepoint and the `cx_tower_commit_allowed` context key is
+    set to False, so the function must not commit the transaction.
+
+    An exception raised for a record does not stop other records.
+    It is logged and returned in place of the record result.
+
+    Args:
+        records (models.Model): records to process
+        func (callable): function that receives a single record.
+            Use `record.env` to access other records and return plain values
+            because the thread cursor is closed after the function is finished.
+            Records created by the threads cannot be read
+            in the current transaction either.
+        max_workers (Int): number of records processed at a time.
+        stop (callable, optional): function that receives a function
+            result or exception. If it returns True no more records
+            are started. Records that are already running are finished anyway.
+
+    Returns:
+        list: function results or exceptions in the same order as records.
+            None is returned for records that were not started.
+    """
+    results = [None] * len(records)
+    if (
+        len(records) < 2
+        or max_workers < 2
+        or records.pool.in_test_mode()
+        or _has_uncommitted_changes(records)
+    ):
+        # Each record is run in a savepoint so the transaction
+        # must not be committed by the function
+        for index, record in enumerate(
+            records.with_context(cx_tower_commit_allowed=False)
+        ):
+            try:
+                with records.env.cr.savepoint():
+                    results[index] = func(record)
+            except Exception as e:
+                _logger.error("Failed to process %s: %s", record, e, exc_info=True)
+                records.env.clear()
+                results[index] = e
+            if stop and stop(results[index]):
+                break
+        return results
+
+    registry = records.pool
+    model_name = records._name
+    uid, context, su = records.env.uid, records.env.context, records.env.su
+
+    # Thread cursors belong to this function so they can be committed
+    thread_context = dict(context, cx_tower_commit_allowed=True)
+
+    def run(record_id):
+        with api.Environment.manage(), registry.cursor() as cr:
+            env = api.Environment(cr, uid, thread_context, su=su)
+            return func(env[model_name].browse(record_id))
+
+    # Rolling window: next record is started as soon as a previous one is done
+    queue = list(enumerate(records.ids))
+    queue.reverse()
+    stopped = False
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(records))) as executor:
+        running = {}
+        while queue or running:
+            while queue and not stopped and len(running) < max_workers:
+                index, record_id = queue.pop()
+                running[executor.submit(run, record_id)] = index
+            if not running:
+                break
+            done, __ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                error = future.exception()
+                if error:
+                    _logger.error(
+                        "Failed to process %s(%s): %s",
+                        model_name,
+                        records.ids[index],
+                        error,
+                        exc_info=error,
+                    )
+                    results[index] = error
+                else:
+                    results[index] = future.result()
+                if stop and stop(results[index]):
+                    stopped = True
+    return results
+
+
+def _has_uncommitted_changes(records):
+    """Check if the transaction of the records has written anything.
+    Such changes cannot be seen by other cursors until committed.
+
+    Args:
+        records (models.Model): any records of the environment
+
+    Returns:
+        bool: True if there are uncommitted changes
+    """
+    records.flush()
+    records.env.cr.execute("SELECT txid_current_if_assigned()")
+    return records.env.cr.fetchone()[0] is not None
@@ -0,0 +1,63 @@
+# Copyright (C) 2024 Cetmix OÜ
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+import collections
+import threading
+
+# Max number of server snapshots kept in the cache
+VARIABLE_SNAPSHOT_CACHE_SIZE = 1024
+
+
+class VariableSnapshotCache(object):
+    """
+    Process-wide cache of rendered server variable values.
+
+    Each snapshot is stored together with the server variable version.
+    Version is increased when any value affecting the server is modified
+    so outdated snapshots are never returned.
+    """
+
+    def __init__(self, max_size=VARIABLE_SNAPSHOT_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # {snapshot key: (version, snapshot)}
+        self._snapshots = collections.OrderedDict()
+
+    def get(self, key, version):
+        """Get snapshot.
+
+        Args:
+            key (tuple): snapshot key
+            version (Int): current variable version
+
+        Returns:
+            dict: snapshot or None if not found or outdated
+        """
+        with self._lock:
+            entry = self._snapshots.get(key)
+            if not entry or entry[0] != version:
+                return None
+            self._snapshots.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, version, snapshot):
+        """Save snapshot.
+
+        Args:
+            key (tuple): snapshot key
+            version (Int): variable version the snapshot is composed for
+            snapshot (dict): snapshot
+        """
+        with self._lock:
+            self._snapshots[key] = (version, snapshot)
+            self._snapshots.move_to_end(key)
+            while len(self._snapshots) > self.max_size:
+                self._snapshots.popitem(last=False)
+
+    def clear(self):
+        """Remove all snapshots"""
+        with self._lock:
+            self._snapshots.clear()
+
+
+# Snapshots shared by all threads of the current worker
+VARIABLE_SNAPSHOTS = VariableSnapshotCache()
@@ -13,3 +13,7 @@ from . import test_cetmix_tower
 from . import test_update_related_variable_names
 from . import test_command_log
 from . import test_variable_option
+from . import test_ssh_pool
+from . import test_ssh_key_cache
+from . import test_ssh_host_keys
+from . import test_template_cache
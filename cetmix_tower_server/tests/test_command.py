@@ -1,4 +1,4 @@
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 from odoo.exceptions import AccessError
 from odoo.tests.common import Form
@@ -306,6 +306,65 @@ COMMAND_RESULT = {
             ),
         )
 
+    def test_ssh_command_sudo_single_session(self):
+        """Test command chain run with sudo with password in a single session"""
+        server = self.server_test_1
+        server.sudo_single_session = True
+        marker = "__cxtower_status_test__"
+
+        # Prepare command chain
+        cmd = server._prepare_ssh_command_single_session(
+            "ls -a /tmp && mkdir /tmp/test", marker, path="/home/doge"
+        )
+        self.assertTrue(
+            cmd.startswith(f"{self.sudo_prefix} sh -c "),
+            msg="Command chain must be run in a single shell using sudo",
+        )
+        for part in ("cd /home/doge", "ls -a /tmp", "mkdir /tmp/test"):
+            self.assertIn(part, cmd, msg=f"Command must contain '{part}'")
+        self.assertEqual(cmd.count(marker), 3, msg="Each command must report status")
+
+        # Original method is used instead of the test one
+        execute_command_using_ssh = server._execute_command_using_ssh.origin
+        client = MagicMock()
+        with patch(
+            "odoo.addons.cetmix_tower_server.models.cx_tower_server.generate_random_id",
+            return_value="test",
+        ):
+            # All commands succeeded
+            client.exec_command.return_value = (
+                0,
+                ["Such\n", "Much\n"],
+                [f"{marker}0\n", f"{marker}0\n"],
+            )
+            result = execute_command_using_ssh(
+                server, client, "ls -a /tmp && mkdir /tmp/test", sudo="p"
+            )
+            client.exec_command.assert_called_once()
+            self.assertEqual(result["status"], 0, msg="Status must be 0")
+            self.assertEqual(result["response"], "Such\nMuch\n")
+            self.assertIsNone(result["error"], msg="Status markers must be removed")
+
+            # Second command failed
+            client.exec_command.return_value = (
+                2,
+                ["Such\n"],
+                [f"{marker}0\n", f"Doge is sad{marker}2\n"],
+            )
+            result = execute_command_using_ssh(
+                server, client, "ls -a /tmp && mkdir /tmp/test", sudo="p"
+            )
+            self.assertEqual(result["status"], 2, msg="Status must be 2")
+            self.assertEqual(result["error"], "Doge is sad")
+
+            # Sudo failed before running any command
+            client.exec_command.return_value = (1, [], ["Sorry, try again.\n"])
+            result = execute_command_using_ssh(
+                server, client, "ls -a /tmp && mkdir /tmp/test", sudo="p"
+            )
+            self.assertEqual(result["status"], 1, msg="Status must be 1")
+            self.assertEqual(result["error"], "Sorry, try again.\n")
+
     def test_server_render_command(self):
         """Test rendering command using `_render_command` method
         of cx.tower.server
@@ -382,6 +441,111 @@ COMMAND_RESULT = {
             rendered_command["rendered_path"], "Rendered path doesn't match"
         )
 
+    def test_render_command_stored_variables(self):
+        """Test that stored variable references are used to render command"""
+        command = self.Command.create(
+            {
+                "name": "Much command",
+                "code": "echo {{ much_var }} {{ tower.server.name }}",
+            }
+        )
+        self.assertFalse(command.variable_ids, "Variable does not exist yet")
+        self.assertEqual(command.missing_variable_references, "much_var")
+
+        # Variable created after the command is linked to it
+        much_var = self.Variable.create({"name": "much_var"})
+        self.assertEqual(command.variable_ids, much_var, "Variable must be linked")
+        self.assertFalse(command.missing_variable_references)
+
+        # Renamed variable is unlinked
+        much_var.reference = "such_var"
+        self.assertFalse(command.variable_ids, "Renamed variable must be unlinked")
+        much_var.reference = "much_var"
+        self.assertEqual(command.variable_ids, much_var, "Variable must be linked")
+        self.VariableValue.create(
+            {
+                "variable_id": much_var.id,
+                "value_char": "wow",
+                "server_id": self.server_test_1.id,
+            }
+        )
+
+        with patch.object(
+            self.registry["cx.tower.command"], "get_variables_from_code"
+        ) as get_variables_from_code:
+            rendered_command = self.server_test_1._render_command(command)
+            get_variables_from_code.assert_not_called()
+        self.assertEqual(
+            rendered_command["rendered_code"],
+            f"echo wow {self.server_test_1.name}",
+            "Rendered code doesn't match",
+        )
+
+        # Deleted variable is unlinked
+        much_var.unlink()
+        self.assertFalse(command.variable_ids, "Deleted variable must be unlinked")
+        self.assertEqual(command.missing_variable_references, "much_var")
+
+    def test_render_for_servers(self):
+        """Test rendering command for several servers at once"""
+        server_test_2 = self.Server.create(
+            {
+                "name": "Such server",
+                "ip_v4_address": "localhost",
+                "ssh_username": "admin",
+                "ssh_password": "password",
+                "ssh_auth_mode": "p",
+            }
+        )
+        command = self.Command.create(
+            {
+                "name": "Much command",
+                "code": "echo {{ much_var }} {{ tower.server.name }}",
+                "path": "/opt/{{ much_var }}",
+            }
+        )
+        much_var = self.Variable.create({"name": "much_var"})
+        self.VariableValue.create(
+            [
+                {
+                    "variable_id": much_var.id,
+                    "value_char": "wow",
+                    "server_id": self.server_test_1.id,
+                },
+                {
+                    "variable_id": much_var.id,
+                    "value_char": "doge",
+                    "server_id": server_test_2.id,
+                },
+            ]
+        )
+
+        servers = self.server_test_1 | server_test_2
+        server_class = self.registry["cx.tower.server"]
+        with patch.object(
+            server_class,
+            "get_variable_values",
+            autospec=True,
+            side_effect=server_class.get_variable_values,
+        ) as get_variable_values:
+            res = command.render_for_servers(servers)
+            get_variable_values.assert_called_once()
+        self.assertEqual(
+            res[self.server_test_1.id],
+            {
+                "rendered_code": f"echo wow {self.server_test_1.name}",
+                "rendered_path": "/opt/wow",
+            },
+        )
+        self.assertEqual(
+            res[server_test_2.id],
+            {"rendered_code": "echo doge Such server", "rendered_path": "/opt/doge"},
+        )
+
+        # Custom path
+        res = command.render_for_servers(servers, path="/tmp/{{ much_var }}")
+        self.assertEqual(res[server_test_2.id]["rendered_path"], "/tmp/doge")
+
     def test_render_code_generic(self):
         """Test generic (aka ssh) code template direct rendering"""
 
@@ -821,7 +985,7 @@ COMMAND_RESULT = {
         """
         self.assertFalse(self.template_file_server.file_ids)
 
-        def download_file(this, remote_path):
+        def download_file(this, remote_path, **kwargs):
             return b"Hello, world!"
 
         cx_tower_server_obj = self.registry["cx.tower.server"]
@@ -1,5 +1,13 @@
+import gzip
+import time
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
+
+from odoo import fields
 from odoo.exceptions import AccessError
 
+from ..models.command_output import CommandOutputCollector, OutputLimiter
+from ..models.constants import COMMAND_INTERRUPTED
 from .common import TestTowerCommon
 
 
@@ -126,3 +134,297 @@ class TestTowerCommandlog(TestTowerCommon):
             test_command_log_1.name,
             "Command name should be same",
         )
+
+    def test_streamed_output(self):
+        """Test saving command output while command is running"""
+        set_param = self.env["ir.config_parameter"].sudo().set_param
+        set_param("cetmix_tower_server.command_output_buffer_size", 10)
+        set_param("cetmix_tower_server.command_output_flush_interval", 1000)
+        log_record = self.CommandLog.start(
+            self.server_test_1.id, self.command_create_dir.id
+        )
+        collector = log_record._get_output_collector(["doge_secret"])
+
+        # Buffer is full. End of the output that can be a part
+        # of a secret is kept until more output is received.
+        collector.add_response(b"Such line, much text\n")
+        self.assertEqual(log_record.command_response, "Such line, ")
+
+        # Secrets are removed, multibyte symbols are not broken
+        collector.add_response(b"Much doge_secret")
+        symbol = "Ñ".encode()
+        collector.add_error(symbol[:1])
+        collector.add_error(symbol[1:])
+        collector.flush(final=True)
+        self.assertEqual(
+            log_record.command_response,
+            f"Such line, much text\nMuch {self.Key.SECRET_VALUE_SPOILER}",
+            "Secret must be replaced with spoiler",
+        )
+        self.assertEqual(log_record.command_error, "Ñ")
+
+        # Streamed output is kept when command is finished
+        log_record.with_context(command_output_streamed=True).finish(status=0)
+        self.assertFalse(log_record.is_running)
+        self.assertEqual(log_record.command_status, 0)
+        self.assertEqual(log_record.command_error, "Ñ")
+
+    def test_output_flush_growth(self):
+        """Test flushing large output in growing chunks"""
+        flushed = []
+        collector = CommandOutputCollector(
+            lambda response=None, error=None: flushed.append(response),
+            flush_interval=1000,
+            buffer_size=10,
+        )
+        collector.add_response(b"a" * 100)
+        self.assertEqual(len(flushed), 1, "Full buffer must be flushed")
+
+        # Chunk must be at least a quarter of the saved output
+        collector.add_response(b"b" * 20)
+        self.assertEqual(len(flushed), 1, "Small chunk must be kept in buffer")
+        collector.add_response(b"b" * 5)
+        self.assertEqual(flushed, ["a" * 100, "b" * 25])
+
+    def test_live_output(self):
+        """Test showing output of a running command"""
+        log_record = self.CommandLog.start(
+            self.server_test_1.id, self.command_create_dir.id
+        )
+        self.assertFalse(log_record.command_output_live)
+        Chunk = self.env["cx.tower.command.log.chunk"]
+        Chunk.create({"command_log_id": log_record.id, "command_response": "Such "})
+        Chunk.create({"command_log_id": log_record.id, "command_error": "wow\n"})
+        log_record.invalidate_cache(["command_output_live"])
+        self.assertEqual(log_record.command_output_live, "Such wow\n")
+
+        # Chunks are removed by the reaper once the command is finished
+        log_record.with_context(command_output_streamed=True).finish(status=0)
+        self.assertFalse(log_record.command_output_live)
+        self.CommandLog._reap_stale_runs()
+        self.assertFalse(Chunk.search([("command_log_id", "=", log_record.id)]))
+
+    def test_streamed_ssh_command(self):
+        """Test SSH command output streaming into the log"""
+        log_record = self.CommandLog.start(
+            self.server_test_1.id, self.command_create_dir.id
+        )
+
+        def exec_command(command, sudo=None, output_collector=None):
+            output_collector.add_response(b"Such response\n")
+            output_collector.add_error(b"Much error\n")
+            return 0, [], []
+
+        client = MagicMock()
+        client.exec_command.side_effect = exec_command
+
+        # Original method is used instead of the test one
+        execute_command_using_ssh = self.server_test_1._execute_command_using_ssh.origin
+        result = execute_command_using_ssh(
+            self.server_test_1, client, "ls", stream_log_record=log_record
+        )
+        self.assertTrue(result["streamed"], "Output must be streamed")
+        self.assertIsNone(result["response"], "Response must not be returned")
+        self.assertEqual(log_record.command_response, "Such response\n")
+        self.assertEqual(log_record.command_error, "Much error\n")
+
+    def test_streamed_ssh_command_single_session(self):
+        """Test streaming output of a command chain run in a single session"""
+        self.server_test_1.write(
+            {
+                "sudo_single_session": True,
+                "output_policy": "limit",
+                "output_head_kb": 1,
+                "output_tail_kb": 1,
+            }
+        )
+        log_record = self.CommandLog.start(
+            self.server_test_1.id, self.command_create_dir.id
+        )
+        marker = "__cxtower_status_test__"
+        output = "".join(f"Such line {i}\n" for i in range(1000))
+
+        def exec_command(command, sudo=None, output_collector=None):
+            output_collector.add_response(output.encode())
+            # Marker is split between chunks
+            output_collector.add_error(f"Doge is sad{marker[:10]}".encode())
+            output_collector.flush_if_due()
+            output_collector.add_error(f"{marker[10:]}0\n{marker}2\n".encode())
+            return 2, [], []
+
+        client = MagicMock()
+        client.exec_command.side_effect = exec_command
+
+        # Original method is used instead of the test one
+        execute_command_using_ssh = self.server_test_1._execute_command_using_ssh.origin
+        with patch(
+            "odoo.addons.cetmix_tower_server.models.cx_tower_server.generate_random_id",
+            return_value="test",
+        ):
+            result = execute_command_using_ssh(
+                self.server_test_1,
+                client,
+                "ls && mkdir /tmp/test",
+                sudo="p",
+                stream_log_record=log_record,
+            )
+        self.assertTrue(result["streamed"], "Output must be streamed")
+        self.assertEqual(result["status"], 2, "Status must be taken from markers")
+        self.assertIsNone(result["error"], "Status markers must not be returned")
+        self.assertEqual(
+            log_record.command_error, "Doge is sad", "Status markers must be removed"
+        )
+        self.assertTrue(log_record.command_response.startswith(output[:1024]))
+        self.assertTrue(log_record.command_response.endswith(output[-1024:]))
+        self.assertIn("skipped", log_record.command_response)
+
+    def test_output_policy(self):
+        """Test command output head and tail limits"""
+        output = "".join(f"Such line {i}\n" for i in range(1000))
+        log_record = self.CommandLog.start(
+            self.server_test_1.id, self.command_create_dir.id
+        )
+        log_record.finish(status=0, response=output)
+        self.assertEqual(log_record.command_response, output, "Output is not limited")
+        self.assertEqual(log_record.output_size, len(output))
+        self.assertEqual(log_record.output_line_count, 1000)
+        self.assertFalse(log_record.is_output_truncated)
+
+        # Limit output in server settings
+        self.server_test_1.write(
+            {
+                "output_policy": "limit",
+                "output_head_kb": 1,
+                "output_tail_kb": 1,
+                "output_attachment": True,
+            }
+        )
+        log_record = self.CommandLog.start(
+            self.server_test_1.id, self.command_create_dir.id
+        )
+        log_record.finish(status=0, response=output)
+        self.assertTrue(log_record.is_output_truncated, "Output must be truncated")
+        self.assertTrue(log_record.command_response.startswith(output[:1024]))
+        self.assertTrue(log_record.command_response.endswith(output[-1024:]))
+        self.assertIn("characters skipped", log_record.command_response)
+        self.assertEqual(log_record.output_size, len(output))
+        self.assertEqual(log_record.output_line_count, 1000)
+        self.assertEqual(
+            gzip.decompress(log_record.output_attachment_ids.raw),
+            output.encode(),
+            "Full output must be saved as attachment",
+        )
+
+        # Command policy overrides server one
+        self.command_create_dir.output_policy = "full"
+        log_record = self.CommandLog.start(
+            self.server_test_1.id, self.command_create_dir.id
+        )
+        log_record.finish(status=0, response=output)
+        self.assertEqual(log_record.command_response, output, "Output is not limited")
+        self.assertFalse(log_record.output_attachment_ids)
+
+    def test_output_limiter_bytes(self):
+        """Test that head and tail sizes are counted in bytes"""
+        limiter = OutputLimiter(head_size=3, tail_size=3)
+        # Two byte symbols are not split
+        res = limiter.feed("aÑ") + limiter.feed("Ñb") + limiter.feed("xyzÑ")
+        res += limiter.finish()
+        self.assertEqual(limiter.size, 12)
+        self.assertTrue(res.startswith("aÑ"), "Head must fit in 3 bytes")
+        self.assertTrue(res.endswith("\n\nzÑ"), "Tail must fit in 3 bytes")
+        self.assertEqual(limiter.skipped, 4)
+
+    def test_heartbeat(self):
+        """Test command heartbeats reported while command is running"""
+        self.env["ir.config_parameter"].sudo().set_param(
+            "cetmix_tower_server.heartbeat_interval", 0.01
+        )
+        plan_log = self.PlanLog.create(
+            {
+                "server_id": self.server_test_1.id,
+                "plan_id": self.plan_1.id,
+                "is_running": True,
+                "start_date": fields.Datetime.now(),
+            }
+        )
+        log_record = self.CommandLog.start(
+            self.server_test_1.id,
+            self.command_create_dir.id,
+            plan_log_id=plan_log.id,
+        )
+        self.assertTrue(log_record.heartbeat_date, "Heartbeat must be saved")
+
+        touched = []
+
+        def touch_heartbeat(records):
+            touched.append(records)
+
+        for model in ("cx.tower.command.log", "cx.tower.plan.log"):
+            patcher = patch.object(
+                self.registry[model],
+                "_touch_heartbeat",
+                autospec=True,
+                side_effect=touch_heartbeat,
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # Command that does not produce any output
+        with log_record._keep_heartbeat():
+            time.sleep(0.1)
+        touched_count = len(touched)
+        time.sleep(0.05)
+
+        self.assertIn(log_record, touched, "Command heartbeat must be reported")
+        self.assertIn(plan_log, touched, "Plan heartbeat must be reported")
+        self.assertEqual(len(touched), touched_count, "Heartbeats must be stopped")
+
+    def test_reap_stale_runs(self):
+        """Test that interrupted commands are finished by reaper"""
+        now = fields.Datetime.now()
+        old_date = now - timedelta(hours=2)
+        plan_log = self.PlanLog.create(
+            {
+                "server_id": self.server_test_1.id,
+                "plan_id": self.plan_1.id,
+                "is_running": True,
+                "start_date": now,
+                "heartbeat_date": now,
+            }
+        )
+        # Command of a flight plan run by a killed worker
+        stale_log = self.CommandLog.start(
+            self.server_test_1.id,
+            self.command_create_dir.id,
+            start_date=old_date,
+            plan_log_id=plan_log.id,
+        )
+        stale_log.heartbeat_date = old_date
+        # Command running a flight plan that is still alive
+        plan_command_log = self.CommandLog.start(
+            self.server_test_1.id,
+            self.command_list_dir.id,
+            start_date=old_date,
+            triggered_plan_log_id=plan_log.id,
+        )
+        plan_command_log.heartbeat_date = old_date
+        # Command that is still running
+        fresh_log = self.CommandLog.start(
+            self.server_test_1.id, self.command_list_dir.id
+        )
+
+        with patch.object(
+            self.registry["cx.tower.plan.log"],
+            "_plan_command_finished",
+            autospec=True,
+        ) as plan_command_finished:
+            reaped_logs = self.CommandLog._reap_stale_runs()
+        self.assertEqual(reaped_logs, stale_log, "Only stale command must be finished")
+        self.assertFalse(stale_log.is_running)
+        self.assertEqual(stale_log.command_status, COMMAND_INTERRUPTED)
+        self.assertTrue(stale_log.finish_date)
+        plan_command_finished.assert_not_called()
+        self.assertTrue(plan_log.is_running, "Flight plan must not be continued")
+        self.assertTrue(plan_command_log.is_running)
+        self.assertTrue(fresh_log.is_running)
@@ -182,3 +182,51 @@ class TestTowerCommandWizard(TestTowerCommon):
             test_wizard.result,
             msg="Command execution should succeed with a single server selected",
         )
+
+    def test_execute_command_on_multiple_servers(self):
+        """Test running command on several servers at once"""
+        server_test_2 = self.Server.create(
+            {
+                "name": "Test 2",
+                "ip_v4_address": "localhost",
+                "ssh_username": "root",
+                "ssh_password": "password",
+                "ssh_auth_mode": "p",
+                "os_id": self.os_debian_10.id,
+            }
+        )
+        servers = self.server_test_1 | server_test_2
+        self.env["ir.config_parameter"].sudo().set_param(
+            "cetmix_tower_server.max_parallel_servers", 4
+        )
+
+        # Results are returned in the same order as servers
+        self.assertEqual(
+            servers._run_in_parallel(lambda server: server.name),
+            [self.server_test_1.name, server_test_2.name],
+            "Results must be returned in the same order as servers",
+        )
+
+        # Failed server does not stop the other ones
+        def fail_first(server):
+            if server == self.server_test_1:
+                raise ValidationError("Such error")
+            return server.name
+
+        results = servers._run_in_parallel(fail_first)
+        self.assertIsInstance(results[0], ValidationError)
+        self.assertEqual(results[1], server_test_2.name)
+
+        test_wizard = self.env["cx.tower.command.execute.wizard"].create(
+            {
+                "server_ids": servers.ids,
+                "command_id": self.command_create_dir.id,
+            }
+        )
+        action = test_wizard.execute_command_on_server()
+        log_records = self.CommandLog.search(
+            [("label", "=", action["context"]["search_default_label"])]
+        )
+        self.assertEqual(
+            log_records.server_id, servers, "Command must be run on all servers"
+        )
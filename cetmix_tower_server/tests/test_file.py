@@ -1,8 +1,9 @@
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 from odoo import exceptions
 from odoo.exceptions import AccessError
 
+from ..models.cx_tower_server import SSH
 from .common import TestTowerCommon
 
 
@@ -39,7 +40,7 @@ class TestTowerFile(TestTowerCommon):
         """
         cx_tower_server_obj = self.registry["cx.tower.server"]
 
-        def upload_file(this, file, remote_path):
+        def upload_file(this, file, remote_path, **kwargs):
             if file == "Hello, world!" and remote_path == "/var/tmp":
                 return "ok"
 
@@ -47,13 +48,104 @@ class TestTowerFile(TestTowerCommon):
             self.file.action_push_to_server()
             self.assertEqual(self.file.server_response, "ok")
 
+    def test_upload_files_shared_connection(self):
+        """
+        Upload several files of the same server using a single connection
+        """
+        file_3 = self.File.create(
+            {
+                "name": "test_3.txt",
+                "source": "tower",
+                "server_id": self.server_test_1.id,
+                "server_dir": "/var/tmp",
+                "code": "Such file",
+            }
+        )
+        cx_tower_server_obj = self.registry["cx.tower.server"]
+        ssh_connection = MagicMock(spec=SSH)
+        connections_used = []
+
+        def upload_file(this, file, remote_path, **kwargs):
+            connections_used.append(kwargs.get("ssh_connection"))
+            return "ok"
+
+        with patch.object(
+            cx_tower_server_obj, "_connect", return_value=ssh_connection
+        ) as connect:
+            with patch.object(cx_tower_server_obj, "upload_file", upload_file):
+                (self.file | file_3).upload()
+
+        self.assertEqual(connect.call_count, 1, "Must connect only once")
+        self.assertEqual(
+            connections_used,
+            [ssh_connection, ssh_connection],
+            "All files must be uploaded using the same connection",
+        )
+        ssh_connection.disconnect.assert_called_once()
+        self.assertEqual(self.file.server_response, "ok")
+        self.assertEqual(file_3.server_response, "ok")
+
+    def test_server_bulk_file_api(self):
+        """
+        Test bulk file operations of the server
+        """
+        ssh_connection = MagicMock(spec=SSH)
+        ssh_connection.download_file.side_effect = [
+            b"Hello, world!",
+            FileNotFoundError(),
+        ]
+        cx_tower_server_obj = self.registry["cx.tower.server"]
+        with patch.object(
+            cx_tower_server_obj, "_connect", return_value=ssh_connection
+        ) as connect:
+            result = self.server_test_1.download_files(
+                ["/var/tmp/test.txt", "/var/tmp/missing.txt"], raise_on_error=False
+            )
+            self.assertEqual(connect.call_count, 1, "Must connect only once")
+            self.assertEqual(result[0], b"Hello, world!")
+            self.assertIsInstance(
+                result[1],
+                exceptions.ValidationError,
+                "Exception must be returned in place of the result",
+            )
+            ssh_connection.disconnect.assert_called_once()
+
+            # Provided connection is not closed
+            ssh_connection.reset_mock()
+            self.server_test_1.upload_files(
+                [("Hello", "/var/tmp/a.txt"), (b"world", "/var/tmp/b.txt")],
+                ssh_connection=ssh_connection,
+            )
+            self.server_test_1.delete_files(
+                ["/var/tmp/a.txt"], ssh_connection=ssh_connection
+            )
+            self.assertEqual(connect.call_count, 1, "Must use provided connection")
+            self.assertEqual(ssh_connection.upload_file.call_count, 2)
+            ssh_connection.delete_file.assert_called_once_with("/var/tmp/a.txt")
+            ssh_connection.disconnect.assert_not_called()
+
+            # Error is raised by default
+            ssh_connection.download_file.side_effect = FileNotFoundError()
+            with self.assertRaises(exceptions.ValidationError):
+                self.server_test_1.download_files(["/var/tmp/missing.txt"])
+
+            # Connection opened for a single file is released on error too
+            ssh_connection.reset_mock()
+            with self.assertRaises(exceptions.ValidationError):
+                self.server_test_1.download_file("/var/tmp/missing.txt")
+            ssh_connection.disconnect.assert_called_once()
+            ssh_connection.reset_mock()
+            self.server_test_1.upload_file("Hello", "/var/tmp/a.txt")
+            self.server_test_1.delete_file("/var/tmp/a.txt")
+            self.assertEqual(ssh_connection.disconnect.call_count, 2)
+
     def test_delete_file(self):
         """
         Delete file remotely from server
         """
         cx_tower_server_obj = self.registry["cx.tower.server"]
 
-        def delete_file(this, remote_path):
+        def delete_file(this, remote_path, **kwargs):
             if remote_path == "/var/tmp":
                 return "ok"
 
@@ -73,7 +165,7 @@ class TestTowerFile(TestTowerCommon):
         Download file from server to tower
         """
 
-        def download_file(this, remote_path):
+        def download_file(this, remote_path, **kwargs):
             if remote_path == "/var/tmp/test.txt":
                 return b"Hello, world!"
             elif remote_path == "/var/tmp/binary.zip":
@@ -101,7 +193,7 @@ class TestTowerFile(TestTowerCommon):
         """
         cx_tower_server_obj = self.registry["cx.tower.server"]
 
-        def upload_file(this, file, remote_path):
+        def upload_file(this, file, remote_path, **kwargs):
             if file == "Hello, world!" and remote_path == "/var/tmp":
                 return "ok"
 
@@ -109,7 +201,7 @@ class TestTowerFile(TestTowerCommon):
             self.file.action_push_to_server()
             self.assertEqual(self.file.server_response, "ok")
 
-        def download_file(this, remote_path):
+        def download_file(this, remote_path, **kwargs):
             if remote_path == "/var/tmp/test.txt":
                 return b"Hello, world!"
 
@@ -245,6 +337,58 @@ class TestTowerFile(TestTowerCommon):
         )
         self.assertEqual(another_file, file)
 
+    def test_file_template_render_for_servers(self):
+        """Test rendering file template for several servers at once"""
+        server_test_2 = self.Server.create(
+            {
+                "name": "Such server",
+                "ip_v4_address": "localhost",
+                "ssh_username": "admin",
+                "ssh_password": "password",
+                "ssh_auth_mode": "p",
+            }
+        )
+        self.file_template.write(
+            {
+                "file_name": "{{ tower.server.name }}.txt",
+                "code": "Hello, {{ test_path_ }}!",
+            }
+        )
+        self.VariableValue.create(
+            [
+                {
+                    "variable_id": self.variable_path.id,
+                    "value_char": "/much",
+                    "server_id": self.server_test_1.id,
+                },
+                {
+                    "variable_id": self.variable_path.id,
+                    "value_char": "/such",
+                    "server_id": server_test_2.id,
+                },
+            ]
+        )
+
+        res = self.file_template.render_for_servers(
+            self.server_test_1 | server_test_2, server_dir="{{ test_path_ }}/tmp"
+        )
+        self.assertEqual(
+            res[self.server_test_1.id],
+            {
+                "rendered_name": f"{self.server_test_1.name}.txt",
+                "rendered_server_dir": "/much/tmp",
+                "rendered_code": "Hello, /much!",
+            },
+        )
+        self.assertEqual(
+            res[server_test_2.id],
+            {
+                "rendered_name": "Such server.txt",
+                "rendered_server_dir": "/such/tmp",
+                "rendered_code": "Hello, /such!",
+            },
+        )
+
     def test_files_access_rule(self):
         """
         Test access rules for files
@@ -1,5 +1,8 @@
+from unittest.mock import patch
+
 from odoo.exceptions import AccessError
 
+from ..models.cx_tower_key import SECRET_CACHES
 from .common import TestTowerCommon
 
 
@@ -102,6 +105,25 @@ class TestTowerKey(TestTowerCommon):
             "Key string must be in key strings",
         )
 
+    def test_tokenize_code(self):
+        """Check if key tokens are found in a single pass"""
+        code = (
+            "#!cxtower.secret.MEME_KEY!# & #!cxtower.DOGE_KEY!# "
+            "#!cxtower.secret.DOGE_KEY !#"
+        )
+        tokens = self.Key._tokenize_code(code)
+        self.assertEqual(len(tokens), 3, "Must be 3 tokens")
+        self.assertEqual(
+            (tokens[0].start, tokens[0].key_type, tokens[0].reference),
+            (0, "secret", "MEME_KEY"),
+            "Key at the beginning of the code must be found",
+        )
+        self.assertIsNone(tokens[1].reference, "Malformed key must have no reference")
+        self.assertEqual(
+            code[tokens[2].start : tokens[2].end], "#!cxtower.secret.DOGE_KEY !#"
+        )
+        self.assertEqual(tokens[2].reference, "DOGE_KEY")
+
     def test_parse_key_string(self):
         """Check if key string is parsed correctly"""
 
@@ -240,6 +262,112 @@ class TestTowerKey(TestTowerCommon):
         key_value = self.Key._resolve_key_type_secret("DOGE_KEY", **kwargs)
         self.assertEqual(key_value, "Doge server", "Key value doesn't match")
 
+    def test_resolve_key_strings(self):
+        """Check that all secrets of the code are resolved at once"""
+        self.Key.create(
+            [
+                {
+                    "name": "doge key",
+                    "reference": "DOGE_KEY",
+                    "secret_value": "Doge dog",
+                    "key_type": "s",
+                },
+                {
+                    "name": "doge key",
+                    "reference": "DOGE_KEY",
+                    "secret_value": "Doge server",
+                    "key_type": "s",
+                    "server_id": self.server_test_1.id,
+                },
+                {
+                    "name": "meme key",
+                    "reference": "MEME_KEY",
+                    "secret_value": "Pepe Frog",
+                    "key_type": "s",
+                },
+                {
+                    "name": "meme key",
+                    "reference": "MEME_KEY",
+                    "secret_value": "Pepe partner",
+                    "key_type": "s",
+                    "partner_id": self.user_bob.partner_id.id,
+                },
+            ]
+        )
+        code = (
+            "#!cxtower.secret.DOGE_KEY!# #!cxtower.secret.MEME_KEY!# "
+            "#!cxtower.secret.PEPE_KEY!#"
+        )
+        key_cache = {}
+        kwargs = {
+            "server_id": self.server_test_1.id,
+            "partner_id": self.user_bob.partner_id.id,
+            "key_cache": key_cache,
+        }
+        key_class = self.registry["cx.tower.key"]
+        with patch.object(
+            key_class,
+            "_resolve_key_type_secrets",
+            autospec=True,
+            side_effect=key_class._resolve_key_type_secrets,
+        ) as mock_resolve:
+            result = self.Key._parse_code_and_return_key_values(code, **kwargs)
+            self.assertEqual(mock_resolve.call_count, 1, "Must be a single call")
+            self.assertEqual(
+                result["code"], "Doge server Pepe partner #!cxtower.secret.PEPE_KEY!#"
+            )
+            self.assertEqual(
+                key_cache,
+                {
+                    ("secret", "DOGE_KEY"): "Doge server",
+                    ("secret", "MEME_KEY"): "Pepe partner",
+                    ("secret", "PEPE_KEY"): None,
+                },
+            )
+
+            # Cached values are reused
+            self.Key._parse_code(code, **kwargs)
+            self.assertEqual(mock_resolve.call_count, 1, "Cached values must be used")
+
+    def test_cache_secrets(self):
+        """Check that secrets are cached only while the block is running"""
+        self.Key.create(
+            {
+                "name": "doge key",
+                "reference": "DOGE_KEY",
+                "secret_value": "Doge dog",
+                "key_type": "s",
+            }
+        )
+        code = "echo #!cxtower.secret.DOGE_KEY!#"
+        kwargs = {"server_id": self.server_test_1.id}
+        key_class = self.registry["cx.tower.key"]
+        with patch.object(
+            key_class,
+            "_resolve_key_type_secret",
+            autospec=True,
+            side_effect=key_class._resolve_key_type_secret,
+        ) as mock_resolve:
+            with self.Key._cache_secrets():
+                self.assertEqual(self.Key._parse_code(code, **kwargs), "echo Doge dog")
+                # Nested block reuses the same cache
+                with self.Key._cache_secrets():
+                    self.Key._parse_code(code, **kwargs)
+                self.assertEqual(
+                    mock_resolve.call_count, 1, "Secret resolver hook must be used once"
+                )
+                self.assertTrue(SECRET_CACHES.caches, "Secret must be cached")
+
+            # Secrets are removed even if an error is raised
+            with self.assertRaises(ValueError), self.Key._cache_secrets():
+                self.Key._parse_code(code, **kwargs)
+                raise ValueError()
+            self.assertIsNone(SECRET_CACHES.caches, "Secrets must be removed")
+
+            # Secrets are not cached outside of the block
+            self.Key._parse_code(code, **kwargs)
+            self.assertEqual(mock_resolve.call_count, 3)
+
     def test_parse_code(self):
         """Test code parsing"""
 
@@ -417,3 +545,44 @@ class TestTowerKey(TestTowerCommon):
         key_values = ["Wow much", "No like"]
         result = self.Key._replace_with_spoiler(code, key_values)
         self.assertEqual(result, code, "Result doesn't match expected code")
+
+    def test_secret_scrubber_stream(self):
+        """Check if secrets split between output chunks are replaced"""
+        spoiler = self.Key.SECRET_VALUE_SPOILER
+        scrubber = self.Key._get_secret_scrubber(['"Pepe Frog"', "Pepe", "Doge\\nmuch"])
+        text = "Hey Pepe Frog & Pepe Doge\nmuch so like Pepe"
+        expected_text = f"Hey {spoiler} & {spoiler} {spoiler} so like {spoiler}"
+        self.assertEqual(scrubber.scrub(text), expected_text)
+
+        # Feed text by small chunks
+        for chunk_size in (1, 3, 7):
+            stream = scrubber.stream()
+            result = "".join(
+                stream.feed(text[i : i + chunk_size])
+                for i in range(0, len(text), chunk_size)
+            )
+            self.assertNotIn("Pepe", result, "Secret must not be saved")
+            result += stream.finish()
+            self.assertEqual(result, expected_text, "Result doesn't match expected")
+
+    def test_secret_scrubber_stream_overlap(self):
+        """Check if overlapping secrets split between chunks are replaced
+        the same way as in the whole text
+        """
+        spoiler = self.Key.SECRET_VALUE_SPOILER
+        scrubber = self.Key._get_secret_scrubber(["doge", "wow such doge", "such"])
+        text = "wow such wow such doge!"
+        expected_text = f"wow {spoiler} {spoiler}!"
+        self.assertEqual(scrubber.scrub(text), expected_text)
+
+        # Split inside the longest secret after the short one is received
+        for split in range(1, len(text)):
+            stream = scrubber.stream()
+            result = stream.feed(text[:split])
+            result += stream.feed(text[split:])
+            result += stream.finish()
+            self.assertEqual(
+                result,
+                expected_text,
+                f"Result doesn't match expected when split at {split}",
+            )
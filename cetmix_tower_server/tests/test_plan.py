@@ -1,10 +1,16 @@
 # Copyright (C) 2022 Cetmix OÜ
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
-from unittest.mock import patch
+import traceback
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
 
 from odoo import _, fields
-from odoo.exceptions import AccessError, ValidationError
+from odoo.exceptions import AccessError, UserError, ValidationError
+from odoo.tools.safe_eval import expr_eval
 
+from ..models.constants import PLAN_INTERRUPTED, PLAN_LINE_FAILED
+from ..models.cx_tower_plan_log import PLAN_SSH_CONNECTIONS
+from ..models.cx_tower_server import SSH
 from .common import TestTowerCommon
 
 
@@ -232,6 +238,36 @@ class TestTowerPlan(TestTowerCommon):
         self.assertEqual(exit_code, 1, msg="Exit code must be equal to 1")
         self.assertIsNone(next_line_id, msg="Next line must be None")
 
+    def test_plan_graph(self):
+        """Test compiled plan is reused until the plan is modified"""
+        plan_line_1 = self.plan_1.line_ids[0]
+        plan_line_2 = self.plan_1.line_ids[1]
+
+        graph = self.plan_1._get_plan_graph()
+        self.assertEqual(graph.first_line_id, plan_line_1.id)
+        self.assertEqual(graph.lines[plan_line_1.id].next_line_id, plan_line_2.id)
+        self.assertIsNone(graph.lines[plan_line_2.id].next_line_id)
+
+        # Compiled predicates must match the action expressions
+        graph_actions = graph.lines[plan_line_1.id].actions
+        self.assertEqual(len(graph_actions), len(plan_line_1.action_ids))
+        for index, action in enumerate(plan_line_1.action_ids):
+            graph_action = graph_actions[index]
+            for exit_code in (-12, 0, 1, 8, 255):
+                self.assertEqual(
+                    graph_action.predicate(exit_code),
+                    expr_eval(f"{exit_code} {action.condition} {action.value_char}"),
+                )
+
+        # Graph is not rebuilt if nothing is modified
+        self.assertIs(self.plan_1._get_plan_graph(), graph)
+
+        # Graph is rebuilt once an action is modified
+        plan_line_1.action_ids[0].value_char = "42"
+        new_graph = self.plan_1._get_plan_graph()
+        self.assertIsNot(new_graph, graph)
+        self.assertTrue(new_graph.lines[plan_line_1.id].actions[0].predicate(42))
+
     def test_plan_execute_single(self):
         """Test plan execution results"""
         # Execute plan
@@ -301,6 +337,262 @@ class TestTowerPlan(TestTowerCommon):
             "Path in command log must be the same as in the flight plan line",
         )
 
+    def test_plan_long_run_stack(self):
+        """Test that plan lines are run by a loop instead of recursion"""
+        plan = self.Plan.create(
+            {
+                "name": "Much long plan",
+                "line_ids": [
+                    (0, 0, {"sequence": i, "command_id": self.command_list_dir.id})
+                    for i in range(30)
+                ],
+            }
+        )
+        line_class = self.registry["cx.tower.plan.line"]
+        stack_depths = []
+
+        def execute(line, server, plan_log_record, **kwargs):
+            stack_depths.append(len(traceback.extract_stack()))
+            return execute.origin(line, server, plan_log_record, **kwargs)
+
+        execute.origin = line_class._execute
+        with patch.object(line_class, "_execute", autospec=True, side_effect=execute):
+            plan_status = plan._execute_single(self.server_test_1)
+
+        plan_log = self.PlanLog.search([("plan_id", "=", plan.id)])
+        self.assertEqual(plan_status, 0, "Plan must be finished successfully")
+        self.assertEqual(len(plan_log.command_log_ids), 30, "All lines must be run")
+        self.assertFalse(plan_log.is_running)
+        self.assertEqual(
+            len(set(stack_depths[1:])), 1, "Stack must not grow with each plan line"
+        )
+
+    def test_plan_parallel_group(self):
+        """Test that lines of a parallel group are run together"""
+        plan = self.Plan.create(
+            {
+                "name": "Pull images",
+                "line_ids": [
+                    (
+                        0,
+                        0,
+                        {
+                            "sequence": 1,
+                            "command_id": self.command_list_dir.id,
+                            "parallel_group": "pull",
+                        },
+                    ),
+                    (
+                        0,
+                        0,
+                        {
+                            "sequence": 2,
+                            "command_id": self.command_list_dir.id,
+                            "parallel_group": "pull",
+                        },
+                    ),
+                    (0, 0, {"sequence": 3, "command_id": self.command_list_dir.id}),
+                ],
+            }
+        )
+        line_class = self.registry["cx.tower.plan.line"]
+        with patch.object(
+            line_class,
+            "_run_parallel_group",
+            autospec=True,
+            side_effect=line_class._run_parallel_group,
+        ) as run_parallel_group:
+            plan_status = plan._execute_single(self.server_test_1)
+
+        self.assertEqual(plan_status, 0, "Plan must be finished successfully")
+        run_parallel_group.assert_called_once()
+        self.assertEqual(
+            run_parallel_group.call_args[0][0],
+            plan.line_ids[:2],
+            "Only lines of the group must be run together",
+        )
+        plan_log = self.PlanLog.search([("plan_id", "=", plan.id)])
+        self.assertEqual(len(plan_log.command_log_ids), 3, "All lines must be run")
+        self.assertEqual(plan_log.plan_line_executed_id, plan.line_ids[2])
+
+        # First line of the group exits the plan.
+        # Second line of the group is finished anyway.
+        plan.line_ids[0].action_ids = [
+            (
+                0,
+                0,
+                {
+                    "condition": "==",
+                    "value_char": "0",
+                    "action": "ec",
+                    "custom_exit_code": 42,
+                },
+            )
+        ]
+        plan_status = plan._execute_single(self.server_test_1)
+        self.assertEqual(plan_status, 42, "Line action must be applied")
+        plan_log = self.PlanLog.search([("plan_id", "=", plan.id)], limit=1)
+        self.assertEqual(
+            len(plan_log.command_log_ids), 2, "Line after the group must not be run"
+        )
+
+    def test_plan_parallel_group_threads(self):
+        """Test parallel group with lines run in other transactions"""
+        plan = self.Plan.create(
+            {
+                "name": "Such parallel plan",
+                "line_ids": [
+                    (
+                        0,
+                        0,
+                        {
+                            "sequence": 1,
+                            "command_id": self.command_create_dir.id,
+                            "parallel_group": "pull",
+                        },
+                    ),
+                    (
+                        0,
+                        0,
+                        {
+                            "sequence": 2,
+                            "command_id": self.command_list_dir.id,
+                            "parallel_group": "pull",
+                        },
+                    ),
+                    (0, 0, {"sequence": 3, "command_id": self.command_list_dir.id}),
+                ],
+            }
+        )
+
+        def run_in_other_transactions(records, func, max_workers, stop=None):
+            results = [func(record) for record in records]
+            # Command logs committed by other transactions cannot be read
+            self.CommandLog.browse(
+                [result["command_log_id"] for result in results]
+            ).sudo().unlink()
+            return results
+
+        with patch(
+            "odoo.addons.cetmix_tower_server.models.cx_tower_plan_line.run_in_parallel",
+            side_effect=run_in_other_transactions,
+        ):
+            plan_status = plan._execute_single(self.server_test_1)
+        self.assertEqual(plan_status, 0, "Plan must be finished successfully")
+        plan_log = self.PlanLog.search([("plan_id", "=", plan.id)])
+        self.assertEqual(
+            len(plan_log.command_log_ids), 1, "Line after the group must be run"
+        )
+
+        # Line that fails with an error fails the group
+        def run_with_error(records, func, max_workers, stop=None):
+            return [func(records[0]), ValidationError("Such error")]
+
+        with patch(
+            "odoo.addons.cetmix_tower_server.models.cx_tower_plan_line.run_in_parallel",
+            side_effect=run_with_error,
+        ):
+            plan_status = plan._execute_single(self.server_test_1)
+        self.assertEqual(plan_status, PLAN_LINE_FAILED, "Group must fail")
+        plan_log = self.PlanLog.search([("plan_id", "=", plan.id)], limit=1)
+        self.assertFalse(plan_log.is_running, "Plan log must be finished")
+        self.assertEqual(plan_log.plan_status, PLAN_LINE_FAILED)
+
+    def test_plan_interrupted_resume(self):
+        """Test that interrupted plan is finished by reaper and resumed"""
+        self.plan_1._execute_single(self.server_test_1)
+        plan_log = self.PlanLog.search([("plan_id", "=", self.plan_1.id)])
+        self.assertTrue(plan_log.heartbeat_date, "Heartbeat must be saved")
+        self.assertEqual(
+            plan_log.plan_line_completed_id,
+            self.plan_line_1,
+            "First line must be saved as completed",
+        )
+
+        # Simulate a worker killed while the second line was running
+        now = fields.Datetime.now()
+        plan_log.write(
+            {
+                "is_running": True,
+                "plan_status": False,
+                "finish_date": False,
+                "heartbeat_date": now - timedelta(hours=2),
+            }
+        )
+        # Stale parent plan with a nested plan that is still alive
+        parent_log = self.PlanLog.create(
+            {
+                "server_id": self.server_test_1.id,
+                "plan_id": self.plan_2.id,
+                "is_running": True,
+                "start_date": now - timedelta(hours=2),
+                "heartbeat_date": now - timedelta(hours=2),
+            }
+        )
+        child_log = self.PlanLog.create(
+            {
+                "server_id": self.server_test_1.id,
+                "plan_id": self.plan_2.id,
+                "is_running": True,
+                "start_date": now,
+                "heartbeat_date": now,
+                "parent_flight_plan_log_id": parent_log.id,
+            }
+        )
+
+        reaped_logs = self.PlanLog._reap_stale_runs()
+        self.assertEqual(reaped_logs, plan_log, "Only stale plan must be finished")
+        self.assertFalse(plan_log.is_running)
+        self.assertEqual(plan_log.plan_status, PLAN_INTERRUPTED)
+        self.assertTrue(parent_log.is_running, "Parent of alive plan must be kept")
+        self.assertTrue(child_log.is_running)
+
+        # Resume from the line next to the last completed one
+        action = plan_log.action_resume()
+        resumed_log = self.PlanLog.browse(action["res_id"])
+        self.assertEqual(resumed_log.resumed_from_log_id, plan_log)
+        self.assertEqual(resumed_log.plan_status, 0, "Plan must be finished")
+        self.assertEqual(
+            resumed_log.command_log_ids.command_id,
+            self.plan_line_2.command_id,
+            "Only the second line must be run",
+        )
+
+        # Finished plan cannot be resumed
+        with self.assertRaises(UserError):
+            resumed_log.action_resume()
+
+    def test_plan_shared_ssh_connection(self):
+        """Test that all plan lines use the same SSH connection"""
+        ssh_connection = MagicMock(spec=SSH)
+        cx_tower_server_obj = self.registry["cx.tower.server"]
+        connections_used = []
+
+        execute_command_using_ssh = cx_tower_server_obj._execute_command_using_ssh
+
+        def _execute_command_using_ssh(this, client, command_code, **kwargs):
+            connections_used.append(client)
+            return execute_command_using_ssh(this, client, command_code, **kwargs)
+
+        with patch.object(
+            cx_tower_server_obj, "_connect", return_value=ssh_connection
+        ) as connect:
+            with patch.object(
+                cx_tower_server_obj,
+                "_execute_command_using_ssh",
+                _execute_command_using_ssh,
+            ):
+                self.plan_1._execute_single(self.server_test_1)
+
+        self.assertEqual(connect.call_count, 1, "Must connect only once")
+        self.assertEqual(len(connections_used), 2, "Must run 2 commands")
+        self.assertTrue(
+            all(client is ssh_connection for client in connections_used),
+            "All commands must use the same connection",
+        )
+        ssh_connection.disconnect.assert_called_once()
+        self.assertFalse(PLAN_SSH_CONNECTIONS, "Connection must be released")
+
     def test_plan_user_access_rule(self):
         """Test plan user access rule"""
         # Create the test plan without assigned plan.lines
@@ -1692,3 +1984,82 @@ class TestTowerPlan(TestTowerCommon):
             variable_value_as_bob.exists(),
             msg="Manager should be able to delete own plan line action variable value",
         )
+
+    def test_plan_execute_fleet(self):
+        """Test plan execution on multiple servers"""
+        servers = self.server_test_1
+        for name in ("Test fleet 1", "Test fleet 2"):
+            servers |= self.Server.create(
+                {
+                    "name": name,
+                    "ip_v4_address": "localhost",
+                    "ssh_username": "admin",
+                    "ssh_password": "password",
+                    "ssh_auth_mode": "p",
+                }
+            )
+
+        # Successful run
+        fleet_log = self.plan_1.execute_fleet(
+            servers, max_parallel_servers=2, plan_log={"label": "fleet"}
+        )
+        self.assertFalse(fleet_log.is_running, "Fleet log must be finished")
+        self.assertFalse(fleet_log.is_stopped, "Fleet log must not be stopped")
+        self.assertEqual(fleet_log.label, "fleet", "Label must be saved")
+        self.assertEqual(
+            fleet_log.plan_log_ids.mapped("server_id"),
+            servers,
+            "Plan must be executed on all servers",
+        )
+        self.assertEqual(fleet_log.server_count, 3)
+        self.assertEqual(fleet_log.success_count, 3)
+        self.assertEqual(fleet_log.failed_count, 0)
+        self.assertEqual(fleet_log.not_started_count, 0)
+        self.assertTrue(
+            all(label == "fleet" for label in fleet_log.plan_log_ids.mapped("label")),
+            "Plan log values must be passed to plan logs",
+        )
+
+        # Plan fails with custom exit code. Stop after 2 failed servers.
+        self.plan_line_1_action_1.write({"custom_exit_code": 29, "action": "ec"})
+        fleet_log = self.plan_1.execute_fleet(servers, max_failed_servers=2)
+        self.assertTrue(fleet_log.is_stopped, "Fleet log must be stopped")
+        self.assertEqual(len(fleet_log.plan_log_ids), 2, "Must run on 2 servers")
+        self.assertEqual(fleet_log.success_count, 0)
+        self.assertEqual(fleet_log.failed_count, 2)
+        self.assertEqual(fleet_log.not_started_count, 1)
+
+        # Never stop
+        fleet_log = self.plan_1.execute_fleet(servers)
+        self.assertFalse(fleet_log.is_stopped, "Fleet log must not be stopped")
+        self.assertEqual(fleet_log.failed_count, 3)
+        self.assertEqual(fleet_log.not_started_count, 0)
+
+        # Error on one server does not stop the other ones
+        self.plan_line_1_action_1.write({"custom_exit_code": 0, "action": "n"})
+        plan_class = self.registry["cx.tower.plan"]
+        execute_single = plan_class._execute_single
+        failed_server = servers[0]
+
+        def execute_single_with_error(plan, server, **kwargs):
+            if server == failed_server:
+                raise ValidationError("Such error")
+            return execute_single(plan, server, **kwargs)
+
+        with patch.object(
+            plan_class,
+            "_execute_single",
+            autospec=True,
+            side_effect=execute_single_with_error,
+        ):
+            fleet_log = self.plan_1.execute_fleet(servers, max_failed_servers=2)
+        self.assertFalse(fleet_log.is_stopped, "Fleet log must not be stopped")
+        self.assertEqual(fleet_log.error_server_ids, failed_server)
+        self.assertIn("Such error", fleet_log.error_message)
+        self.assertEqual(
+            fleet_log.plan_log_ids.mapped("server_id"),
+            servers - failed_server,
+            "Plan must be executed on other servers",
+        )
+        self.assertEqual(fleet_log.failed_count, 1)
+        self.assertEqual(fleet_log.not_started_count, 0)
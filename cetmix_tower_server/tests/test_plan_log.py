@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 from odoo.exceptions import AccessError
 
 from .common import TestTowerCommon
@@ -55,3 +57,36 @@ class TestTowerPlanlog(TestTowerCommon):
                                 not be able to unlink log entries",
         ):
             test_plan_log_as_bob.unlink()
+
+    def test_can_commit_plan_checkpoint(self):
+        """Test that request transaction is not committed by plans"""
+        plan_log = self.PlanLog
+        self.assertFalse(
+            plan_log._can_commit_plan_checkpoint(), "Never commit in test mode"
+        )
+        with patch.object(type(self.registry), "in_test_mode", return_value=False):
+            self.assertFalse(
+                plan_log._can_commit_plan_checkpoint(),
+                "Request transaction must not be committed by default",
+            )
+            self.assertTrue(
+                plan_log.with_context(
+                    cx_tower_commit_allowed=True
+                )._can_commit_plan_checkpoint(),
+                "Own cursor can be committed",
+            )
+            self.env["ir.config_parameter"].sudo().set_param(
+                "cetmix_tower_server.plan_checkpoint_commit", "True"
+            )
+            self.assertTrue(plan_log._can_commit_plan_checkpoint())
+
+    def test_plan_checkpoint_in_sequential_run(self):
+        """Test that plans run one by one in savepoints do not commit"""
+        self.env["ir.config_parameter"].sudo().set_param(
+            "cetmix_tower_server.plan_checkpoint_commit", "True"
+        )
+        cursor_class = type(self.env.cr)
+        with patch.object(type(self.registry), "in_test_mode", return_value=False):
+            with patch.object(cursor_class, "commit") as commit:
+                self.plan_1.execute_fleet(self.server_test_1, max_parallel_servers=1)
+                commit.assert_not_called()
@@ -0,0 +1,114 @@
+from unittest.mock import MagicMock
+
+from ..models.ssh_host_keys import (
+    SSH_HOST_KEYS,
+    HostKeyMismatchError,
+    TrustedHostKeyPolicy,
+)
+from .common import TestTowerCommon
+
+
+class FakeKey:
+    def __init__(self, key_type, data):
+        self.key_type = key_type
+        self.data = data
+
+    def get_name(self):
+        return self.key_type
+
+    def get_base64(self):
+        return self.data
+
+    def get_fingerprint(self):
+        return self.data.encode()
+
+
+class TestTowerSSHHostKeys(TestTowerCommon):
+    def test_policy(self):
+        """Test trust on first use host key policy"""
+        new_keys = []
+
+        def on_new_host_key(key_type, key):
+            new_keys.append((key_type, key))
+
+        # First connection: key is accepted and reported
+        TrustedHostKeyPolicy({}, on_new_host_key).missing_host_key(
+            None, "localhost", FakeKey("ssh-ed25519", "much_key")
+        )
+        self.assertEqual(new_keys, [("ssh-ed25519", "much_key")])
+
+        # Known key is accepted
+        policy = TrustedHostKeyPolicy({"ssh-ed25519": "much_key"}, on_new_host_key)
+        policy.missing_host_key(None, "localhost", FakeKey("ssh-ed25519", "much_key"))
+        self.assertEqual(len(new_keys), 1, "Known key must not be reported")
+
+        # Another key is rejected
+        with self.assertRaises(HostKeyMismatchError):
+            policy.missing_host_key(
+                None, "localhost", FakeKey("ssh-ed25519", "such_key")
+            )
+        with self.assertRaises(HostKeyMismatchError):
+            policy.missing_host_key(None, "localhost", FakeKey("ssh-rsa", "much_key"))
+
+    def test_policy_system_host_keys(self):
+        """Test checking the first key against the system known hosts"""
+        new_keys = []
+        system_host_keys = MagicMock()
+        system_host_keys.lookup.side_effect = lambda hostname: (
+            {"ssh-ed25519": FakeKey("ssh-ed25519", "much_key")}
+            if hostname == "localhost"
+            else None
+        )
+        policy = TrustedHostKeyPolicy(
+            {},
+            lambda key_type, key: new_keys.append((key_type, key)),
+            system_host_keys=system_host_keys,
+        )
+
+        # Known host: key must match the system one
+        with self.assertRaises(HostKeyMismatchError):
+            policy.missing_host_key(
+                None, "localhost", FakeKey("ssh-ed25519", "such_key")
+            )
+        self.assertFalse(new_keys, "Rejected key must not be reported")
+        policy.missing_host_key(None, "localhost", FakeKey("ssh-ed25519", "much_key"))
+        self.assertEqual(new_keys, [("ssh-ed25519", "much_key")])
+
+        # Unknown host: key is trusted on first use
+        policy.missing_host_key(None, "example.com", FakeKey("ssh-rsa", "wow_key"))
+        self.assertEqual(new_keys[-1], ("ssh-rsa", "wow_key"))
+
+    def test_save_host_keys(self):
+        """Test that new host keys are saved and loaded"""
+        dbname = self.env.cr.dbname
+        server_id = self.server_test_1.id
+        SSH_HOST_KEYS.add(dbname, server_id, "ssh-ed25519", "much_key")
+        SSH_HOST_KEYS.add(dbname, server_id, "ssh-ed25519", "such_key")
+        # Key of another server is collected by another thread
+        SSH_HOST_KEYS.add(dbname, server_id + 1000, "ssh-ed25519", "wow_key")
+        self.server_test_1._save_ssh_host_keys()
+        self.assertEqual(
+            self.server_test_1.ssh_host_keys,
+            "ssh-ed25519 much_key",
+            "First received key must be saved",
+        )
+        self.assertFalse(
+            SSH_HOST_KEYS.pop(dbname, [server_id]), "Saved keys must be removed"
+        )
+        self.assertEqual(
+            SSH_HOST_KEYS.pop(dbname, [server_id + 1000]),
+            {server_id + 1000: {"ssh-ed25519": "wow_key"}},
+            "Keys of other servers must be kept",
+        )
+        self.assertEqual(
+            self.server_test_1._get_ssh_host_keys(),
+            {"ssh-ed25519": "much_key"},
+            "Saved key must be trusted",
+        )
+
+        # Clear host keys to accept a new key
+        self.server_test_1.ssh_host_keys = False
+        self.assertFalse(
+            self.server_test_1._get_ssh_host_keys(),
+            "Removed key must not be trusted",
+        )
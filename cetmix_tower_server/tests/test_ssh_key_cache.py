@@ -0,0 +1,85 @@
+import io
+from unittest.mock import patch
+
+from paramiko import RSAKey
+
+from ..models.cx_tower_server import SSH
+from ..models.ssh_key_cache import SSH_KEY_CACHE, SSHKeyCache
+from .common import TestTowerCommon
+
+
+class TestTowerSSHKeyCache(TestTowerCommon):
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        self.cache = SSHKeyCache(max_size=2)
+        self.loaded = []
+
+    def _load(self, key_class):
+        """Fake key loader. Returns a new object for each call"""
+        self.loaded.append(key_class)
+        return RSAKey.__new__(RSAKey)
+
+    def test_get(self):
+        """Test that parsed key is reused"""
+        pkey = self.cache.get(1, "much key", self._load)
+        self.assertIs(
+            self.cache.get(1, "much key", self._load),
+            pkey,
+            "Parsed key must be taken from the cache",
+        )
+        self.assertEqual(self.loaded, [None], "Key must be parsed once")
+
+        # Modified secret is parsed again using detected key type
+        new_pkey = self.cache.get(1, "new key", self._load)
+        self.assertIsNot(new_pkey, pkey, "Modified key must be parsed again")
+        self.assertEqual(
+            self.loaded, [None, RSAKey], "Detected key type must be tried first"
+        )
+
+    def test_invalidate(self):
+        """Test cache invalidation and size limit"""
+        pkey = self.cache.get(1, "much key", self._load)
+        self.cache.invalidate([1])
+        self.assertIsNot(
+            self.cache.get(1, "much key", self._load),
+            pkey,
+            "Invalidated key must be parsed again",
+        )
+
+        # Least recently used key is dropped
+        self.cache.get(2, "such key", self._load)
+        self.cache.get(3, "wow key", self._load)
+        self.cache.get(1, "much key", self._load)
+        self.assertEqual(len(self.loaded), 5, "Dropped key must be parsed again")
+
+    def test_ssh_get_ssh_key(self):
+        """Test that SSH client uses the cache"""
+        key_file = io.StringIO()
+        RSAKey.generate(1024).write_private_key(key_file)
+        ssh_key = key_file.getvalue()
+
+        def make_client():
+            return SSH(
+                "localhost", 22, "admin", ssh_key=ssh_key, mode="k", ssh_key_id=-1
+            )
+
+        try:
+            pkey = make_client()._get_ssh_key()
+            self.assertIsInstance(pkey, RSAKey, "Key must be parsed")
+            with patch.object(SSH, "_load_ssh_key") as load_ssh_key:
+                self.assertIs(
+                    make_client()._get_ssh_key(),
+                    pkey,
+                    "Parsed key must be taken from the cache",
+                )
+                load_ssh_key.assert_not_called()
+        finally:
+            SSH_KEY_CACHE.invalidate([-1])
+
+    def test_key_write_invalidates_cache(self):
+        """Test that parsed key is dropped when secret is modified"""
+        with patch.object(SSH_KEY_CACHE, "invalidate") as invalidate:
+            self.key_1.write({"name": "Such name"})
+            invalidate.assert_not_called()
+            self.key_1.write({"secret_value": "much new key"})
+            invalidate.assert_called_once_with(self.key_1.ids)
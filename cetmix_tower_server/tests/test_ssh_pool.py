@@ -0,0 +1,156 @@
+import threading
+from unittest.mock import patch
+
+from ..models.ssh_pool import SSH_POOL, SSHConnectionPool
+from .common import TestTowerCommon
+
+
+class FakeTransport:
+    def __init__(self):
+        self.active = True
+        self.probe_count = 0
+
+    def is_active(self):
+        return self.active
+
+    def send_ignore(self):
+        self.probe_count += 1
+        return True
+
+
+class FakeClient:
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.closed = False
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.closed = True
+        self.transport.active = False
+
+
+class TestTowerSSHPool(TestTowerCommon):
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        self.pool = SSHConnectionPool(idle_timeout=300, max_per_server=2, max_total=3)
+        self.key_1 = self.pool.make_key("localhost", 22, "admin", "p", "password")
+        self.key_2 = self.pool.make_key("localhost", 22, "admin", "p", "new_password")
+
+    def test_make_key(self):
+        """Test that auth fingerprint is a part of the pool key"""
+        self.assertNotEqual(self.key_1, self.key_2, "Keys must differ by password")
+        self.assertEqual(
+            self.key_1,
+            self.pool.make_key("localhost", "22", "admin", "p", "password"),
+            "Port must be converted to string",
+        )
+        self.assertNotIn("password", self.key_1, "Password must not be stored as is")
+
+    def test_acquire_release(self):
+        """Test that released connection is reused"""
+        client = self.pool.acquire(self.key_1, FakeClient)
+        self.pool.release(self.key_1, client)
+        self.assertFalse(client.closed, "Pooled connection must be kept open")
+        self.assertIs(
+            self.pool.acquire(self.key_1, FakeClient),
+            client,
+            "Released connection must be reused",
+        )
+
+        self.assertEqual(
+            client.transport.probe_count, 1, "Connection must be probed once"
+        )
+
+        # Connection in use is not shared
+        other_client = self.pool.acquire(self.key_1, FakeClient)
+        self.assertIsNot(other_client, client, "Used connection must not be shared")
+
+    def test_dead_connection(self):
+        """Test that broken connections are not reused"""
+        client = self.pool.acquire(self.key_1, FakeClient)
+        self.pool.release(self.key_1, client)
+        client.transport.active = False
+        new_client = self.pool.acquire(self.key_1, FakeClient)
+        self.assertIsNot(new_client, client, "Broken connection must not be reused")
+        self.assertTrue(client.closed, "Broken connection must be closed")
+
+    def test_limits(self):
+        """Test per server and per worker limits"""
+        clients = [self.pool.acquire(self.key_1, FakeClient) for __ in range(2)]
+
+        # Server limit: next request waits for a released connection
+        self.pool.configure(acquire_timeout=0)
+        with self.assertRaises(TimeoutError):
+            self.pool.acquire(self.key_1, FakeClient)
+        self.pool.configure(acquire_timeout=10)
+        timer = threading.Timer(0.1, self.pool.release, (self.key_1, clients[1]))
+        timer.start()
+        self.assertIs(
+            self.pool.acquire(self.key_1, FakeClient),
+            clients[1],
+            "Released connection must be handed out",
+        )
+        timer.join()
+        for client in clients:
+            self.pool.release(self.key_1, client)
+        self.assertFalse(clients[0].closed, "Pooled connection must be kept open")
+
+        # Worker limit: least recently used connection is evicted
+        client_2 = self.pool.acquire(self.key_2, FakeClient)
+        client_3 = self.pool.acquire(self.key_2, FakeClient)
+        self.assertTrue(
+            clients[0].closed, "Least recently used connection must be evicted"
+        )
+        self.assertFalse(clients[1].closed, "Pooled connection must be kept open")
+        self.pool.release(self.key_2, client_2)
+        self.pool.release(self.key_2, client_3)
+        self.assertFalse(client_3.closed, "Connection must be kept in the pool")
+
+    def test_idle_eviction(self):
+        """Test that idle connections are closed"""
+        client = self.pool.acquire(self.key_1, FakeClient)
+        self.pool.release(self.key_1, client)
+        self.pool.configure(idle_timeout=-1)
+        self.pool.evict_idle()
+        self.assertTrue(client.closed, "Idle connection must be closed")
+
+    def test_invalidate(self):
+        """Test connection invalidation"""
+        idle_client = self.pool.acquire(self.key_1, FakeClient)
+        used_client = self.pool.acquire(self.key_1, FakeClient)
+        self.pool.release(self.key_1, idle_client)
+
+        self.pool.invalidate([self.key_1])
+        self.assertTrue(idle_client.closed, "Idle connection must be closed")
+        self.assertFalse(used_client.closed, "Used connection must be kept open")
+        self.pool.release(self.key_1, used_client)
+        self.assertTrue(used_client.closed, "Stale connection must be closed")
+
+    def test_server_write_invalidates_pool(self):
+        """Test that pooled connections are dropped on SSH settings change"""
+        pool_keys = self.server_test_1._get_ssh_pool_keys()
+        with patch.object(SSH_POOL, "invalidate") as invalidate:
+            self.server_test_1.write({"note": "Such note"})
+            invalidate.assert_not_called()
+            self.server_test_1.write({"ssh_password": "much_password"})
+            invalidate.assert_called_once_with(pool_keys)
+
+    def test_server_pool_settings(self):
+        """Test that pool settings are not read on each connection"""
+        param_obj = self.registry["ir.config_parameter"]
+        self.Server._configure_ssh_pool()
+        with patch.object(
+            param_obj, "get_param", autospec=True, side_effect=param_obj.get_param
+        ) as get_param:
+            self.Server._configure_ssh_pool()
+            get_param.assert_not_called()
+
+        # Settings are read again once parameters are modified
+        with patch.object(SSH_POOL, "configure") as configure:
+            self.env["ir.config_parameter"].sudo().set_param(
+                "cetmix_tower_server.ssh_pool_max_total", 7
+            )
+            self.Server._configure_ssh_pool()
+            self.assertEqual(configure.call_args[1]["max_total"], 7)
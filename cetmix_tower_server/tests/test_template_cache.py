@@ -0,0 +1,45 @@
+from ..models.template_cache import TEMPLATE_CACHE, TemplateCache
+from .common import TestTowerCommon
+
+
+class TestTowerTemplateCache(TestTowerCommon):
+    def test_template_cache(self):
+        """Test that compiled templates are reused"""
+        cache = TemplateCache(max_size=2)
+        template = cache.get_template("echo {{ much }}")
+        self.assertIs(
+            cache.get_template("echo {{ much }}"),
+            template,
+            "Compiled template must be reused",
+        )
+        self.assertIsNot(
+            cache.get_template("echo {{ much }}", trim_blocks=False),
+            template,
+            "Render options must be a part of the cache key",
+        )
+        self.assertEqual(template.render({"much": "wow"}), "echo wow")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+        # Least recently used template is dropped
+        self.assertEqual(cache.get_variables("{{ such }} {{ much }}"), {"such", "much"})
+        self.assertEqual(cache.stats()["size"], 2, "Cache size must be limited")
+        self.assertIsNot(
+            cache.get_template("echo {{ much }}"),
+            template,
+            "Dropped template must be compiled again",
+        )
+
+    def test_render_code_custom(self):
+        """Test that template mixin uses the cache"""
+        TEMPLATE_CACHE.clear()
+        for __ in range(3):
+            self.assertEqual(
+                self.command_create_dir.render_code_custom(
+                    "mkdir {{ dir }}", dir="/opt/much"
+                ),
+                "mkdir /opt/much",
+            )
+        stats = self.Command.get_template_cache_stats()
+        self.assertEqual(stats["misses"], 1, "Template must be compiled once")
+        self.assertEqual(stats["hits"], 2, "Compiled template must be reused")
@@ -217,6 +217,23 @@ class TestTowerVariable(TestTowerCommon):
         )
         self.assertEqual(var_version, "10.0", msg="Variable 'version' must be '10.0'")
 
+    def test_variables_in_variable_values_cycle(self):
+        """Test that variables referencing each other are reported"""
+        with Form(self.server_test_1) as f:
+            with f.variable_value_ids.new() as line:
+                line.variable_id = self.variable_dir
+                line.value_char = "{{ test_url }}/web"
+            with f.variable_value_ids.new() as line:
+                line.variable_id = self.variable_path
+                line.value_char = "{{ test_dir }}/odoo"
+            with f.variable_value_ids.new() as line:
+                line.variable_id = self.variable_url
+                line.value_char = "{{ test_path_ }}/example.com"
+            f.save()
+
+        with self.assertRaisesRegex(ValidationError, "test_dir -> "):
+            self.server_test_1.get_variable_values(["test_dir"])
+
     def test_variable_values_unlink(self):
         """Ensure variable values are deleted properly
         - Create a new server
@@ -568,6 +585,35 @@ class TestTowerVariable(TestTowerCommon):
             "System variable doesn't match result provided by tools",
         )
 
+    def test_system_variable_lazy_values(self):
+        """Test that only system variable values used in template are computed"""
+        command = self.Command.create(
+            {"name": "Much command", "code": "echo {{ tower.server.ipv4 }}"}
+        )
+        server_class = self.registry["cx.tower.server"]
+        with patch.object(
+            server_class,
+            "_parse_system_variable_tools",
+            autospec=True,
+            side_effect=server_class._parse_system_variable_tools,
+        ) as mock_tools:
+            rendered_command = self.server_test_1._render_command(command)
+            mock_tools.assert_not_called()
+        self.assertEqual(
+            rendered_command["rendered_code"],
+            f"echo {self.server_test_1.ip_v4_address}",
+        )
+
+        # Values are computed once
+        tower = self.server_test_1._get_system_variable_value("tower")
+        self.assertEqual(tower["tools"]["uuid"], tower["tools"]["uuid"])
+
+        # Pythonic values are converted on access
+        pythonic_tower = self.Command._make_value_pythonic(tower)
+        self.assertEqual(
+            pythonic_tower["server"]["name"], f'"{self.server_test_1.name}"'
+        )
+
     def test_make_value_pythonic(self):
         """Test making variable values 'pythonic`"""
 
@@ -737,3 +783,168 @@ class TestTowerVariable(TestTowerCommon):
                     "server_id": server.id,
                 }
             )
+
+    def test_variable_values_multiple_records(self):
+        """Test getting variable values for several servers at once"""
+        server_test_2 = self.Server.create(
+            {
+                "name": "Test 2",
+                "ip_v4_address": "localhost",
+                "ssh_username": "admin",
+                "ssh_password": "password",
+                "ssh_auth_mode": "p",
+            }
+        )
+        much_var = self.Variable.create({"name": "much_var"})
+        such_var = self.Variable.create({"name": "such_var"})
+        self.VariableValue.create(
+            [
+                {
+                    "variable_id": much_var.id,
+                    "value_char": "much_1",
+                    "server_id": self.server_test_1.id,
+                },
+                {
+                    "variable_id": much_var.id,
+                    "value_char": "much_2",
+                    "server_id": server_test_2.id,
+                },
+                {"variable_id": such_var.id, "value_char": "such_global"},
+                {
+                    "variable_id": such_var.id,
+                    "value_char": "such_2",
+                    "server_id": server_test_2.id,
+                },
+            ]
+        )
+
+        servers = self.server_test_1 | server_test_2
+        res = servers.get_variable_values(["much_var", "such_var", "tower"])
+        self.assertEqual(res[self.server_test_1.id]["much_var"], "much_1")
+        self.assertEqual(res[server_test_2.id]["much_var"], "much_2")
+        self.assertEqual(
+            res[self.server_test_1.id]["such_var"],
+            "such_global",
+            "Global value must be used as a fallback",
+        )
+        self.assertEqual(res[server_test_2.id]["such_var"], "such_2")
+        for server in servers:
+            self.assertEqual(
+                res[server.id]["tower"]["server"]["name"],
+                server.name,
+                "System variable must be computed for each server",
+            )
+
+    def test_variable_values_snapshot(self):
+        """Test that server variable snapshot is reused until values change"""
+        much_var = self.Variable.create({"name": "much_var"})
+        such_var = self.Variable.create({"name": "such_var"})
+        much_value = self.VariableValue.create(
+            {
+                "variable_id": much_var.id,
+                "value_char": "much",
+                "server_id": self.server_test_1.id,
+            }
+        )
+        self.VariableValue.create(
+            {
+                "variable_id": such_var.id,
+                "value_char": "{{ tower.server.name }}",
+                "server_id": self.server_test_1.id,
+            }
+        )
+        references = ["much_var", "such_var", "tower"]
+        server_class = self.registry["cx.tower.server"]
+        render = server_class._render_variable_snapshot_values
+        with patch.object(
+            server_class,
+            "_render_variable_snapshot_values",
+            autospec=True,
+            side_effect=render,
+        ) as mock_render:
+            res = self.server_test_1.get_variable_values(references)
+            self.assertEqual(res[self.server_test_1.id]["much_var"], "much")
+            self.assertEqual(
+                res[self.server_test_1.id]["such_var"], self.server_test_1.name
+            )
+
+            # Values using system variables are always resolved
+            self.server_test_1.name = "Much Server"
+            res = self.server_test_1.get_variable_values(references)
+            self.assertEqual(
+                mock_render.call_args[0][1],
+                ["such_var", "tower"],
+                "Snapshot must be reused",
+            )
+            self.assertEqual(res[self.server_test_1.id]["much_var"], "much")
+            self.assertEqual(res[self.server_test_1.id]["such_var"], "Much Server")
+
+            # Modified value makes the snapshot outdated
+            version = self.server_test_1.variable_version
+            much_value.value_char = "such"
+            self.assertNotEqual(self.server_test_1.variable_version, version)
+            res = self.server_test_1.get_variable_values(references)
+            self.assertEqual(mock_render.call_args[0][1], references)
+            self.assertEqual(res[self.server_test_1.id]["much_var"], "such")
+
+            # Global values affect all servers without updating them
+            version = self.server_test_1.variable_version
+            global_version = self.Server._get_global_variable_version()
+            with patch.object(type(self.registry), "clear_caches") as mock_clear:
+                self.VariableValue.create(
+                    {"variable_id": such_var.id, "value_char": "g"}
+                )
+                mock_clear.assert_not_called()
+            self.assertEqual(self.server_test_1.variable_version, version)
+            self.assertNotEqual(
+                self.Server._get_global_variable_version(), global_version
+            )
+            self.server_test_1.get_variable_values(["much_var"])
+            self.assertEqual(
+                mock_render.call_args[0][1], ["much_var"], "Snapshot must be updated"
+            )
+
+    def test_variable_values_snapshot_bulk(self):
+        """Test that values of several servers are rendered at once
+        and unrelated broken values do not affect them
+        """
+        much_var = self.Variable.create({"name": "much_var"})
+        broken_var = self.Variable.create({"name": "broken_var"})
+        server_test_2 = self.server_test_1.copy({"name": "Such Server"})
+        self.VariableValue.create(
+            [
+                {"variable_id": much_var.id, "value_char": "much"},
+                {"variable_id": broken_var.id, "value_char": "{{ such.doge }}"},
+            ]
+        )
+        servers = self.server_test_1 | server_test_2
+        server_class = self.registry["cx.tower.server"]
+        render = server_class._render_variable_snapshot_values
+        with patch.object(
+            server_class,
+            "_render_variable_snapshot_values",
+            autospec=True,
+            side_effect=render,
+        ) as mock_render:
+            res = servers.get_variable_values(["much_var"])
+            self.assertEqual(mock_render.call_count, 1, "Must be a single call")
+            for server in servers:
+                self.assertEqual(res[server.id]["much_var"], "much")
+
+        # Modified value bumps server version once
+        value = self.VariableValue.create(
+            {
+                "variable_id": much_var.id,
+                "value_char": "such",
+                "server_id": self.server_test_1.id,
+            }
+        )
+        with patch.object(
+            server_class,
+            "_increase_variable_version",
+            autospec=True,
+            side_effect=server_class._increase_variable_version,
+        ) as mock_increase:
+            value.write({"server_id": server_test_2.id})
+            self.assertEqual(mock_increase.call_count, 1, "Version must be bumped once")
+            self.assertEqual(set(mock_increase.call_args[0][1]), set(servers.ids))
@@ -165,13 +165,25 @@ class CxTowerCommandExecuteWizard(models.TransientModel):
         )
         # Add custom values for log
         custom_values = {"log": {"label": log_label}}
-        for server in self.server_ids:
+        command_id = self.command_id.id
+        use_sudo = self.use_sudo
+
+        def execute_command(server):
             server.execute_command(
-                self.command_id,
-                sudo=self.use_sudo,
+                server.env["cx.tower.command"].browse(command_id),
+                sudo=use_sudo,
                 path=path_value,
                 **custom_values,
             )
+
+        results = self.server_ids._run_in_parallel(execute_command)
+        errors = [
+            f"[{server.name}]: {results[index]}"
+            for index, server in enumerate(self.server_ids)
+            if isinstance(results[index], Exception)
+        ]
+        if errors:
+            raise ValidationError("\n".join(errors))
         return {
             "type": "ir.actions.act_window",
             "name": _("Command Log"),
@@ -230,9 +242,12 @@ class CxTowerCommandExecuteWizard(models.TransientModel):
             raise ValidationError(_("Some servers don't support this command"))
 
         result = ""
+        action = self.action
+        rendered_code = self.rendered_code
+        path = self.path or None
+        use_sudo = self.use_sudo or None
 
-        for server in self.server_ids:
-            server_name = server.name
+        def execute_code(server):
             # Prepare key renderer values
             key_vals = {
                 "server_id": server.id,
@@ -240,18 +255,22 @@ class CxTowerCommandExecuteWizard(models.TransientModel):
             }
 
             kwargs = {"key": key_vals}
-            if self.action == "python_code":
-                command_result = server._execute_python_code(
-                    code=self.rendered_code, **kwargs
-                )
-            else:
-                command_result = server._execute_command_using_ssh(
-                    server._connect(raise_on_error=True),
-                    self.rendered_code,
-                    self.path or None,
-                    sudo=self.use_sudo if self.use_sudo else None,
-                    **kwargs,
-                )
+            if action == "python_code":
+                return server._execute_python_code(code=rendered_code, **kwargs)
+            return server._execute_command_using_ssh(
+                server._connect(raise_on_error=True),
+                rendered_code,
+                path,
+                sudo=use_sudo,
+                **kwargs,
+            )
+
+        command_results = self.server_ids._run_in_parallel(execute_code)
+        for index, server in enumerate(self.server_ids):
+            server_name = server.name
+            command_result = command_results[index]
+            if isinstance(command_result, Exception):
+                command_result = {"error": command_result, "response": None}
             command_error = command_result["error"]
             command_response = command_result["response"]
             if command_error:
@@ -38,6 +38,16 @@ class CxTowerPlanExecuteWizard(models.TransientModel):
     show_servers = fields.Boolean(
         compute="_compute_show_servers",
     )
+    max_parallel_servers = fields.Integer(
+        string="Servers at a Time",
+        default=1,
+        help="Number of servers the Flight Plan is executed on at the same time",
+    )
+    max_failed_servers = fields.Integer(
+        string="Stop After Failures",
+        help="Do not start the Flight Plan on the remaining servers "
+        "after it fails on this number of servers. Leave 0 to never stop.",
+    )
 
     @api.depends("server_ids")
     def _compute_show_servers(self):
@@ -81,6 +91,21 @@ class CxTowerPlanExecuteWizard(models.TransientModel):
             plan_label = generate_random_id(4)
             # Add custom values for log
             custom_values = {"plan_log": {"label": plan_label}}
+            if len(self.server_ids) > 1:
+                fleet_log = self.plan_id.execute_fleet(
+                    self.server_ids,
+                    max_parallel_servers=self.max_parallel_servers,
+                    max_failed_servers=self.max_failed_servers,
+                    **custom_values,
+                )
+                return {
+                    "type": "ir.actions.act_window",
+                    "name": _("Fleet Log"),
+                    "res_model": "cx.tower.plan.fleet.log",
+                    "res_id": fleet_log.id,
+                    "view_mode": "form",
+                    "target": "current",
+                }
             self.plan_id.execute(self.server_ids, **custom_values)
             return {
                 "type": "ir.actions.act_window",
@@ -20,13 +20,14 @@ class CxTowerServer(models.Model):
         # this plan should be launched as a synchronous command to
         # preserve the order of execution of commands with action “Run flight plan”.
         # Use runner only if command log record is provided.
+        # SSH connection cannot be passed to a job so the job opens its own one.
         if log_record and not log_record.plan_log_id.parent_flight_plan_log_id:
             self.with_delay()._command_runner(
                 command,
                 log_record,
                 rendered_command_code,
                 rendered_command_path,
-                ssh_connection,
+                None,
                 **kwargs,
             )
 